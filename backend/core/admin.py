@@ -3,9 +3,23 @@ from .models import User
 from .models import GlobalKnowledgeDocument
 from .models import PersonalKnowledgeDocument
 from .models import Conversation, Message
+from .models import SemanticCacheEntry, SemanticCacheStat
+from .models import UsageRecord, UsageRollup, UserActivityStats, ConversationArchive
 
 admin.site.register(User)
 admin.site.register(GlobalKnowledgeDocument)
-admin.site.register(PersonalKnowledgeDocument)
-admin.site.register(Conversation)
 admin.site.register(Message)
+
+@admin.register(PersonalKnowledgeDocument)
+class PersonalKnowledgeDocumentAdmin(admin.ModelAdmin):
+    list_select_related = ('owner',)
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_select_related = ('user',)
+admin.site.register(SemanticCacheEntry)
+admin.site.register(SemanticCacheStat)
+admin.site.register(UsageRecord)
+admin.site.register(UsageRollup)
+admin.site.register(UserActivityStats)
+admin.site.register(ConversationArchive)
@@ -0,0 +1,134 @@
+import os
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from .services.tracing import current_span
+
+# Referenced from settings.LOGGING. Records are only enqueued on the request thread;
+# merging immutable args, truncation, JSON encoding and file I/O happen on the listener thread.
+LOG_MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', '500'))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv('LOG_MAX_MESSAGE_CHARS', '4000'))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1.0'))
+
+_IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+def truncate(value: str, limit: int) -> str:
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}... [{len(value) - limit} more chars]"
+
+def _clip(value):
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return truncate(str(value), LOG_MAX_FIELD_CHARS)
+
+def merge_args(record: logging.LogRecord) -> str:
+    """record.getMessage() with every argument truncated."""
+    message = str(record.msg)
+    if record.args:
+        if isinstance(record.args, dict) and '%(' not in message:
+            args = (_clip(record.args),)  # a lone dict logged with %s
+        elif isinstance(record.args, dict):
+            args = {k: _clip(v) for k, v in record.args.items()}
+        else:
+            args = tuple(_clip(a) for a in record.args)
+        try:
+            message = message % args
+        except (TypeError, ValueError):
+            message = record.getMessage()
+    return message
+
+def render_message(record: logging.LogRecord) -> str:
+    """merge_args, then the whole message truncated."""
+    return truncate(merge_args(record), LOG_MAX_MESSAGE_CHARS)
+
+class SamplingFilter(logging.Filter):
+    """
+    Runs on the logging thread before the record is queued: keeps LOG_DEBUG_SAMPLE_RATE
+    of DEBUG records and stamps the current trace and span ids, which the listener
+    thread could not see.
+    """
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and LOG_DEBUG_SAMPLE_RATE < 1.0 and random.random() >= LOG_DEBUG_SAMPLE_RATE:
+            return False
+        span = current_span()
+        if span is not None:
+            record.trace_id = span.trace_id
+            record.span_id = span.span_id
+        return True
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record; `extra=` fields become top-level keys."""
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': render_message(record),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = _clip(value)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """The classic `asctime level name message` line, with the same truncation as JSON."""
+    def __init__(self, fmt='%(asctime)s %(levelname)s %(name)s %(message)s', **kwargs):
+        super().__init__(fmt, **kwargs)
+
+    def formatMessage(self, record):
+        record.message = render_message(record)
+        return super().formatMessage(record)
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a QueueListener that owns the rotating file handler and, when
+    enabled, a console handler. The queue is bounded; when the listener falls behind,
+    records are dropped and counted rather than blocking requests.
+    """
+    def __init__(self, log_file: str = None, console: bool = False, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, queue_size: int = 10000):
+        super().__init__(queue.Queue(queue_size))
+        self.targets = [logging.StreamHandler()] if console else []
+        if log_file:
+            os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+            self.targets.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count))
+        self.dropped = 0
+        self.listener = logging.handlers.QueueListener(self.queue, *self.targets)
+        self.listener.start()
+        self._stopped = False
+        atexit.register(self.stop)
+
+    def setFormatter(self, fmt):
+        for target in self.targets:
+            target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Formatting is the listener's job, but a dict or list logged as an argument may
+        # change before the listener gets to it: merge such arguments now
+        args = record.args.values() if isinstance(record.args, dict) else record.args or ()
+        if not all(isinstance(a, _IMMUTABLE_ARGS) for a in args):
+            record.msg, record.args = merge_args(record), None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Drain the queue and stop the listener thread (at exit, or when the handler closes)."""
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+
+    def close(self):
+        self.stop()
+        super().close()
@@ -0,0 +1,31 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from django.utils import timezone
+from core.models import SemanticCacheEntry, SemanticCacheStat
+
+
+class Command(BaseCommand):
+    help = "Report semantic answer cache hit rate and completion latency saved per day."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7)
+
+    def handle(self, *args, **options):
+        since = timezone.localdate() - timedelta(days=options['days'] - 1)
+        self.stdout.write(f"{'date':<12}{'lookups':>9}{'global':>8}{'personal':>10}{'hit rate':>10}{'saved s':>10}")
+        totals = {'lookups': 0, 'hits': 0, 'saved': 0.0}
+        for stat in SemanticCacheStat.objects.filter(date__gte=since).order_by('date'):
+            hits = stat.global_hits + stat.personal_hits
+            rate = hits / stat.lookups if stat.lookups else 0.0
+            self.stdout.write(
+                f"{stat.date.isoformat():<12}{stat.lookups:>9}{stat.global_hits:>8}{stat.personal_hits:>10}"
+                f"{rate:>10.1%}{stat.latency_saved_ms / 1000:>10.1f}"
+            )
+            totals['lookups'] += stat.lookups
+            totals['hits'] += hits
+            totals['saved'] += stat.latency_saved_ms / 1000
+        rate = totals['hits'] / totals['lookups'] if totals['lookups'] else 0.0
+        self.stdout.write(f"total: {totals['hits']}/{totals['lookups']} hits ({rate:.1%}), {totals['saved']:.1f}s of generation saved")
+        for row in SemanticCacheEntry.objects.values('scope').annotate(entries=Count('id'), hits=Sum('hits')).order_by('-hits')[:10]:
+            self.stdout.write(f"  {row['scope']:<16}{row['entries']:>6} entries {row['hits'] or 0:>6} hits")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from core.services.archive import ARCHIVE_IDLE_DAYS, archive_idle, idle_conversations
+
+
+class Command(BaseCommand):
+    help = "Move conversations idle for --idle-days into the compressed archive. Run from cron; they are restored on access."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, default=ARCHIVE_IDLE_DAYS)
+        parser.add_argument('--limit', type=int, default=None, help='Archive at most this many conversations.')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            idle = idle_conversations(options['idle_days']).count()
+            self.stdout.write(f"{idle} conversations idle for more than {options['idle_days']} days")
+            return
+        archived = archive_idle(options['idle_days'], limit=options['limit'])
+        self.stdout.write(f"Archived {archived} conversations idle for more than {options['idle_days']} days")
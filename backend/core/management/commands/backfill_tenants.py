@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.services import qdrant_client
+from core.services.vector_store import VECTOR_STORE_BACKEND
+
+
+class Command(BaseCommand):
+    help = (
+        "Prepare tenant collections (personal_kb, chat_memory) that existed before tenant "
+        "partitioning: create the tenant_id index and set tenant_id on existing points from "
+        "their user_id, so tenant-filtered searches find them. Safe to re-run; run it once "
+        "after deploying, before serving traffic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collection', action='append', help='Only this collection (repeatable).')
+        parser.add_argument('--batch-size', type=int, default=256)
+
+    def handle(self, *args, **options):
+        if VECTOR_STORE_BACKEND != 'qdrant':
+            self.stdout.write("The local vector store partitions by user_id itself; nothing to do")
+            return
+        collections = options['collection'] or sorted(qdrant_client.TENANT_COLLECTIONS)
+        for collection in collections:
+            try:
+                counts = qdrant_client.backfill_tenants(collection, batch_size=options['batch_size'])
+            except (ValueError, RuntimeError) as e:
+                raise CommandError(str(e))
+            self.stdout.write(f"{collection}: tenant_id set on {counts['updated']} points, {counts['skipped']} without user_id left as they are")
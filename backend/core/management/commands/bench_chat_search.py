@@ -0,0 +1,92 @@
+import time
+import statistics
+import numpy as np
+from django.core.management.base import BaseCommand
+from core.models import User, Conversation, Message
+from core.services.chat_search import search_messages
+
+# The most frequent words; the rest of the vocabulary is synthetic. Word frequencies follow
+# a Zipf law as in natural text, so a few words are in most messages and most words are rare.
+COMMON_WORDS = (
+    "tour venue guarantee setlist merch label contract royalty streaming playlist release single album "
+    "booking promoter festival rider soundcheck budget marketing radio sync licensing publishing manager "
+    "press interview video shoot crowdfunding fans newsletter pitch advance masters distribution vinyl"
+).split()
+
+def synthetic_words(rng, n):
+    """Random lowercase words of 4-10 letters, so prefix queries expand to a few terms as with real words."""
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    return list({''.join(rng.choice(letters, size=int(rng.integers(4, 11)))) for _ in range(max(n, 0))})
+
+def zipf_words(rng, vocabulary, shape):
+    ranks = rng.zipf(1.2, size=shape) - 1
+    return vocabulary[np.minimum(ranks, len(vocabulary) - 1)]
+
+
+class Command(BaseCommand):
+    help = "Seed synthetic chat history and measure full-text chat search against an icontains scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--messages-per-conversation', type=int, default=40)
+        parser.add_argument('--words', type=int, default=30, help='Words per message.')
+        parser.add_argument('--vocabulary', type=int, default=20000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--skip-scan', action='store_true', help='Skip the icontains baseline, which is slow at millions of messages.')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded users and messages afterwards.')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        vocabulary = np.array(COMMON_WORDS + synthetic_words(rng, options['vocabulary'] - len(COMMON_WORDS)))
+        users = [
+            User.objects.create_user(username=f"bench_search_{i}", email=f"bench_search_{i}@example.invalid", password=None)
+            for i in range(options['users'])
+        ]
+        try:
+            self._seed(users, rng, vocabulary, options)
+            self.stdout.write(f"messages={options['messages']} users={options['users']} queries={options['queries']}")
+            self.stdout.write(f"{'method':<12}{'p50 ms':>10}{'p99 ms':>10}{'mean hits':>11}")
+            methods = [('fts', self._fts)] + ([] if options['skip_scan'] else [('icontains', self._scan)])
+            for name, method in methods:
+                latencies, hits = [], []
+                for _ in range(options['queries']):
+                    user = users[int(rng.integers(0, len(users)))]
+                    query = ' '.join(zipf_words(rng, vocabulary, 2))
+                    started = time.perf_counter()
+                    hits.append(method(user.id, query))
+                    latencies.append((time.perf_counter() - started) * 1000)
+                latencies.sort()
+                self.stdout.write(
+                    f"{name:<12}{statistics.median(latencies):>10.2f}{latencies[int(len(latencies) * 0.99) - 1]:>10.2f}"
+                    f"{statistics.mean(hits):>11.1f}"
+                )
+        finally:
+            if not options['keep']:
+                User.objects.filter(id__in=[u.id for u in users]).delete()
+
+    def _seed(self, users, rng, vocabulary, options):
+        per_conversation = options['messages_per_conversation']
+        conversations = Conversation.objects.bulk_create([
+            Conversation(user=users[i % len(users)], title=f"Bench {i}")
+            for i in range(max(options['messages'] // per_conversation, 1))
+        ], batch_size=options['batch_size'])
+        for start in range(0, options['messages'], options['batch_size']):
+            count = min(options['batch_size'], options['messages'] - start)
+            words = zipf_words(rng, vocabulary, (count, options['words']))
+            Message.objects.bulk_create([
+                Message(conversation=conversations[(start + i) // per_conversation % len(conversations)],
+                        sender='user' if i % 2 else 'ai', text=' '.join(words[i]))
+                for i in range(count)
+            ], batch_size=options['batch_size'])
+
+    def _fts(self, user_id, query):
+        return len(search_messages(user_id, query, page_size=20)['results'])
+
+    def _scan(self, user_id, query):
+        messages = Message.objects.filter(conversation__user_id=user_id)
+        for word in query.split():
+            messages = messages.filter(text__icontains=word)
+        return len(messages.order_by('-id')[:20])
@@ -0,0 +1,68 @@
+import os
+import time
+import logging
+import tempfile
+import statistics
+from logging.handlers import RotatingFileHandler
+from django.core.management.base import BaseCommand
+from core.logging_config import AsyncQueueHandler, JSONFormatter, SamplingFilter
+
+
+def chat_turn_logging(logger, query, context, messages, lazy):
+    """The log calls of one chat turn, in the old eager f-string style or the lazy style."""
+    if lazy:
+        logger.info("Generating response for user_id=%s (%d chars)", 7, len(query))
+        logger.debug("User message: %s", query)
+        logger.info("Retrieving context for user_id=%s intent=%s top_k=%s", 7, 'hybrid', 3)
+        logger.info("Retrieved %s global KB candidates.", 10)
+        logger.info("Retrieved %s personal KB candidates.", 10)
+        logger.debug("Context retrieved: %s", context)
+        logger.debug("Messages sent to LLM: %s", messages)
+        logger.info("LLM response received for user_id=%s", 7)
+    else:
+        logger.info(f"Generating response for user_id={7} | user_message='{query}'")
+        logger.info(f"Retrieving context for query: {query}, user_id: {7}, intent: hybrid, top_k: {3}")
+        logger.info(f"Retrieved {10} global KB candidates.")
+        logger.info(f"Retrieved {10} personal KB candidates.")
+        logger.debug(f"Context retrieved: {context}")
+        logger.debug(f"Messages sent to LLM: {messages}")
+        logger.info(f"LLM response received for user_id={7}")
+
+
+class Command(BaseCommand):
+    help = "Measure request-thread logging overhead per chat turn: synchronous file handler with eager f-strings vs the async JSON queue handler."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--turns', type=int, default=2000)
+        parser.add_argument('--context-chars', type=int, default=6000, help='Size of the logged context and prompt payloads.')
+        parser.add_argument('--level', default='INFO', choices=['DEBUG', 'INFO'])
+
+    def handle(self, *args, **options):
+        query = "How should I plan my release schedule around the festival season?"
+        context = {'global': ['x' * (options['context_chars'] // 2)], 'personal': ['y' * (options['context_chars'] // 2)]}
+        messages = [{'role': 'system', 'content': 'z' * options['context_chars']}, {'role': 'user', 'content': query}]
+        level = getattr(logging, options['level'])
+        self.stdout.write(f"turns={options['turns']} level={options['level']} payload={options['context_chars']} chars")
+        self.stdout.write(f"{'setup':<28}{'mean us':>10}{'p99 us':>10}")
+        with tempfile.TemporaryDirectory() as tmp:
+            sync_handler = RotatingFileHandler(os.path.join(tmp, 'sync.log'), maxBytes=50 * 1024 * 1024)
+            sync_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+            async_handler = AsyncQueueHandler(log_file=os.path.join(tmp, 'async.log'), console=False, max_bytes=50 * 1024 * 1024)
+            async_handler.setFormatter(JSONFormatter())
+            async_handler.addFilter(SamplingFilter())
+            for name, handler, lazy in [('sync file, f-strings', sync_handler, False), ('async queue, lazy', async_handler, True)]:
+                logger = logging.getLogger(f"bench_logging.{name}")
+                logger.handlers = [handler]
+                logger.propagate = False
+                logger.setLevel(level)
+                timings = []
+                for _ in range(options['turns']):
+                    started = time.perf_counter()
+                    chat_turn_logging(logger, query, context, messages, lazy)
+                    timings.append((time.perf_counter() - started) * 1e6)
+                timings.sort()
+                self.stdout.write(f"{name:<28}{statistics.mean(timings):>10.1f}{timings[int(len(timings) * 0.99) - 1]:>10.1f}")
+            async_handler.close()
+            sync_handler.close()
+            if async_handler.dropped:
+                self.stdout.write(f"async handler dropped {async_handler.dropped} records (queue full)")
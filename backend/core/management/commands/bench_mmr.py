@@ -0,0 +1,54 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from core.services.mmr import mmr_select
+
+
+def naive_mmr(query, vectors, k, lambda_mult):
+    """Reference loop-based MMR, recomputing similarities every step."""
+    def cos(a, b):
+        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+    picked, remaining = [], list(range(len(vectors)))
+    while remaining and len(picked) < k:
+        best, best_score = None, -np.inf
+        for i in remaining:
+            redundancy = max((cos(vectors[i], vectors[j]) for j in picked), default=0.0)
+            score = lambda_mult * cos(vectors[i], query) - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        picked.append(best)
+        remaining.remove(best)
+    return picked
+
+
+class Command(BaseCommand):
+    help = "Benchmark vectorised MMR selection for growing candidate sets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='25,50,100,200,400')
+        parser.add_argument('--dim', type=int, default=1536)
+        parser.add_argument('--k', type=int, default=6)
+        parser.add_argument('--repeats', type=int, default=20)
+        parser.add_argument('--naive-max', type=int, default=200, help='Skip the loop baseline above this size.')
+        parser.add_argument('--seed', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        dim, k = options['dim'], options['k']
+        self.stdout.write(f"dim={dim} k={k} repeats={options['repeats']}")
+        self.stdout.write(f"{'candidates':>10}{'mmr p50 ms':>12}{'mmr p99 ms':>12}{'loop ms':>10}")
+        for n in [int(x) for x in options['sizes'].split(',')]:
+            query = rng.standard_normal(dim).astype(np.float32)
+            vectors = rng.standard_normal((n, dim)).astype(np.float32)
+            tokens = rng.integers(100, 512, size=n)
+            timings = []
+            for _ in range(options['repeats']):
+                started = time.perf_counter()
+                mmr_select(query, vectors, token_counts=tokens, token_budget=1500, k=k)
+                timings.append((time.perf_counter() - started) * 1000)
+            naive = '-'
+            if n <= options['naive_max']:
+                started = time.perf_counter()
+                naive_mmr(query, vectors, k, 0.7)
+                naive = f"{(time.perf_counter() - started) * 1000:.1f}"
+            self.stdout.write(f"{n:>10}{np.percentile(timings, 50):>12.2f}{np.percentile(timings, 99):>12.2f}{naive:>10}")
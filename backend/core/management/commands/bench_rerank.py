@@ -0,0 +1,51 @@
+import time
+import random
+import numpy as np
+from django.core.management.base import BaseCommand
+from core.services.reranker import CrossEncoderReranker, RERANK_MODEL
+
+WORDS = (
+    "release tour playlist pitch label contract royalties streaming fans merch single album "
+    "producer publicist booking venue budget campaign social video radio sync licensing "
+    "distribution audience growth brand collaboration festival press interview schedule"
+).split()
+
+
+def synthetic_passage(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+class Command(BaseCommand):
+    help = "Measure cross-encoder rerank latency per batch size on CPU."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=RERANK_MODEL)
+        parser.add_argument('--batch-sizes', default='1,4,8,16,32')
+        parser.add_argument('--candidates', type=int, default=30)
+        parser.add_argument('--passage-words', type=int, default=300, help='Roughly a 512-token chunk at the default.')
+        parser.add_argument('--repeats', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=3)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        query = "How should I plan my next single release and playlist pitching?"
+        passages = [synthetic_passage(rng, options['passage_words']) for _ in range(options['candidates'])]
+        reranker = CrossEncoderReranker(model_name=options['model'])
+        reranker.score_batch(query, passages[:2])  # load weights and warm up outside the timings
+
+        self.stdout.write(f"model={options['model']} candidates={len(passages)} words/passage={options['passage_words']}")
+        self.stdout.write(f"{'batch':>6}{'ms/batch p50':>14}{'ms/pair':>10}{'ms total p50':>14}{'ms total p99':>14}")
+        for batch_size in [int(b) for b in options['batch_sizes'].split(',')]:
+            batch_ms, totals = [], []
+            for _ in range(options['repeats']):
+                started = time.perf_counter()
+                for start in range(0, len(passages), batch_size):
+                    batch_started = time.perf_counter()
+                    reranker.score_batch(query, passages[start:start + batch_size])
+                    batch_ms.append((time.perf_counter() - batch_started) * 1000)
+                totals.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f"{batch_size:>6}{np.percentile(batch_ms, 50):>14.1f}"
+                f"{np.percentile(batch_ms, 50) / batch_size:>10.2f}"
+                f"{np.percentile(totals, 50):>14.1f}{np.percentile(totals, 99):>14.1f}"
+            )
@@ -0,0 +1,65 @@
+import time
+import requests
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from core.services.qdrant_client import (
+    TENANT_MODES, QDRANT_URL, HEADERS, ensure_collection, upsert_vectors, search_vectors,
+)
+from .bench_vector_profiles import synthetic_corpus, wait_until_indexed
+
+
+class Command(BaseCommand):
+    help = "Benchmark tenant-partitioned search latency as the number of tenants grows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default=','.join(TENANT_MODES), help='Comma-separated tenant modes.')
+        parser.add_argument('--tenants', default='100,1000,10000,100000', help='Comma-separated tenant counts.')
+        parser.add_argument('--points-per-tenant', type=int, default=10)
+        parser.add_argument('--dim', type=int, default=128)
+        parser.add_argument('--queries', type=int, default=300)
+        parser.add_argument('--k', type=int, default=3)
+        parser.add_argument('--batch-size', type=int, default=1024)
+        parser.add_argument('--seed', type=int, default=11)
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark collections afterwards.')
+
+    def handle(self, *args, **options):
+        modes = [m.strip() for m in options['modes'].split(',') if m.strip()]
+        unknown = [m for m in modes if m not in TENANT_MODES]
+        if unknown:
+            raise CommandError(f"Unknown tenant modes: {', '.join(unknown)}")
+        tenant_counts = [int(t) for t in options['tenants'].split(',')]
+        per_tenant, dim, k = options['points_per_tenant'], options['dim'], options['k']
+        rng = np.random.default_rng(options['seed'])
+
+        self.stdout.write(f"points/tenant={per_tenant} dim={dim} queries={options['queries']} k={k}")
+        self.stdout.write(f"{'mode':<10}{'tenants':>10}{'points':>12}{'p50 ms':>10}{'p99 ms':>10}{'leaks':>8}")
+        for mode in modes:
+            for tenants in tenant_counts:
+                n = tenants * per_tenant
+                collection = f"bench_tenants_{mode}_{tenants}"
+                requests.delete(f"{QDRANT_URL}/collections/{collection}", headers=HEADERS)
+                ensure_collection(collection, vector_size=dim, tenant_mode=mode)
+                for start in range(0, n, options['batch_size']):
+                    batch = synthetic_corpus(min(options['batch_size'], n - start), dim, 32, options['seed'] + start)
+                    upsert_vectors([
+                        {'id': start + i, 'embedding': vec.tolist(), 'chunk': '',
+                         'metadata': {'user_id': (start + i) % tenants}}
+                        for i, vec in enumerate(batch)
+                    ], collection=collection, tenant_mode=mode)
+                wait_until_indexed(collection, n)
+
+                queries = synthetic_corpus(options['queries'], dim, 32, options['seed'] - 1)
+                latencies, leaks = [], 0
+                for query in queries:
+                    user_id = int(rng.integers(0, tenants))
+                    started = time.perf_counter()
+                    result = search_vectors(query.tolist(), collection=collection, top=k, user_id=user_id, tenant_mode=mode)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    leaks += sum(1 for r in result.get('result', []) if r['payload'].get('user_id') != user_id)
+
+                self.stdout.write(
+                    f"{mode:<10}{tenants:>10}{n:>12}"
+                    f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 99):>10.2f}{leaks:>8}"
+                )
+                if not options['keep']:
+                    requests.delete(f"{QDRANT_URL}/collections/{collection}", headers=HEADERS)
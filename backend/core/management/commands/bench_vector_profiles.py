@@ -0,0 +1,112 @@
+import time
+import requests
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from core.services.qdrant_client import (
+    COLLECTION_PROFILES, QDRANT_URL, HEADERS, ensure_collection, upsert_vectors, search_vectors,
+)
+
+
+def synthetic_corpus(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Clustered, L2-normalised float32 vectors, closer to real embeddings than pure noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def estimated_ram_bytes(profile: str, n: int, dim: int) -> int:
+    """Vector storage kept in RAM for a profile (HNSW links excluded, they are identical across profiles)."""
+    settings = COLLECTION_PROFILES[profile]
+    quantization = settings.get('quantization_config', {})
+    originals = 0 if settings.get('on_disk') else n * dim * 4
+    if 'scalar' in quantization:
+        return originals + n * dim
+    if 'binary' in quantization:
+        return originals + n * dim // 8
+    return originals
+
+
+def resident_memory_bytes():
+    """Qdrant process RSS as reported by its Prometheus endpoint, or None if unavailable."""
+    try:
+        r = requests.get(f"{QDRANT_URL}/metrics", headers=HEADERS, timeout=5)
+        r.raise_for_status()
+    except Exception:
+        return None
+    for line in r.text.splitlines():
+        if line.startswith('memory_resident_bytes'):
+            return int(float(line.split()[-1]))
+    return None
+
+
+def wait_until_indexed(collection: str, n: int, timeout: float = 600.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        info = requests.get(f"{QDRANT_URL}/collections/{collection}", headers=HEADERS).json()['result']
+        if info.get('status') == 'green' and info.get('points_count', 0) >= n:
+            return info
+        time.sleep(0.5)
+    raise CommandError(f"Collection {collection} was not indexed within {timeout:.0f}s")
+
+
+class Command(BaseCommand):
+    help = "Benchmark Qdrant collection profiles: recall@k, latency percentiles and RAM on a synthetic corpus."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default=','.join(COLLECTION_PROFILES), help='Comma-separated profile names.')
+        parser.add_argument('--points', type=int, default=20000)
+        parser.add_argument('--dim', type=int, default=1536)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--clusters', type=int, default=64)
+        parser.add_argument('--batch-size', type=int, default=256)
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark collections afterwards.')
+
+    def handle(self, *args, **options):
+        profiles = [p.strip() for p in options['profiles'].split(',') if p.strip()]
+        unknown = [p for p in profiles if p not in COLLECTION_PROFILES]
+        if unknown:
+            raise CommandError(f"Unknown profiles: {', '.join(unknown)}")
+        n, dim, k = options['points'], options['dim'], options['k']
+
+        corpus = synthetic_corpus(n, dim, options['clusters'], options['seed'])
+        queries = synthetic_corpus(options['queries'], dim, options['clusters'], options['seed'] + 1)
+        # Exact cosine top-k is the ground truth every profile is measured against
+        scores = queries @ corpus.T
+        truth = np.argpartition(-scores, k, axis=1)[:, :k]
+
+        self.stdout.write(f"corpus={n} dim={dim} queries={len(queries)} k={k}")
+        self.stdout.write(f"{'profile':<16}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'est RAM MiB':>13}{'RSS delta MiB':>15}")
+        for profile in profiles:
+            collection = f"bench_{profile}_{n}_{dim}"
+            requests.delete(f"{QDRANT_URL}/collections/{collection}", headers=HEADERS)
+            rss_before = resident_memory_bytes()
+            ensure_collection(collection, vector_size=dim, profile=profile)
+            for start in range(0, n, options['batch_size']):
+                batch = corpus[start:start + options['batch_size']]
+                upsert_vectors([
+                    {'id': start + i, 'embedding': vec.tolist(), 'chunk': '', 'metadata': {}}
+                    for i, vec in enumerate(batch)
+                ], collection=collection)
+            wait_until_indexed(collection, n)
+            rss_after = resident_memory_bytes()
+
+            latencies, hits = [], 0
+            for qi, query in enumerate(queries):
+                started = time.perf_counter()
+                result = search_vectors(query.tolist(), collection=collection, top=k, profile=profile)
+                latencies.append((time.perf_counter() - started) * 1000)
+                found = {r['id'] for r in result.get('result', [])}
+                hits += len(found.intersection(truth[qi].tolist()))
+
+            rss_delta = '-' if rss_before is None or rss_after is None else f"{(rss_after - rss_before) / 2**20:.1f}"
+            self.stdout.write(
+                f"{profile:<16}{hits / (k * len(queries)):>10.3f}"
+                f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 99):>10.2f}"
+                f"{estimated_ram_bytes(profile, n, dim) / 2**20:>13.1f}{rss_delta:>15}"
+            )
+            if not options['keep']:
+                requests.delete(f"{QDRANT_URL}/collections/{collection}", headers=HEADERS)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from core.models import ConversationArchive, Message
+from core.services.memory import CHAT_MEMORY_BATCH_SIZE, index_exchanges, load_archived_exchanges, upsert_exchanges
+
+
+class Command(BaseCommand):
+    help = (
+        "Embed past chat exchanges into the chat_memory collection. New replies are indexed in the "
+        "background; run this once to backfill, or after workers died with replies still queued. "
+        "Re-indexing an exchange replaces its point. Archived conversations are read from their archives."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, default=None, help='Only this user id.')
+        parser.add_argument('--after-id', type=int, default=0, help='Only AI replies with a larger message id.')
+        parser.add_argument('--batch-size', type=int, default=CHAT_MEMORY_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        replies = Message.objects.filter(sender='ai', id__gt=options['after_id'])
+        archives = ConversationArchive.objects.select_related('conversation').order_by('conversation_id')
+        if options['user'] is not None:
+            replies = replies.filter(conversation__user_id=options['user'])
+            archives = archives.filter(conversation__user_id=options['user'])
+        ids = list(replies.order_by('id').values_list('id', flat=True))
+        indexed = 0
+        for start in range(0, len(ids), options['batch_size']):
+            batch = ids[start:start + options['batch_size']]
+            indexed += index_exchanges(batch)
+            self.stdout.write(f"Indexed {indexed} exchanges (through message {batch[-1]})")
+        self.stdout.write(f"Done: {indexed} of {len(ids)} replies indexed")
+        archived = 0
+        for archive in archives.iterator():
+            archived += upsert_exchanges(load_archived_exchanges(archive, after_id=options['after_id']))
+        if archived:
+            self.stdout.write(f"Indexed {archived} exchanges from archived conversations")
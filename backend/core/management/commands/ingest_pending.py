@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from core.models import INGEST_PENDING_STATUSES
+from core.services.ingest_queue import DOCUMENT_MODELS, ingest
+
+
+class Command(BaseCommand):
+    help = (
+        "Ingest knowledge documents left queued or half-ingested, e.g. after the process running "
+        "the background ingestion workers restarted. Runs in the foreground, one document at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed', action='store_true', help='Also retry documents whose ingestion failed.')
+
+    def handle(self, *args, **options):
+        statuses = INGEST_PENDING_STATUSES + (('failed',) if options['failed'] else ())
+        for kind, model in DOCUMENT_MODELS.items():
+            ids = list(model.objects.filter(ingest_status__in=statuses).order_by('id').values_list('id', flat=True))
+            for doc_id in ids:
+                chunks = ingest(kind, doc_id)
+                status = model.objects.filter(id=doc_id).values_list('ingest_status', flat=True).first()
+                self.stdout.write(f"{kind} document {doc_id}: {status}, {chunks} chunks")
+            self.stdout.write(f"Done: {len(ids)} {kind} documents")
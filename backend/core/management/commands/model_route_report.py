@@ -0,0 +1,34 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.utils import timezone
+from core.models import UsageRollup
+
+
+class Command(BaseCommand):
+    help = "Report chat completions per route and model: calls, mean latency, tokens and cost."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7)
+        parser.add_argument('--stage', default='generate')
+
+    def handle(self, *args, **options):
+        since = timezone.localdate() - timedelta(days=options['days'] - 1)
+        rows = (
+            UsageRollup.objects.filter(date__gte=since, stage=options['stage'])
+            .values('route', 'model')
+            .annotate(
+                calls=Sum('calls'), latency=Sum('latency_ms'), prompt=Sum('prompt_tokens'),
+                completion=Sum('completion_tokens'), cost=Sum('cost_usd'),
+            )
+            .order_by('route', 'model')
+        )
+        self.stdout.write(f"{'route':<8}{'model':<24}{'calls':>7}{'mean ms':>10}{'prompt':>10}{'completion':>12}{'cost $':>10}{'$/call':>10}")
+        for row in rows:
+            calls = row['calls'] or 0
+            mean = row['latency'] / calls if calls else 0.0
+            per_call = row['cost'] / calls if calls else 0.0
+            self.stdout.write(
+                f"{row['route'] or '-':<8}{row['model']:<24}{calls:>7}{mean:>10.0f}{row['prompt']:>10}"
+                f"{row['completion']:>12}{row['cost']:>10.4f}{per_call:>10.5f}"
+            )
@@ -0,0 +1,35 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from core.models import Message
+
+
+class Command(BaseCommand):
+    help = "Report prompt, cached and completion tokens and the prefix reuse ratio per day."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7)
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        rows = (
+            Message.objects.filter(sender='ai', timestamp__gte=since, prompt_tokens__isnull=False)
+            .annotate(day=TruncDate('timestamp'))
+            .values('day')
+            .annotate(
+                completions=Count('id'),
+                prompt=Sum('prompt_tokens'),
+                cached=Sum('cached_tokens'),
+                completion=Sum('completion_tokens'),
+            )
+            .order_by('day')
+        )
+        self.stdout.write(f"{'date':<12}{'calls':>7}{'prompt':>10}{'cached':>10}{'completion':>12}{'reuse':>8}")
+        for row in rows:
+            reuse = (row['cached'] or 0) / row['prompt'] if row['prompt'] else 0.0
+            self.stdout.write(
+                f"{row['day'].isoformat():<12}{row['completions']:>7}{row['prompt']:>10}"
+                f"{row['cached'] or 0:>10}{row['completion'] or 0:>12}{reuse:>8.1%}"
+            )
@@ -0,0 +1,39 @@
+import time
+from .services.metrics import http_request_duration
+from .services.tracing import span, TRACING_ENABLED
+
+
+class TracingMiddleware:
+    """
+    Opens the root span of each request, continuing the caller's W3C traceparent header
+    when present, and returns the traceparent so clients can correlate their own logs.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not TRACING_ENABLED:
+            return self.get_response(request)
+        with span(f"HTTP {request.method}", traceparent=request.headers.get('traceparent'),
+                  **{'http.method': request.method, 'http.target': request.path}) as root:
+            response = self.get_response(request)
+            match = getattr(request, 'resolver_match', None)
+            if match is not None:
+                root.name = f"HTTP {request.method} {match.route}"
+            root.set_attribute('http.status_code', response.status_code)
+        response['traceparent'] = root.traceparent()
+        return response
+
+
+class MetricsMiddleware:
+    """Observes request latency per resolved route (not per raw path, to bound label cardinality)."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else 'unmatched'
+        http_request_duration.labels(request.method, route, str(response.status_code)).observe(time.perf_counter() - started)
+        return response
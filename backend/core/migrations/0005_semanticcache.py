@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_conversation_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SemanticCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(db_index=True, max_length=64)),
+                ('intent', models.CharField(max_length=16)),
+                ('query', models.TextField()),
+                ('embedding', models.BinaryField()),
+                ('response', models.TextField()),
+                ('generation_ms', models.FloatField(default=0)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SemanticCacheStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('lookups', models.PositiveIntegerField(default=0)),
+                ('global_hits', models.PositiveIntegerField(default=0)),
+                ('personal_hits', models.PositiveIntegerField(default=0)),
+                ('latency_saved_ms', models.FloatField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_usage_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='usagerollup',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='usagerecord',
+            name='route',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='usagerollup',
+            name='route',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AlterUniqueTogether(
+            name='usagerollup',
+            unique_together={('user', 'date', 'stage', 'model', 'route')},
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def backfill_activity_stats(apps, schema_editor):
+    """Seed counters for existing users; later writes keep them current."""
+    User = apps.get_model('core', 'User')
+    UserActivityStats = apps.get_model('core', 'UserActivityStats')
+    PersonalKnowledgeDocument = apps.get_model('core', 'PersonalKnowledgeDocument')
+    Conversation = apps.get_model('core', 'Conversation')
+    Message = apps.get_model('core', 'Message')
+    documents = dict(PersonalKnowledgeDocument.objects.values('owner').annotate(n=Count('id')).values_list('owner', 'n'))
+    conversations = dict(Conversation.objects.values('user').annotate(n=Count('id')).values_list('user', 'n'))
+    messages = dict(Message.objects.values('conversation__user').annotate(n=Count('id')).values_list('conversation__user', 'n'))
+    active_days, last_active = {}, {}
+    days = Message.objects.annotate(day=TruncDate('timestamp')).values_list('conversation__user', 'day').distinct()
+    for user_id, day in days:
+        active_days[user_id] = active_days.get(user_id, 0) + 1
+        last_active[user_id] = max(day, last_active.get(user_id, day))
+    UserActivityStats.objects.bulk_create([
+        UserActivityStats(
+            user_id=user_id, documents=documents.get(user_id, 0), conversations=conversations.get(user_id, 0),
+            messages=messages.get(user_id, 0), active_days=active_days.get(user_id, 0),
+            last_active_date=last_active.get(user_id)
+        )
+        for user_id in User.objects.values_list('id', flat=True)
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_usage_route'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActivityStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='activity_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('documents', models.IntegerField(default=0)),
+                ('chunks', models.IntegerField(default=0)),
+                ('conversations', models.IntegerField(default=0)),
+                ('messages', models.IntegerField(default=0)),
+                ('suggestions', models.IntegerField(default=0)),
+                ('active_days', models.IntegerField(default=0)),
+                ('last_active_date', models.DateField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_activity_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_user_activity_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', 'started_at'], name='conversation_user_started'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'timestamp'], name='message_conversation_ts'),
+        ),
+        migrations.AddIndex(
+            model_name='personalknowledgedocument',
+            index=models.Index(fields=['owner', 'uploaded_at'], name='personal_doc_owner_uploaded'),
+        ),
+    ]
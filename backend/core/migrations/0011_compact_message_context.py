@@ -0,0 +1,63 @@
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def history_ids(history, ids, texts, p):
+    """
+    Ids of the messages whose texts an AI message at position p copied as history. The view
+    saved the user turn first and then copied the last messages up to and including it, so
+    normally those are the len(history) messages before p. If texts no longer line up (a
+    message was edited or deleted since), each text is matched to the latest earlier message
+    with that text instead, and texts no message has any more are left out.
+    """
+    start = max(p - len(history), 0)
+    if texts[start:p] == history:
+        return ids[start:p]
+    matched, end = [], p
+    for text in reversed(history):
+        for i in range(end - 1, -1, -1):
+            if texts[i] == text:
+                matched.append(ids[i])
+                end = i
+                break
+    return matched[::-1]
+
+
+def compact_message_context(apps, schema_editor):
+    """
+    Replace the copied history texts on AI messages with the ids of the messages they
+    were copied from. Works one conversation at a time and writes in batches.
+    """
+    Message = apps.get_model('core', 'Message')
+    conversation_ids = (
+        Message.objects.filter(sender='ai', context__has_key='history')
+        .values_list('conversation_id', flat=True).distinct().order_by('conversation_id')
+    )
+    for conversation_id in conversation_ids.iterator():
+        rows = list(Message.objects.filter(conversation_id=conversation_id).order_by('timestamp', 'id').values_list('id', 'text'))
+        ids = [message_id for message_id, _ in rows]
+        texts = [text for _, text in rows]
+        position = {message_id: i for i, message_id in enumerate(ids)}
+        pending = []
+        for message in Message.objects.filter(conversation_id=conversation_id, sender='ai', context__has_key='history').only('id', 'context'):
+            history = message.context.get('history') or []
+            message.context = {k: v for k, v in message.context.items() if k != 'history'}
+            message.context['history_ids'] = history_ids(history, ids, texts, position[message.id])
+            pending.append(message)
+            if len(pending) >= BATCH_SIZE:
+                Message.objects.bulk_update(pending, ['context'])
+                pending = []
+        if pending:
+            Message.objects.bulk_update(pending, ['context'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_message_context, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations
+from core.migration_ops import VendorRunSQL
+
+# SQLite: an external-content FTS5 table kept in sync by triggers. Besides the text it
+# indexes an owner token ('u<user id>') so a search intersects with the user's messages
+# inside the index instead of ranking every tenant's matches. The content is read
+# through a view since the owner lives on the conversation. detail='column' drops token
+# positions from the doclists: search has no phrase or NEAR queries, and the smaller
+# doclists halve query time (snippet() and bm25() still work).
+OWNER = "(SELECT 'u' || user_id FROM core_conversation WHERE id = {row}.conversation_id)"
+SQLITE_FORWARD = [
+    """CREATE VIEW core_message_search_source AS
+        SELECT m.id AS id, m.text AS text, 'u' || c.user_id AS owner
+        FROM core_message m JOIN core_conversation c ON c.id = m.conversation_id""",
+    "CREATE VIRTUAL TABLE core_message_fts USING fts5(text, owner, content='core_message_search_source', content_rowid='id', tokenize='porter unicode61', detail='column')",
+    f"""CREATE TRIGGER core_message_fts_insert AFTER INSERT ON core_message BEGIN
+        INSERT INTO core_message_fts(rowid, text, owner) VALUES (new.id, new.text, {OWNER.format(row='new')});
+    END""",
+    f"""CREATE TRIGGER core_message_fts_delete AFTER DELETE ON core_message BEGIN
+        INSERT INTO core_message_fts(core_message_fts, rowid, text, owner) VALUES ('delete', old.id, old.text, {OWNER.format(row='old')});
+    END""",
+    f"""CREATE TRIGGER core_message_fts_update AFTER UPDATE OF text ON core_message BEGIN
+        INSERT INTO core_message_fts(core_message_fts, rowid, text, owner) VALUES ('delete', old.id, old.text, {OWNER.format(row='old')});
+        INSERT INTO core_message_fts(rowid, text, owner) VALUES (new.id, new.text, {OWNER.format(row='new')});
+    END""",
+    "INSERT INTO core_message_fts(core_message_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS core_message_fts_update",
+    "DROP TRIGGER IF EXISTS core_message_fts_delete",
+    "DROP TRIGGER IF EXISTS core_message_fts_insert",
+    "DROP TABLE IF EXISTS core_message_fts",
+    "DROP VIEW IF EXISTS core_message_search_source",
+]
+
+# PostgreSQL: a generated tsvector column (computed on write) with a GIN index. It is not a
+# model field, so the ORM never reads or writes it.
+POSTGRES_FORWARD = [
+    "ALTER TABLE core_message ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', text)) STORED",
+    "CREATE INDEX core_message_search_vector ON core_message USING GIN (search_vector)",
+]
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS core_message_search_vector",
+    "ALTER TABLE core_message DROP COLUMN IF EXISTS search_vector",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_conversation_archive'),
+    ]
+
+    operations = [
+        VendorRunSQL('sqlite', SQLITE_FORWARD, SQLITE_REVERSE),
+        VendorRunSQL('postgresql', POSTGRES_FORWARD, POSTGRES_REVERSE),
+    ]
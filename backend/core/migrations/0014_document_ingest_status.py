@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:12
+
+from django.db import migrations, models
+
+
+def mark_existing_ready(apps, schema_editor):
+    """Documents uploaded before ingestion moved to the background were ingested on upload."""
+    for name in ('GlobalKnowledgeDocument', 'PersonalKnowledgeDocument'):
+        apps.get_model('core', name).objects.update(ingest_status='ready', ingest_progress=1.0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_message_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='globalknowledgedocument',
+            name='ingest_status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('extracting', 'Extracting'), ('embedding', 'Embedding'), ('indexing', 'Indexing'), ('ready', 'Ready'), ('failed', 'Failed')], default='queued', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='globalknowledgedocument',
+            name='ingest_progress',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='globalknowledgedocument',
+            name='ingest_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='personalknowledgedocument',
+            name='ingest_status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('extracting', 'Extracting'), ('embedding', 'Embedding'), ('indexing', 'Indexing'), ('ready', 'Ready'), ('failed', 'Failed')], default='queued', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='personalknowledgedocument',
+            name='ingest_progress',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='personalknowledgedocument',
+            name='ingest_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(mark_existing_ready, migrations.RunPython.noop),
+    ]
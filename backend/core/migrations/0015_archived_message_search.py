@@ -0,0 +1,41 @@
+from django.db import migrations
+from core.migration_ops import VendorRunSQL
+
+# Archived conversations leave core_message, and the 0013 triggers take them out of search.
+# They are indexed here instead, without a second copy of their text: a contentless FTS5
+# table on SQLite, a tsvector-only table on PostgreSQL. Row ids pack the conversation id and
+# the message's position in the archive blob (see services.archive.archive_row_id).
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE core_message_archive_fts USING fts5(text, owner, content='', tokenize='porter unicode61', detail='column')",
+]
+SQLITE_REVERSE = [
+    "DROP TABLE IF EXISTS core_message_archive_fts",
+]
+POSTGRES_FORWARD = [
+    "CREATE TABLE core_message_archive_search (id bigint PRIMARY KEY, search_vector tsvector NOT NULL)",
+    "CREATE INDEX core_message_archive_search_vector ON core_message_archive_search USING GIN (search_vector)",
+]
+POSTGRES_REVERSE = [
+    "DROP TABLE IF EXISTS core_message_archive_search",
+]
+
+
+def index_existing_archives(apps, schema_editor):
+    """Conversations archived before this migration dropped out of search; put them back."""
+    from core.services.archive import index_archived_messages, read_archive
+    ConversationArchive = apps.get_model('core', 'ConversationArchive')
+    for archive in ConversationArchive.objects.select_related('conversation').iterator():
+        index_archived_messages(archive.conversation_id, archive.conversation.user_id, [row['text'] for row in read_archive(archive)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_document_ingest_status'),
+    ]
+
+    operations = [
+        VendorRunSQL('sqlite', SQLITE_FORWARD, SQLITE_REVERSE),
+        VendorRunSQL('postgresql', POSTGRES_FORWARD, POSTGRES_REVERSE),
+        migrations.RunPython(index_existing_archives, migrations.RunPython.noop),
+    ]
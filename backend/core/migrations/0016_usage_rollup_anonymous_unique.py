@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:59
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def merge_anonymous_rollups(apps, schema_editor):
+    """
+    Rebuild duplicated anonymous rollups from the ledger: every duplicate received every
+    later update, so their totals cannot simply be summed.
+    """
+    UsageRecord = apps.get_model('core', 'UsageRecord')
+    UsageRollup = apps.get_model('core', 'UsageRollup')
+    key = ('date', 'stage', 'model', 'route')
+    duplicated = UsageRollup.objects.filter(user__isnull=True).values(*key).annotate(n=Count('id')).filter(n__gt=1)
+    for group in duplicated:
+        group = {k: group[k] for k in key}
+        UsageRollup.objects.filter(user__isnull=True, **group).delete()
+        totals = UsageRecord.objects.filter(
+            user__isnull=True, stage=group['stage'], model=group['model'], route=group['route']
+        ).annotate(day=TruncDate('created_at')).filter(day=group['date']).aggregate(
+            calls=Count('id'), prompt_tokens=Sum('prompt_tokens'), cached_tokens=Sum('cached_tokens'),
+            completion_tokens=Sum('completion_tokens'), latency_ms=Sum('latency_ms'), cost_usd=Sum('cost_usd'),
+        )
+        cache_hits = UsageRecord.objects.filter(
+            user__isnull=True, stage=group['stage'], model=group['model'], route=group['route'], cache_hit=True
+        ).annotate(day=TruncDate('created_at')).filter(day=group['date']).count()
+        UsageRollup.objects.create(user=None, cache_hits=cache_hits, **group, **{k: v or 0 for k, v in totals.items()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_archived_message_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_anonymous_rollups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='usagerollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('date', 'stage', 'model', 'route'), name='usage_rollup_anonymous_unique'),
+        ),
+    ]
@@ -6,6 +6,14 @@ from django.dispatch import receiver
 
 # Create your models here.
 
+# Knowledge documents are ingested in the background after upload:
+# queued -> extracting -> embedding -> indexing -> ready, or failed with ingest_error set
+INGEST_STATUS_CHOICES = [
+    ('queued', 'Queued'), ('extracting', 'Extracting'), ('embedding', 'Embedding'),
+    ('indexing', 'Indexing'), ('ready', 'Ready'), ('failed', 'Failed'),
+]
+INGEST_PENDING_STATUSES = ('queued', 'extracting', 'embedding', 'indexing')
+
 class User(AbstractUser):
     email = models.EmailField(unique=True)
     is_admin = models.BooleanField(default=False)
@@ -25,14 +33,18 @@ class GlobalKnowledgeDocument(models.Model):
     metadata = models.JSONField(default=dict, blank=True)
     # For future: store Qdrant vector id or embedding reference
     vector_id = models.CharField(max_length=128, blank=True, null=True)
+    ingest_status = models.CharField(max_length=16, choices=INGEST_STATUS_CHOICES, default='queued')
+    # Fraction of the ingestion done, 0..1, for progress bars
+    ingest_progress = models.FloatField(default=0.0)
+    ingest_error = models.TextField(blank=True, default='')
 
     def __str__(self):
         return self.title
 
-# Signal to delete Qdrant vectors when global doc is deleted
+# Signal to delete vectors when global doc is deleted
 @receiver(post_delete, sender=GlobalKnowledgeDocument)
 def delete_global_vectors(sender, instance, **kwargs):
-    from .services.qdrant_client import delete_vectors_by_doc_id
+    from .services.vector_store import delete_vectors_by_doc_id
     if instance.id:
         delete_vectors_by_doc_id(str(instance.id), collection='global_kb')
 
@@ -44,31 +56,158 @@ class PersonalKnowledgeDocument(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     metadata = models.JSONField(default=dict, blank=True)
     vector_id = models.CharField(max_length=128, blank=True, null=True)
+    ingest_status = models.CharField(max_length=16, choices=INGEST_STATUS_CHOICES, default='queued')
+    # Fraction of the ingestion done, 0..1, for progress bars
+    ingest_progress = models.FloatField(default=0.0)
+    ingest_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        # Ascending so a backwards scan serves the newest-first per-owner lists
+        indexes = [models.Index(fields=['owner', 'uploaded_at'], name='personal_doc_owner_uploaded')]
 
     def __str__(self):
         return f"{self.title} ({self.owner.email})"
 
-# Signal to delete Qdrant vectors when personal doc is deleted
+# Signal to delete vectors when personal doc is deleted
 @receiver(post_delete, sender=PersonalKnowledgeDocument)
 def delete_personal_vectors(sender, instance, **kwargs):
-    from .services.qdrant_client import delete_vectors_by_doc_id
+    from .services.vector_store import delete_vectors_by_doc_id
     if instance.id:
-        delete_vectors_by_doc_id(str(instance.id), collection='personal_kb')
+        delete_vectors_by_doc_id(str(instance.id), collection='personal_kb', user_id=instance.owner_id)
 
 class Conversation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
     started_at = models.DateTimeField(auto_now_add=True)
     title = models.CharField(max_length=255, blank=True, default='')
+    # Set while the messages live compressed in ConversationArchive instead of the Message table
+    archived_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'started_at'], name='conversation_user_started')]
 
     def __str__(self):
         return f"Conversation {self.id} ({self.user.email})"
 
+# Signal to forget a conversation's exchanges when it is deleted
+@receiver(post_delete, sender=Conversation)
+def delete_conversation_memory(sender, instance, **kwargs):
+    from .services.memory import forget_conversation
+    if instance.id:
+        forget_conversation(instance.id, user_id=instance.user_id)
+
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     sender = models.CharField(max_length=32, choices=[('user', 'User'), ('ai', 'AI')])
     text = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     context = models.JSONField(default=dict, blank=True)
+    # Token usage reported for the completion that produced an AI message
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    cached_tokens = models.PositiveIntegerField(null=True, blank=True)
+    completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        # Chat history is read newest-first per conversation on every turn
+        indexes = [models.Index(fields=['conversation', 'timestamp'], name='message_conversation_ts')]
 
     def __str__(self):
         return f"{self.sender} @ {self.timestamp}: {self.text[:30]}..."
+
+class SemanticCacheEntry(models.Model):
+    # 'global' for global-only answers, 'user:<id>' for answers built on a user's personal KB
+    scope = models.CharField(max_length=64, db_index=True)
+    intent = models.CharField(max_length=16)
+    query = models.TextField()
+    # L2-normalised float32 query embedding
+    embedding = models.BinaryField()
+    response = models.TextField()
+    generation_ms = models.FloatField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"[{self.scope}] {self.query[:30]}..."
+
+class SemanticCacheStat(models.Model):
+    date = models.DateField(unique=True)
+    lookups = models.PositiveIntegerField(default=0)
+    global_hits = models.PositiveIntegerField(default=0)
+    personal_hits = models.PositiveIntegerField(default=0)
+    latency_saved_ms = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"Answer cache {self.date}: {self.global_hits + self.personal_hits}/{self.lookups}"
+
+class UsageRecord(models.Model):
+    """One upstream model call (intent classification, embedding or completion)."""
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='usage_records')
+    stage = models.CharField(max_length=32)
+    model = models.CharField(max_length=64)
+    route = models.CharField(max_length=16, blank=True, default='')
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    cached_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    latency_ms = models.FloatField(default=0)
+    cost_usd = models.FloatField(default=0)
+    cache_hit = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.stage}/{self.model} {self.prompt_tokens}+{self.completion_tokens} tokens"
+
+class UsageRollup(models.Model):
+    """Per user, day, stage and model totals of UsageRecord, updated as records are written."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='usage_rollups')
+    date = models.DateField()
+    stage = models.CharField(max_length=32)
+    model = models.CharField(max_length=64)
+    route = models.CharField(max_length=16, blank=True, default='')
+    calls = models.PositiveIntegerField(default=0)
+    cache_hits = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    cached_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    latency_ms = models.FloatField(default=0)
+    cost_usd = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'date', 'stage', 'model', 'route')
+        constraints = [
+            # unique_together ignores NULLs: anonymous usage needs its own constraint
+            models.UniqueConstraint(
+                fields=['date', 'stage', 'model', 'route'], condition=models.Q(user__isnull=True),
+                name='usage_rollup_anonymous_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.date} {self.stage}/{self.model}: {self.calls} calls"
+
+class UserActivityStats(models.Model):
+    """Per-user dashboard counters, kept current by signals as documents, conversations and messages are written."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='activity_stats')
+    documents = models.IntegerField(default=0)
+    chunks = models.IntegerField(default=0)
+    conversations = models.IntegerField(default=0)
+    messages = models.IntegerField(default=0)
+    suggestions = models.IntegerField(default=0)
+    active_days = models.IntegerField(default=0)
+    last_active_date = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Activity of {self.user_id}: {self.conversations} conversations, {self.messages} messages"
+
+class ConversationArchive(models.Model):
+    """The messages of an idle conversation as one compressed JSONL blob (see services/archive.py)."""
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, primary_key=True, related_name='archive')
+    codec = models.CharField(max_length=8)  # 'zstd' | 'zlib'
+    payload = models.BinaryField()
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    raw_bytes = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archive of conversation {self.conversation_id}: {self.message_count} messages, {len(self.payload)}/{self.raw_bytes} bytes"
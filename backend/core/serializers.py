@@ -42,20 +42,35 @@ class UserProfileSerializer(serializers.ModelSerializer):
 class GlobalKnowledgeDocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = GlobalKnowledgeDocument
-        fields = ['id', 'title', 'file', 'file_type', 'uploaded_at', 'metadata', 'vector_id']
-        read_only_fields = ['id', 'uploaded_at', 'vector_id']
+        fields = ['id', 'title', 'file', 'file_type', 'uploaded_at', 'metadata', 'vector_id', 'ingest_status', 'ingest_progress', 'ingest_error']
+        read_only_fields = ['id', 'uploaded_at', 'vector_id', 'ingest_status', 'ingest_progress', 'ingest_error']
 
 class PersonalKnowledgeDocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = PersonalKnowledgeDocument
-        fields = ['id', 'owner', 'title', 'file', 'file_type', 'uploaded_at', 'metadata', 'vector_id']
-        read_only_fields = ['id', 'owner', 'uploaded_at', 'vector_id']
+        fields = ['id', 'owner', 'title', 'file', 'file_type', 'uploaded_at', 'metadata', 'vector_id', 'ingest_status', 'ingest_progress', 'ingest_error']
+        read_only_fields = ['id', 'owner', 'uploaded_at', 'vector_id', 'ingest_status', 'ingest_progress', 'ingest_error']
 
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
-        fields = ['id', 'conversation', 'sender', 'text', 'timestamp', 'context']
-        read_only_fields = ['id', 'timestamp', 'context']
+        fields = ['id', 'conversation', 'sender', 'text', 'timestamp', 'prompt_tokens', 'cached_tokens', 'completion_tokens']
+        read_only_fields = ['id', 'timestamp', 'prompt_tokens', 'cached_tokens', 'completion_tokens']
+
+class MessageContextSerializer(MessageSerializer):
+    """MessageSerializer plus the generation context, for clients that ask for it."""
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ['context']
+        read_only_fields = MessageSerializer.Meta.read_only_fields + ['context']
+
+class ConversationSummarySerializer(serializers.ModelSerializer):
+    # Filled by annotations on the list queryset
+    message_count = serializers.IntegerField(read_only=True)
+    last_message_at = serializers.DateTimeField(read_only=True)
+    class Meta:
+        model = Conversation
+        fields = ['id', 'title', 'started_at', 'last_message_at', 'message_count', 'archived_at']
+        read_only_fields = fields
 
 class ConversationSerializer(serializers.ModelSerializer):
     messages = MessageSerializer(many=True, read_only=True)
@@ -0,0 +1,50 @@
+import logging
+from typing import Dict, Optional
+from django.db.models import F
+from django.utils import timezone
+from ..models import UserActivityStats, PersonalKnowledgeDocument, Conversation
+
+logger = logging.getLogger('ai_manager')
+
+RECENT_DOCUMENTS = 5
+RECENT_CONVERSATIONS = 3
+
+def bump(user_id: Optional[int], active: bool = True, **deltas: int):
+    """
+    Add deltas to the user's counters (e.g. messages=1) and, when `active`, count today
+    as an active day once. Never raises: stats must not break the write they follow.
+    """
+    if user_id is None:
+        return
+    try:
+        UserActivityStats.objects.get_or_create(user_id=user_id)
+        stats = UserActivityStats.objects.filter(user_id=user_id)
+        if deltas:
+            stats.update(**{field: F(field) + delta for field, delta in deltas.items()})
+        if active:
+            today = timezone.localdate()
+            # Conditional update so concurrent writers count the day once
+            stats.exclude(last_active_date=today).update(active_days=F('active_days') + 1, last_active_date=today)
+    except Exception as e:
+        logger.warning("Failed to update activity stats for user_id=%s: %s", user_id, e)
+
+def dashboard(user_id: int) -> Dict:
+    """Counters plus the most recent documents and conversations, for GET /api/dashboard/."""
+    stats = UserActivityStats.objects.filter(user_id=user_id).first() or UserActivityStats(user_id=user_id)
+    recent_documents = PersonalKnowledgeDocument.objects.filter(owner_id=user_id).order_by('-uploaded_at').values(
+        'id', 'title', 'file_type', 'uploaded_at'
+    )[:RECENT_DOCUMENTS]
+    recent_conversations = Conversation.objects.filter(user_id=user_id).order_by('-started_at', '-id').values(
+        'id', 'title', 'started_at'
+    )[:RECENT_CONVERSATIONS]
+    return {
+        'documents': stats.documents,
+        'chunks': stats.chunks,
+        'conversations': stats.conversations,
+        'messages': stats.messages,
+        'suggestions': stats.suggestions,
+        'active_days': stats.active_days,
+        'last_active_date': stats.last_active_date,
+        'recent_documents': list(recent_documents),
+        'recent_conversations': list(recent_conversations),
+    }
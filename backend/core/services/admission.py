@@ -0,0 +1,129 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from .metrics import admission_rejections
+
+logger = logging.getLogger('ai_manager')
+
+# Chat admission control shared by every worker process through a small SQLite file
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_DB_PATH = os.getenv('ADMISSION_DB_PATH', os.path.join(os.path.dirname(__file__), '../../admission.sqlite3'))
+ADMISSION_USER_CONCURRENCY = int(os.getenv('ADMISSION_USER_CONCURRENCY', '1'))
+ADMISSION_RATE_PER_MINUTE = float(os.getenv('ADMISSION_RATE_PER_MINUTE', '12'))
+ADMISSION_BURST = float(os.getenv('ADMISSION_BURST', '4'))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '8'))
+# Leases of crashed workers expire after this many seconds
+ADMISSION_LEASE_TTL = float(os.getenv('ADMISSION_LEASE_TTL', '120'))
+ADMISSION_SHED_RETRY_AFTER = float(os.getenv('ADMISSION_SHED_RETRY_AFTER', '5'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, expires_at REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS leases_user ON leases (user_id);
+CREATE TABLE IF NOT EXISTS buckets (user_id INTEGER PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL);
+"""
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Chat request rejected ({reason}); retry after {retry_after:.1f}s")
+        self.reason = reason  # 'overloaded' | 'concurrency' | 'rate'
+        self.retry_after = retry_after
+
+@dataclass(frozen=True)
+class Lease:
+    id: int
+    user_id: int
+
+class AdmissionController:
+    """
+    Admits chat generations against three limits, checked atomically in one SQLite write
+    transaction so they hold across gunicorn workers:
+    global in-flight generations (load shedding), per-user in-flight generations, and a
+    per-user token bucket refilled at ADMISSION_RATE_PER_MINUTE up to ADMISSION_BURST.
+    """
+    def __init__(self, path: str = ADMISSION_DB_PATH, user_concurrency: int = ADMISSION_USER_CONCURRENCY,
+                 rate_per_minute: float = ADMISSION_RATE_PER_MINUTE, burst: float = ADMISSION_BURST,
+                 max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, lease_ttl: float = ADMISSION_LEASE_TTL):
+        self.path = path
+        self.user_concurrency = user_concurrency
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.lease_ttl = lease_ttl
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, user_id: int) -> Lease:
+        """Take a generation lease for the user or raise AdmissionRejected with a retry hint."""
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM leases WHERE expires_at < ?', (now,))
+            in_flight = conn.execute('SELECT COUNT(*) FROM leases').fetchone()[0]
+            if in_flight >= self.max_in_flight:
+                raise AdmissionRejected('overloaded', ADMISSION_SHED_RETRY_AFTER)
+            user_in_flight = conn.execute('SELECT COUNT(*) FROM leases WHERE user_id = ?', (user_id,)).fetchone()[0]
+            if user_in_flight >= self.user_concurrency:
+                raise AdmissionRejected('concurrency', 1.0)
+            row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE user_id = ?', (user_id,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            if tokens < 1.0:
+                raise AdmissionRejected('rate', (1.0 - tokens) / self.rate if self.rate else 60.0)
+            conn.execute(
+                'INSERT INTO buckets (user_id, tokens, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at',
+                (user_id, tokens - 1.0, now)
+            )
+            cursor = conn.execute('INSERT INTO leases (user_id, expires_at) VALUES (?, ?)', (user_id, now + self.lease_ttl))
+            conn.execute('COMMIT')
+            return Lease(cursor.lastrowid, user_id)
+        except AdmissionRejected as e:
+            conn.execute('ROLLBACK')
+            admission_rejections.labels(e.reason).inc()
+            logger.info("Admission rejected for user_id=%s: %s", user_id, e.reason)
+            raise
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def release(self, lease: Lease):
+        """Return the lease. If the store is unavailable the lease is left to expire after ADMISSION_LEASE_TTL."""
+        try:
+            self._connection().execute('DELETE FROM leases WHERE id = ?', (lease.id,))
+        except sqlite3.Error as e:
+            # The turn has already been saved: failing here would turn it into a 500 and a duplicate on retry
+            logger.warning("Admission store unavailable, lease %s of user_id=%s expires by TTL: %s", lease.id, lease.user_id, e)
+
+    @contextmanager
+    def admitted(self, user_id: int):
+        """Hold a lease for the duration of the block. A no-op when ADMISSION_ENABLED is false."""
+        if not ADMISSION_ENABLED:
+            yield None
+            return
+        try:
+            lease = self.acquire(user_id)
+        except sqlite3.Error as e:
+            # The limiter must not take chat down with it: fail open
+            logger.warning("Admission store unavailable, admitting user_id=%s: %s", user_id, e)
+            lease = None
+        try:
+            yield lease
+        finally:
+            if lease is not None:
+                self.release(lease)
+
+# Global instance
+admission = AdmissionController()
@@ -1,17 +1,28 @@
+import math
+import time
+import os
 import logging
-import logging.config
 import openai
 from typing import List, Dict, Optional, Literal
-from .qdrant_client import search_vectors
+from .vector_store import search_vectors
 from .ingestion import embed_text
+from .usage import record_response_usage
+from .reranker import reranker, RERANK_ENABLED, RERANK_CANDIDATES
+from .mmr import mmr_select
+from .tracing import span, traced
+from .metrics import observe_upstream
+from .model_registry import stage_model
+from .memory import CHAT_MEMORY_ENABLED, CHAT_MEMORY_COLLECTION, CHAT_MEMORY_MIN_SCORE
+from .resilience import call_with_resilience, OPENAI_INTENT_TIMEOUT
 
-# Load logging configuration if not already loaded
-import os
-LOGGING_CONF_PATH = os.path.join(os.path.dirname(__file__), '../../logging.conf')
-if os.path.exists(LOGGING_CONF_PATH):
-    logging.config.fileConfig(LOGGING_CONF_PATH, disable_existing_loggers=False)
 logger = logging.getLogger('ai_manager')
 
+# Diversity selection over the combined global + personal + memory candidates
+MMR_ENABLED = os.getenv('MMR_ENABLED', 'true').lower() == 'true'
+MMR_CANDIDATES = int(os.getenv('MMR_CANDIDATES', '10'))  # candidate pool per KB
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', '0.7'))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+
 class QueryIntent:
     PERSONAL = "personal"
     GLOBAL = "global"
@@ -21,23 +32,33 @@ class Agent:
     """
     Agentic orchestration for intent classification, retriever selection, and prompt construction.
     """
-    def classify_intent(self, query: str) -> Literal["personal", "global", "hybrid"]:
+    @traced('agent.classify_intent')
+    def classify_intent(self, query: str, user_id: Optional[int] = None, use_llm: bool = True) -> Literal["personal", "global", "hybrid"]:
         """
         Classify query intent using LLM-based intent detection.
+        use_llm=False goes straight to the keyword classifier (used over the soft usage budget).
         """
-        logger.info(f"Classifying intent for query: {query}")
+        logger.debug("Classifying intent for query: %s", query)
+        if not use_llm:
+            return self._keyword_intent(query)
         try:
+            model = stage_model('intent').name
+            started = time.perf_counter()
             prompt = (
                 "You are an expert assistant. Classify the user query as 'personal', 'global', or 'hybrid'. "
                 "Return the classification as a string.\n\n"
                 f"User Query: {query}"
             )
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": prompt}],
-                max_tokens=512,
-                temperature=0.0
-            )
+            with observe_upstream('openai', 'intent'):
+                response = call_with_resilience(
+                    'openai', openai.chat.completions.create,
+                    model=model,
+                    messages=[{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": prompt}],
+                    max_tokens=512,
+                    temperature=0.0,
+                    timeout=OPENAI_INTENT_TIMEOUT
+                )
+            record_response_usage(user_id, 'intent', model, response, (time.perf_counter() - started) * 1000)
             classification = response.choices[0].message.content.strip().lower()
             # Extract only 'personal', 'global', or 'hybrid' from the output
             if "personal" in classification:
@@ -47,102 +68,234 @@ class Agent:
             elif "hybrid" in classification:
                 classification = "hybrid"
             else:
-                logger.warning(f"LLM intent classification output unrecognized: {classification}. Using fallback.")
+                logger.warning("LLM intent classification output unrecognized: %s. Using fallback.", classification)
                 raise ValueError('Unrecognized intent')
-            logger.info(f"Intent classified as {classification}.")
+            logger.info("Intent classified as %s.", classification)
             return classification
         except Exception as e:
-            logger.error(f"Error in LLM-based intent classification: {e}")
-            # Fallback to keyword-based classification
-            personal_keywords = ["my", "me", "mine", "personal", "myself", "upload", "show", "schedule"]
-            global_keywords = ["industry", "trend", "market", "best practice", "professional", "general"]
-            query_lower = query.lower()
-            has_personal = any(word in query_lower for word in personal_keywords)
-            has_global = any(word in query_lower for word in global_keywords)
-            if has_personal:
-                if has_global:
-                    logger.info("Intent classified as HYBRID.")
-                    return QueryIntent.HYBRID
-                logger.info("Intent classified as PERSONAL.")
-                return QueryIntent.PERSONAL
+            logger.error("Error in LLM-based intent classification: %s", e)
+            return self._keyword_intent(query)
+
+    def _keyword_intent(self, query: str) -> Literal["personal", "global", "hybrid"]:
+        """Keyword-based classification, the fallback when the LLM is unavailable or skipped."""
+        personal_keywords = ["my", "me", "mine", "personal", "myself", "upload", "show", "schedule"]
+        global_keywords = ["industry", "trend", "market", "best practice", "professional", "general"]
+        query_lower = query.lower()
+        has_personal = any(word in query_lower for word in personal_keywords)
+        has_global = any(word in query_lower for word in global_keywords)
+        if has_personal:
             if has_global:
-                logger.info("Intent classified as GLOBAL.")
-                return QueryIntent.GLOBAL
-            logger.info("Intent classified as HYBRID (default).")
-            return QueryIntent.HYBRID  # Default to hybrid for ambiguous queries
+                logger.info("Intent classified as HYBRID.")
+                return QueryIntent.HYBRID
+            logger.info("Intent classified as PERSONAL.")
+            return QueryIntent.PERSONAL
+        if has_global:
+            logger.info("Intent classified as GLOBAL.")
+            return QueryIntent.GLOBAL
+        logger.info("Intent classified as HYBRID (default).")
+        return QueryIntent.HYBRID  # Default to hybrid for ambiguous queries
 
 
-    def retrieve_context(self, query: str, user_id: Optional[int] = None, intent: Optional[str] = None, top_k: int = 3) -> Dict[str, List[str]]:
+    @traced('agent.embed_query')
+    def embed_query(self, query: str, user_id: Optional[int] = None) -> List[float]:
+        """OpenAI embedding of a single query."""
+        query_embeddings = embed_text([query], user_id=user_id)
+        if len(query_embeddings[0]) < 1:
+            raise RuntimeError('Failed to generate OpenAI query embedding.')
+        return query_embeddings[0][0]
+
+    @traced('agent.retrieve_context')
+    def retrieve_context(self, query: str, user_id: Optional[int] = None, intent: Optional[str] = None, top_k: int = 3, query_embedding: Optional[List[float]] = None, sources: Optional[List[Dict]] = None, exclude_message_ids: Optional[List[int]] = None) -> Dict[str, List[str]]:
         """
         Retrieve context for a query. Global KB is always included for managerial insights.
-        Returns a dict with 'personal' and 'global' keys.
+        Returns a dict with 'global', 'personal' and 'memory' (earlier exchanges from all of
+        the user's conversations) keys. With reranking enabled each KB is over-fetched to
+        RERANK_CANDIDATES hits and the cross-encoder trims it to the candidate pool; with MMR
+        enabled the final chunks are chosen across all of them by select_diverse.
+        Pass query_embedding when the caller already embedded the query, and a list as
+        sources to collect compact references (kb, point id, doc id, score) to the chunks used.
+        exclude_message_ids are the turns the caller already sends as history; exchanges
+        containing them are not recalled from memory.
         """
-        logger.info(f"Retrieving context for query: {query}, user_id: {user_id}, intent: {intent}, top_k: {top_k}")
+        logger.info("Retrieving context for user_id=%s intent=%s top_k=%s", user_id, intent, top_k)
+        logger.debug("Retrieval query: %s", query)
         context = {}
         try:
             # For now, only use OpenAI embedding for retrieval (future-proof for hybrid)
-            query_embeddings = embed_text([query])
-            if len(query_embeddings[0]) >= 1:
-                query_embedding_openai = query_embeddings[0][0]
-            else:
-                raise RuntimeError('Failed to generate OpenAI query embedding.')
+            query_embedding_openai = query_embedding if query_embedding is not None else self.embed_query(query, user_id=user_id)
         except Exception as e:
-            logger.error(f"Error embedding query: {e}")
+            logger.error("Error embedding query: %s", e)
             return context
+        pool_k = max(top_k, MMR_CANDIDATES) if MMR_ENABLED else top_k
+        fetch_k = max(pool_k, RERANK_CANDIDATES) if RERANK_ENABLED else pool_k
+        candidates = {}
         # Modular retrieval: try each KB independently, log and continue on error
         # Global KB retrieval
         try:
             # Only use OpenAI embedding for search (future: add hybrid search here)
-            global_results = search_vectors(query_embedding_openai, collection='global_kb', top=top_k)
-            context['global'] = [r['payload']['chunk'] for r in global_results.get('result', []) if 'payload' in r and 'chunk' in r['payload']]
-            logger.info(f"Retrieved {len(context['global'])} global KB chunks.")
+            with span('agent.search', collection='global_kb', top=fetch_k):
+                global_results = search_vectors(query_embedding_openai, collection='global_kb', top=fetch_k, with_vectors=MMR_ENABLED)
+            hits = [r for r in global_results.get('result', []) if 'payload' in r and 'chunk' in r['payload']]
+            candidates['global'] = self._rerank(query, hits, pool_k)
+            logger.info("Retrieved %s global KB candidates.", len(candidates['global']))
         except Exception as e:
-            logger.warning(f"Global KB retrieval failed: {e}")
+            logger.warning("Global KB retrieval failed: %s", e)
         # Personal KB retrieval
         if intent and user_id and intent.lower() in (QueryIntent.PERSONAL, QueryIntent.HYBRID):
             try:
                 # Only use OpenAI embedding for search (future: add hybrid search here)
-                personal_results = search_vectors(query_embedding_openai, collection='personal_kb', top=top_k)
+                # The personal KB is tenant-partitioned: Qdrant only searches this user's points
+                with span('agent.search', collection='personal_kb', top=fetch_k):
+                    personal_results = search_vectors(query_embedding_openai, collection='personal_kb', top=fetch_k, user_id=user_id, with_vectors=MMR_ENABLED)
                 filtered = [r for r in personal_results.get('result', []) if r['payload'].get('user_id') == user_id]
-                context['personal'] = [r['payload']['chunk'] for r in filtered if 'payload' in r and 'chunk' in r['payload']]
-                logger.info(f"Retrieved {len(context['personal'])} personal KB chunks.")
+                hits = [r for r in filtered if 'payload' in r and 'chunk' in r['payload']]
+                candidates['personal'] = self._rerank(query, hits, pool_k)
+                logger.info("Retrieved %s personal KB candidates.", len(candidates['personal']))
             except Exception as e:
-                logger.warning(f"Personal KB retrieval failed: {e}")
+                logger.warning("Personal KB retrieval failed: %s", e)
+        # Long-term memory is recalled on every turn and competes with the KB chunks for the same context budget
+        if CHAT_MEMORY_ENABLED and user_id:
+            try:
+                with span('agent.search', collection=CHAT_MEMORY_COLLECTION, top=fetch_k):
+                    memory_results = search_vectors(query_embedding_openai, collection=CHAT_MEMORY_COLLECTION, top=fetch_k, user_id=user_id, with_vectors=MMR_ENABLED)
+                recent = set(exclude_message_ids or ())
+                hits = [
+                    r for r in memory_results.get('result', [])
+                    if r['payload'].get('user_id') == user_id and 'chunk' in r['payload']
+                    and r.get('score', 1.0) >= CHAT_MEMORY_MIN_SCORE
+                    and not recent.intersection(r['payload'].get('message_ids', ()))
+                ]
+                candidates['memory'] = self._rerank(query, hits, pool_k)
+                logger.info("Retrieved %s memory candidates.", len(candidates['memory']))
+            except Exception as e:
+                logger.warning("Chat memory retrieval failed: %s", e)
+        if MMR_ENABLED:
+            with span('agent.select_diverse', candidates=sum(len(h) for h in candidates.values())):
+                selected = self.select_diverse(query_embedding_openai, candidates, top_k)
+        else:
+            selected = self.select_within_budget(candidates, top_k)
+        for kb, hits in selected.items():
+            context[kb] = [r['payload']['chunk'] for r in hits]
+            if sources is not None:
+                sources.extend(self._source_ref(kb, r) for r in hits)
         return context
 
-    def merge_results(self, result1, result2, result3):
-        merged = result1.get('result', []) + result2.get('result', []) + result3.get('result', [])
-        merged = list({r['id']: r for r in merged}.values())
-        return {'result': merged}
+    def _source_ref(self, kb: str, hit: Dict) -> Dict:
+        score = hit.get('rerank_score', hit.get('score'))
+        return {
+            'kb': kb, 'id': hit.get('id'), 'doc_id': hit['payload'].get('doc_id'),
+            'score': round(float(score), 4) if score is not None else None,
+        }
+
+    def _rerank(self, query: str, hits: List[Dict], top_k: int) -> List[Dict]:
+        """Cross-encoder rerank of over-fetched hits when enabled, else the top_k as returned."""
+        if not RERANK_ENABLED:
+            return hits[:top_k]
+        with span('agent.rerank', candidates=len(hits)):
+            return reranker.rerank(query, hits, top_n=top_k)
+
+    def select_diverse(self, query_vector: List[float], candidates: Dict[str, List[Dict]], top_k: int, token_budget: int = None) -> Dict[str, List[Dict]]:
+        """
+        Pick a relevant but non-redundant set of hits across all KBs with MMR, under the
+        context token budget, and regroup them by KB in pick order. Near-duplicates such
+        as overlapping neighbour chunks are dropped. Falls back to select_within_budget
+        when the search did not return vectors.
+        """
+        token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+        pool = [(kb, hit) for kb, hits in candidates.items() for hit in hits]
+        if not pool or any('vector' not in hit for _, hit in pool):
+            return self.select_within_budget(candidates, top_k, token_budget)
+        # Relevance must be on one scale across KBs: cross-encoder scores only when every KB
+        # was reranked, otherwise (rerank fell back for some KB) vector scores for all
+        relevance = None
+        if all('rerank_score' in hit for _, hit in pool):
+            relevance = [1 / (1 + math.exp(-hit['rerank_score'])) for _, hit in pool]
+        elif all('score' in hit for _, hit in pool):
+            relevance = [hit['score'] for _, hit in pool]
+        picks = mmr_select(
+            query_vector,
+            [hit['vector'] for _, hit in pool],
+            relevance=relevance,
+            token_counts=[self._token_count(hit) for _, hit in pool],
+            token_budget=token_budget,
+            k=top_k * sum(1 for hits in candidates.values() if hits),
+            lambda_mult=MMR_LAMBDA,
+        )
+        selected = {kb: [] for kb in candidates}
+        for i in picks:
+            kb, hit = pool[i]
+            selected[kb].append(hit)
+        logger.info("MMR kept %s of %s candidates within %s tokens.", len(picks), len(pool), token_budget)
+        return selected
+
+    def select_within_budget(self, candidates: Dict[str, List[Dict]], top_k: int, token_budget: int = None) -> Dict[str, List[Dict]]:
+        """
+        Without MMR: take up to top_k hits per KB, best ranks of every KB first, while they
+        fit the context token budget shared by all KBs.
+        """
+        remaining = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+        selected = {kb: [] for kb in candidates}
+        for rank in range(top_k):
+            for kb, hits in candidates.items():
+                if rank < len(hits) and self._token_count(hits[rank]) <= remaining:
+                    selected[kb].append(hits[rank])
+                    remaining -= self._token_count(hits[rank])
+        return selected
+
+    def _token_count(self, hit: Dict) -> int:
+        """Chunk length in tokens from its ingestion offsets, else estimated from its characters."""
+        payload = hit['payload']
+        if payload.get('end_token') is not None and payload.get('start_token') is not None:
+            return payload['end_token'] - payload['start_token']
+        return len(payload['chunk']) // 4
 
     def build_prompt(self, context: Dict[str, List[str]], query: str) -> str:
         """
-        Construct a prompt with clear context source separation.
+        Construct the volatile part of the prompt: retrieved context with clear source
+        separation, then the query. The invariant instructions live in SYSTEM_PROMPT.
         """
-        logger.info(f"Building prompt for query: {query}")
+        logger.debug("Building prompt for query: %s", query)
         prompt = []
-        # Persona and anti-generic instructions (always prepend)
-        persona_header = (
-            "You are not a generic AI. You are the user's dedicated personal manager for their music artist career. "
-            "Act as a comprehensive music manager for artists, overseeing all aspects of their careers. Provide strategic guidance on branding, marketing, release schedules, touring, collaborations, and fan engagement. Develop and critique business plans, assist with contract interpretation, plan music releases and promotional campaigns, and advise on financial planning for sustainability. Support day-to-day operations such as managing a team (e.g., publicists, producers, stylists), scheduling, and digital presence. "
-            "Never act as a generic AI. Always tailor your advice to the user's goals, context, and artist career. "
-            "If you lack information, ask clarifying questions as a manager would. "
-            "If you must rely on general knowledge, relate it to the music industry and the user's career.\n"
-        )
-        prompt.append(persona_header)
         if context.get('global'):
             prompt.append("Global Knowledge (industry best practices):\n" + "\n---\n".join(context['global']))
         if context.get('personal'):
             prompt.append("Personal Knowledge (your data):\n" + "\n---\n".join(context['personal']))
-        if not (context.get('global') or context.get('personal')):
+        if context.get('memory'):
+            prompt.append("Earlier Conversations (past exchanges with the user):\n" + "\n---\n".join(context['memory']))
+        if not (context.get('global') or context.get('personal') or context.get('memory')):
             prompt.append("No specific context available. Relate your answer to the user's music career and goals.")
-        prompt.append(f"\nUser Query: {query}")
+        prompt.append(f"User Query: {query}")
         final_prompt = "\n\n".join(prompt)
-        logger.info(f"Final constructed prompt: {final_prompt[:200]}... (truncated)")
-        logger.debug(f"Full prompt sent to LLM: {final_prompt}")
+        logger.debug("Full prompt sent to LLM: %s", final_prompt)
         return final_prompt
 
-
+# Invariant leading block of every chat completion. It must stay byte-identical across
+# users and turns (no dates, names or retrieved text) so the provider can reuse the
+# cached prefix; everything volatile goes after the conversation history.
+SYSTEM_PROMPT = (
+    "You are not a generic AI. You are the user's dedicated personal manager for their music artist career. "
+    "Act as a comprehensive music manager for artists, overseeing all aspects of their careers. Provide strategic guidance on branding, marketing, release schedules, touring, collaborations, and fan engagement. Develop and critique business plans, assist with contract interpretation, plan music releases and promotional campaigns, and advise on financial planning for sustainability. Support day-to-day operations such as managing a team (e.g., publicists, producers, stylists), scheduling, and digital presence. "
+    "Never act as a generic AI. Always tailor your advice to the user's goals, context, and artist career. "
+    "If you lack information, ask clarifying questions as a manager would. "
+    "If you must rely on general knowledge, relate it to the music industry and the user's career.\n\n"
+    "Your role is to:\n"
+    "1. Provide informed, actionable advice based on music industry best practices\n"
+    "2. Help artists understand and leverage their personal data and documents\n"
+    "3. Offer strategic guidance for career development and business growth\n"
+    "4. Answer questions about music production, marketing, and business as a manager would\n"
+    "5. Be encouraging, supportive, and professional at all times\n\n"
+    "How to read the latest user message: it may start with a summary of earlier conversation, "
+    "followed by 'Global Knowledge (industry best practices)', 'Personal Knowledge (your data)' and "
+    "'Earlier Conversations (past exchanges with the user)' sections retrieved for this question, and ends "
+    "with 'User Query:'. Answer the query. Use the knowledge sections when they are relevant, prefer the "
+    "artist's personal data for specifics about them, treat earlier conversations as what was said before "
+    "rather than current facts, and never claim to have information that is not in the conversation or "
+    "those sections.\n\n"
+    "When responding:\n"
+    "- Be concise but thorough\n"
+    "- Focus on actionable, practical steps\n"
+    "- Maintain a professional, encouraging, and artist-focused tone"
+)
 
 # Global instance
 agent = Agent()
@@ -1,76 +1,163 @@
 import openai
 import os
-from typing import List, Dict, Optional
-from .qdrant_client import search_vectors
+import time
+from typing import List, Dict, Optional, Tuple
+from .vector_store import search_vectors
 from .ingestion import embed_text
+from .answer_cache import answer_cache
+from .usage import BudgetStatus, budget_status, record_usage, record_response_usage
+from .tracing import span, traced, current_span
+from .metrics import observe_upstream, track_in_flight
+from .model_registry import get_model, stage_model, model_router
+from .resilience import call_with_resilience, OPENAI_CHAT_TIMEOUT
 import logging
-import logging.config
-
-# Load logging configuration
-LOGGING_CONF_PATH = os.path.join(os.path.dirname(__file__), '../../logging.conf')
-if os.path.exists(LOGGING_CONF_PATH):
-    try:
-        logging.config.fileConfig(LOGGING_CONF_PATH, disable_existing_loggers=False)
-    except Exception as e:
-        # Fallback to basic logging if config fails
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s %(levelname)s %(name)s %(message)s',
-            handlers=[
-                logging.StreamHandler(),
-                logging.FileHandler('logs/ai_manager.log', mode='a') if os.path.exists('logs') else logging.StreamHandler()
-            ]
-        )
-else:
-    # Fallback to basic logging if config file doesn't exist
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s %(levelname)s %(name)s %(message)s',
-        handlers=[logging.StreamHandler()]
-    )
 
 logger = logging.getLogger('ai_manager')
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 openai.api_key = OPENAI_API_KEY
 
+# Completion length cap once a user is over the soft usage budget
+SOFT_BUDGET_MAX_TOKENS = int(os.getenv('SOFT_BUDGET_MAX_TOKENS', '300'))
+# Context window kept free for the completion (1000) and message framing
+RESERVED_TOKENS = 1200
+# History sent with a turn: at least HISTORY_WINDOW_MESSAGES, and the start of the window
+# only advances in steps of HISTORY_BLOCK_MESSAGES so consecutive turns share a cacheable prefix
+HISTORY_WINDOW_MESSAGES = int(os.getenv('HISTORY_WINDOW_MESSAGES', '10'))
+HISTORY_BLOCK_MESSAGES = int(os.getenv('HISTORY_BLOCK_MESSAGES', '10'))
+
+def history_window_start(message_count: int) -> int:
+    """
+    Index of the first earlier message to send as history. Between block boundaries the
+    window grows instead of sliding, so the system prompt plus history stays byte-identical
+    from one turn to the next.
+    """
+    if message_count <= HISTORY_WINDOW_MESSAGES:
+        return 0
+    return (message_count - HISTORY_WINDOW_MESSAGES) // HISTORY_BLOCK_MESSAGES * HISTORY_BLOCK_MESSAGES
+
 class AIService:
     def __init__(self):
-        self.model = "gpt-3.5-turbo"
-        self.max_context_length = 4000  # tokens
+        self.model = stage_model('chat_fast').name  # tokenizer and cache-hit accounting; completions are routed
+
+    def generate_response(self, user_message: str, conversation_history: List, user_id: int = None) -> str:
+        """Generate the AI response text. See generate_reply for the full result."""
+        return self.generate_reply(user_message, conversation_history, user_id=user_id)['text']
 
-    def generate_response(self, user_message: str, conversation_history: List[str], user_id: int = None) -> str:
+    @traced('ai.generate_reply')
+    @track_in_flight()
+    def generate_reply(self, user_message: str, conversation_history: List, user_id: int = None, recent_message_ids: List[int] = ()) -> Dict:
         """
-        Generate AI response using agentic hybrid RAG orchestration.
+        Generate AI response using agentic hybrid RAG orchestration. Repeated questions are
+        answered from the semantic answer cache without classification, retrieval or completion.
+        conversation_history holds the earlier turns, oldest first, as {'role', 'content'}
+        dicts (plain strings are read as alternating user/assistant turns); recent_message_ids
+        are their message ids, so long-term memory does not recall them a second time.
+        Returns {'text', 'usage', 'context'} where usage has prompt/cached/completion token
+        counts when a completion was made and context is a compact record of how the reply
+        was produced (intent, model, retrieved chunk references, stage timings).
+        Over the user's soft daily budget intent is classified by keywords and the completion
+        is shorter; over the hard budget only cached answers are served.
         """
         try:
             from .agent import agent
-            logger.info(f"Generating response for user_id={user_id} | user_message='{user_message}'")
+            started = time.perf_counter()
+            logger.info("Generating response for user_id=%s (%d chars)", user_id, len(user_message))
+            logger.debug("User message: %s", user_message)
+            budget = budget_status(user_id)
+            root = current_span()
+            if root:
+                root.set_attribute('budget.status', budget)
+            # 0. Semantic answer cache, keyed by the query embedding retrieval reuses below. The key
+            # holds no conversation, so turns with earlier history neither read nor feed it
+            query_embedding = None
+            if not conversation_history and answer_cache.enabled_for(user_message):
+                try:
+                    with span('ai.answer_cache_lookup') as stage:
+                        query_embedding = agent.embed_query(user_message, user_id=user_id)
+                        cached = answer_cache.lookup(query_embedding, user_id=user_id)
+                        if stage:
+                            stage.set_attribute('cache.hit', cached is not None)
+                    if cached is not None:
+                        total_ms = (time.perf_counter() - started) * 1000
+                        record_usage(user_id, 'generate', self.model, latency_ms=total_ms, cache_hit=True, route='cache')
+                        return {'text': cached.response, 'usage': {}, 'context': {'route': 'cache', 'timings_ms': {'total': round(total_ms, 1)}}}
+                except Exception as e:
+                    logger.warning("Answer cache lookup failed: %s", e)
+            if budget == BudgetStatus.HARD:
+                logger.info("User %s is over the hard usage budget; not generating", user_id)
+                return {'text': self._get_budget_response(), 'usage': {}, 'context': {'route': 'budget'}}
             # 1. Classify intent
-            intent = agent.classify_intent(user_message)
-            logger.debug(f"Intent classified: {intent}")
+            intent = agent.classify_intent(user_message, user_id=user_id, use_llm=budget == BudgetStatus.OK)
+            logger.debug("Intent classified: %s", intent)
             # 2. Retrieve context based on intent
-            context_dict = agent.retrieve_context(user_message, user_id=user_id, intent=intent, top_k=3)
-            logger.debug(f"Context retrieved: {context_dict}")
-            # 3. Build prompt with clear source separation
-            system_prompt = agent.build_prompt(context_dict, user_message)
-            logger.debug(f"System prompt constructed: {system_prompt}")
-            # 4. Build messages for OpenAI API
-            messages = self._build_messages(system_prompt, conversation_history, user_message)
-            logger.debug(f"Messages sent to LLM: {messages}")
-            # 5. Generate response
-            response = openai.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.7,
-                top_p=0.9
-            )
-            logger.info(f"LLM response received for user_id={user_id}")
-            return response.choices[0].message.content.strip()
+            retrieval_started = time.perf_counter()
+            sources = []
+            context_dict = agent.retrieve_context(user_message, user_id=user_id, intent=intent, top_k=3, query_embedding=query_embedding, sources=sources, exclude_message_ids=recent_message_ids)
+            retrieval_ms = (time.perf_counter() - retrieval_started) * 1000
+            logger.debug("Context retrieved: %s", context_dict)
+            # 3. Build the volatile prompt (context + query) with clear source separation
+            prompt = agent.build_prompt(context_dict, user_message)
+            # 4. Route to a chat model by turn complexity, load, budget and the tokens of the untrimmed turn
+            measured = self._measure(prompt, conversation_history)
+            route = model_router.route(user_message, conversation_history, prompt_tokens=measured[0] + sum(measured[2]) + RESERVED_TOKENS, budget=budget)
+            # 5. Build messages for OpenAI API: static block, history, volatile turn, within the routed model's window
+            with span('ai.build_messages', **{'history.turns': len(conversation_history)}):
+                messages = self._build_messages(prompt, conversation_history, model=route.model, measured=measured)
+            logger.debug("Messages sent to LLM: %s", messages)
+            # 6. Generate response
+            generation_started = time.perf_counter()
+            with (span('ai.completion', model=route.model, route=route.name, reason=route.reason) as stage,
+                  observe_upstream('openai', 'completion'), model_router.generating(route)):
+                response = call_with_resilience(
+                    'openai', openai.chat.completions.create,
+                    model=route.model,
+                    messages=messages,
+                    max_tokens=1000 if budget == BudgetStatus.OK else SOFT_BUDGET_MAX_TOKENS,
+                    temperature=0.7,
+                    top_p=0.9,
+                    timeout=OPENAI_CHAT_TIMEOUT
+                )
+                if stage:
+                    for key, value in self._usage(response).items():
+                        stage.set_attribute(f"llm.{key}", value)
+            completion_ms = (time.perf_counter() - generation_started) * 1000
+            record_response_usage(user_id, 'generate', route.model, response, completion_ms, route=route.name)
+            logger.info("LLM response received for user_id=%s", user_id)
+            answer = response.choices[0].message.content.strip()
+            # Over the soft budget the answer is shorter and keyword-classified: not worth serving again.
+            # Recalled exchanges tie the answer to the user's past chats just as history would
+            if query_embedding is not None and budget == BudgetStatus.OK and not context_dict.get('memory'):
+                try:
+                    answer_cache.store(query_embedding, user_id, intent, user_message, answer, (time.perf_counter() - started) * 1000)
+                except Exception as e:
+                    logger.warning("Answer cache store failed: %s", e)
+            return {
+                'text': answer,
+                'usage': self._usage(response),
+                'context': {
+                    'intent': intent, 'model': route.model, 'route': route.name, 'sources': sources,
+                    'timings_ms': {
+                        'retrieval': round(retrieval_ms, 1), 'completion': round(completion_ms, 1),
+                        'total': round((time.perf_counter() - started) * 1000, 1),
+                    },
+                },
+            }
         except Exception as e:
-            logger.exception(f"Error generating AI response (agentic) for user_id={user_id} | user_message='{user_message}'")
-            return self._get_fallback_response(user_message)
+            logger.exception("Error generating AI response (agentic) for user_id=%s", user_id)
+            return {'text': self._get_fallback_response(user_message), 'usage': {}, 'context': {'route': 'fallback'}}
+
+    def _usage(self, response) -> Dict:
+        """Prompt, cached-prompt and completion token counts reported by the API."""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return {}
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return {
+            'prompt_tokens': usage.prompt_tokens,
+            'cached_tokens': getattr(details, 'cached_tokens', None) or 0,
+            'completion_tokens': usage.completion_tokens,
+        }
 
     
     def _retrieve_context(self, query: str, user_id: int = None) -> str:
@@ -88,7 +175,7 @@ class AIService:
             # Search personal knowledgebase if user_id provided
             personal_context = ""
             if user_id:
-                personal_results = search_vectors(query_embedding, collection='personal_kb', top=3)
+                personal_results = search_vectors(query_embedding, collection='personal_kb', top=3, user_id=user_id)
                 # Filter results for this user
                 filtered_results = [r for r in personal_results.get('result', []) 
                                   if r['payload'].get('user_id') == user_id]
@@ -104,7 +191,7 @@ class AIService:
             return combined_context.strip()
             
         except Exception as e:
-            print(f"Error retrieving context: {e}")
+            logger.error("Error retrieving context: %s", e)
             return ""
     
     def _extract_context_from_results(self, results: Dict) -> str:
@@ -116,80 +203,56 @@ class AIService:
                     context_parts.append(result['payload']['chunk'])
             return "\n".join(context_parts)
         except Exception as e:
-            print(f"Error extracting context: {e}")
+            logger.error("Error extracting context: %s", e)
             return ""
     
-    def _build_system_prompt(self, context: str) -> str:
-        """Build the system prompt with context"""
-        base_prompt = """
-You are not a generic AI assistant. You are the user's dedicated personal manager for their music artist career. Your sole purpose is to help this specific artist with their career development, creative process, and business strategies. You must always:
-
-- Act as a professional, supportive, and proactive personal manager for music artists.
-- Use both global music industry knowledge and the artist's personal documents and information to provide advice.
-- Never refer to yourself as an AI. Never give generic, vague, or impersonal answers.
-- Always tailor your advice to the user's goals, context, and artist career. If you lack information, ask clarifying questions as a manager would.
-- If you must rely on general knowledge, always relate it back to the music industry and the user's career.
-
-Your role is to:
-1. Provide informed, actionable advice based on music industry best practices
-2. Help artists understand and leverage their personal data and documents
-3. Offer strategic guidance for career development and business growth
-4. Answer questions about music production, marketing, and business as a manager would
-5. Be encouraging, supportive, and professional at all times
-
-When responding:
-- Use the provided context to give relevant, specific, and personalized advice
-- If the context doesn't contain relevant information, relate your response to the user's music career and goals
-- Be concise but thorough
-- Focus on actionable, practical steps
-- Maintain a professional, encouraging, and artist-focused tone
-- Never act as a generic AI assistant. Reiterate your role as the user's personal manager for music artists if needed.
-
-Available Context Information:
-"""
-        
-        if context:
-            return base_prompt + f"\n{context}\n\nUse this context to provide relevant, personalized advice."
-        else:
-            return base_prompt + "\nNo specific context available. Rely on your general knowledge of the music industry."
-    
-    def _build_messages(self, system_prompt: str, conversation_history: List[str], user_message: str) -> List[Dict]:
-        """Build messages array for OpenAI API with dynamic context windowing and summarization."""
+    def _measure(self, prompt: str, conversation_history: List) -> Tuple[int, List[Dict], List[int]]:
+        """Tokens of the system prompt plus volatile turn, the history as turns, and the tokens of each turn."""
         import tiktoken
+        from .agent import SYSTEM_PROMPT
         encoding = tiktoken.encoding_for_model(self.model)
-        max_tokens = self.max_context_length
-        # Reserve tokens for system prompt and LLM output
-        reserved_tokens = 1200  # 1000 for output, 200 for prompt overhead
-        used_tokens = len(encoding.encode(system_prompt)) + len(encoding.encode(user_message))
-        messages = [{"role": "system", "content": system_prompt}]
-
-        # Estimate tokens for each conversation message
-        history_tokens = [len(encoding.encode(m)) for m in conversation_history]
+        turns = [self._as_turn(i, m) for i, m in enumerate(conversation_history)]
+        return (
+            len(encoding.encode(SYSTEM_PROMPT)) + len(encoding.encode(prompt)),
+            turns,
+            [len(encoding.encode(t['content'])) for t in turns],
+        )
+
+    def _build_messages(self, prompt: str, conversation_history: List, model: str = None, measured: Tuple = None) -> List[Dict]:
+        """
+        Build messages array for OpenAI API with dynamic context windowing and summarization.
+        History is trimmed to fit the context window of model (the fast chat model by default);
+        pass measured from _measure to avoid tokenizing twice.
+        Layout for prefix caching: the invariant SYSTEM_PROMPT first, then history turns in
+        chronological order, and last a single user turn with everything volatile
+        (summary of trimmed history, retrieved context and the query).
+        """
+        from .agent import SYSTEM_PROMPT
+        max_tokens = get_model(model or self.model).context_window
+        used_tokens, turns, history_tokens = measured or self._measure(prompt, conversation_history)
         cum_tokens = used_tokens
-        selected = []
+        first_kept = len(turns)
         # Add as many recent messages as possible without exceeding token budget
-        for i in range(len(conversation_history)-1, -1, -1):
-            if cum_tokens + history_tokens[i] + reserved_tokens > max_tokens:
+        for i in range(len(turns)-1, -1, -1):
+            if cum_tokens + history_tokens[i] + RESERVED_TOKENS > max_tokens:
                 break
-            selected.append((i, conversation_history[i]))
+            first_kept = i
             cum_tokens += history_tokens[i]
-        selected = sorted(selected)  # maintain chronological order
-
-        # If not all history fits, summarize the omitted portion
-        if len(selected) < len(conversation_history):
-            omitted = conversation_history[:len(conversation_history)-len(selected)]
-            summary = self._summarize_history(omitted)
-            messages.append({"role": "user", "content": f"Summary of earlier conversation: {summary}"})
 
-        # Add selected messages (alternating roles)
-        for idx, message in selected:
-            role = "user" if idx % 2 == 0 else "assistant"
-            messages.append({"role": role, "content": message})
-
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        messages.extend(turns[first_kept:])
+        # If not all history fits, summarize the omitted portion inside the volatile turn
+        if first_kept > 0:
+            summary = self._summarize_history([t['content'] for t in turns[:first_kept]])
+            prompt = f"Summary of earlier conversation: {summary}\n\n{prompt}"
+        messages.append({"role": "user", "content": prompt})
         return messages
 
+    def _as_turn(self, index: int, message) -> Dict:
+        if isinstance(message, dict):
+            return {"role": message['role'], "content": message['content']}
+        return {"role": "user" if index % 2 == 0 else "assistant", "content": message}
+
     def _summarize_history(self, history: list) -> str:
         """Summarize omitted conversation history for context windowing."""
         if not history:
@@ -201,6 +264,10 @@ Available Context Information:
         return joined
 
     
+    def _get_budget_response(self) -> str:
+        """Response when the user has used up today's hard usage budget"""
+        return "You've reached today's usage limit for new answers. Previously answered questions still work, and your limit resets tomorrow."
+
     def _get_fallback_response(self, user_message: str) -> str:
         """Fallback response when AI generation fails"""
         return f"I apologize, but I'm having trouble processing your request right now. You said: '{user_message}'. Please try again in a moment, or feel free to ask a different question about your music career or creative process."
@@ -0,0 +1,143 @@
+import os
+import logging
+import threading
+import numpy as np
+from datetime import timedelta
+from typing import List, Optional
+from django.db.models import F, Max, Count
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from ..models import SemanticCacheEntry, SemanticCacheStat
+from .metrics import cache_lookups
+
+logger = logging.getLogger('ai_manager')
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', str(24 * 3600)))  # seconds
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '500'))  # per scope
+# Short turns ("tell me more", "why?") depend on the conversation, not just the text
+ANSWER_CACHE_MIN_CHARS = int(os.getenv('ANSWER_CACHE_MIN_CHARS', '24'))
+
+GLOBAL_SCOPE = 'global'
+
+def user_scope(user_id: int) -> str:
+    return f"user:{user_id}"
+
+class SemanticAnswerCache:
+    """
+    Caches final answers keyed by query embedding. The key holds no conversation, so only
+    answers built without history or recalled exchanges are stored. Global-intent answers are
+    shared by every user; all other answers are scoped to the user whose KB built them.
+    Each process keeps a matrix of the live embeddings per scope and only re-reads the
+    table when the scope's (max id, count) fingerprint changes.
+    """
+    def __init__(self):
+        self._matrices = {}
+        self._lock = threading.Lock()
+
+    def enabled_for(self, query: str) -> bool:
+        return ANSWER_CACHE_ENABLED and len(query.strip()) >= ANSWER_CACHE_MIN_CHARS
+
+    def _live(self, scope: str):
+        return SemanticCacheEntry.objects.filter(
+            scope=scope, created_at__gte=timezone.now() - timedelta(seconds=ANSWER_CACHE_TTL)
+        )
+
+    def _scope_matrix(self, scope: str):
+        """(ids, matrix) of the scope's unexpired embeddings, refreshed incrementally."""
+        live = self._live(scope)
+        fingerprint = live.aggregate(max_id=Max('id'), count=Count('id'))
+        with self._lock:
+            cached = self._matrices.get(scope)
+        if cached and cached[0] == fingerprint:
+            return cached[1], cached[2]
+        rows = None
+        if cached and cached[2] is not None:
+            new_rows = list(live.filter(id__gt=cached[0]['max_id']).order_by('id').values_list('id', 'embedding'))
+            if len(cached[1]) + len(new_rows) == fingerprint['count']:
+                # Only additions since the last load: append them
+                ids = cached[1] + [r[0] for r in new_rows]
+                matrix = np.vstack([cached[2]] + [np.frombuffer(bytes(r[1]), dtype=np.float32) for r in new_rows])
+                rows = new_rows
+        if rows is None:
+            # Deletions or expiry: reload the scope
+            rows = list(live.order_by('id').values_list('id', 'embedding'))
+            ids = [r[0] for r in rows]
+            matrix = np.vstack([np.frombuffer(bytes(r[1]), dtype=np.float32) for r in rows]) if rows else None
+        with self._lock:
+            self._matrices[scope] = (fingerprint, ids, matrix)
+        return ids, matrix
+
+    def lookup(self, embedding: List[float], user_id: Optional[int] = None):
+        """Best cached entry at or above the similarity threshold, or None."""
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        best_id, best_score = None, -1.0
+        for scope in [GLOBAL_SCOPE] + ([user_scope(user_id)] if user_id else []):
+            ids, matrix = self._scope_matrix(scope)
+            if matrix is None or matrix.shape[1] != len(query):
+                continue
+            scores = matrix @ query
+            i = int(np.argmax(scores))
+            if scores[i] > best_score:
+                best_id, best_score = ids[i], float(scores[i])
+
+        today = timezone.localdate()
+        SemanticCacheStat.objects.get_or_create(date=today)
+        entry = None
+        if best_id is not None and best_score >= ANSWER_CACHE_THRESHOLD:
+            entry = SemanticCacheEntry.objects.filter(id=best_id).first()
+        if entry is None:
+            SemanticCacheStat.objects.filter(date=today).update(lookups=F('lookups') + 1)
+            cache_lookups.labels('answer', 'miss').inc()
+            return None
+        SemanticCacheEntry.objects.filter(id=entry.id).update(hits=F('hits') + 1, last_hit_at=timezone.now())
+        hit_field = 'global_hits' if entry.scope == GLOBAL_SCOPE else 'personal_hits'
+        SemanticCacheStat.objects.filter(date=today).update(
+            lookups=F('lookups') + 1,
+            latency_saved_ms=F('latency_saved_ms') + entry.generation_ms,
+            **{hit_field: F(hit_field) + 1}
+        )
+        cache_lookups.labels('answer', 'hit').inc()
+        logger.info("Answer cache hit in %s (similarity %.3f)", entry.scope, best_score)
+        return entry
+
+    def store(self, embedding: List[float], user_id: Optional[int], intent: str, query: str, response: str, generation_ms: float):
+        """Cache an answer under the scope its context came from, then evict over the cap."""
+        if intent == 'global':
+            scope = GLOBAL_SCOPE
+        elif user_id:
+            scope = user_scope(user_id)
+        else:
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        SemanticCacheEntry.objects.create(
+            scope=scope, intent=intent, query=query, embedding=vector.tobytes(),
+            response=response, generation_ms=generation_ms
+        )
+        self.evict(scope)
+
+    def evict(self, scope: str):
+        """Drop expired entries and keep the ANSWER_CACHE_MAX_ENTRIES most recently used."""
+        entries = SemanticCacheEntry.objects.filter(scope=scope)
+        entries.filter(created_at__lt=timezone.now() - timedelta(seconds=ANSWER_CACHE_TTL)).delete()
+        stale = list(
+            entries.annotate(used_at=Coalesce('last_hit_at', 'created_at'))
+            .order_by('-used_at').values_list('id', flat=True)[ANSWER_CACHE_MAX_ENTRIES:]
+        )
+        if stale:
+            SemanticCacheEntry.objects.filter(id__in=stale).delete()
+
+    def invalidate_global(self):
+        """The global KB feeds every answer, so a change there clears all scopes."""
+        deleted, _ = SemanticCacheEntry.objects.all().delete()
+        logger.info("Global KB changed: cleared %s cached answers", deleted)
+
+    def invalidate_user(self, user_id: int):
+        deleted, _ = SemanticCacheEntry.objects.filter(scope=user_scope(user_id)).delete()
+        logger.info("Personal KB of user %s changed: cleared %s cached answers", user_id, deleted)
+
+# Global instance
+answer_cache = SemanticAnswerCache()
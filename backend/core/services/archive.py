@@ -0,0 +1,170 @@
+import os
+import json
+import zlib
+import logging
+from datetime import timedelta
+from typing import List, Tuple
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from ..models import Conversation, ConversationArchive, Message
+
+try:
+    import zstandard
+except ImportError:  # zlib is always available; zstd compresses chat text better and faster
+    zstandard = None
+
+logger = logging.getLogger('ai_manager')
+
+# Conversations without a message for ARCHIVE_IDLE_DAYS move to the compressed archive
+ARCHIVE_IDLE_DAYS = int(os.getenv('ARCHIVE_IDLE_DAYS', '90'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '200'))
+ARCHIVE_ZSTD_LEVEL = int(os.getenv('ARCHIVE_ZSTD_LEVEL', '10'))
+
+# Archived messages stay searchable through an index that holds no text (migration 0015): a
+# contentless FTS5 table on SQLite, a tsvector table on PostgreSQL. Its row id packs the
+# conversation id with the message's position in the archive, so a hit is read back from the blob.
+ARCHIVE_POSITION_BITS = 32
+
+MESSAGE_FIELDS = ['id', 'sender', 'text', 'timestamp', 'context', 'prompt_tokens', 'cached_tokens', 'completion_tokens']
+
+def compress(raw: bytes) -> Tuple[str, bytes]:
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(raw)
+    return 'zlib', zlib.compress(raw, 9)
+
+def decompress(codec: str, payload: bytes) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Archive is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+def _encode(messages: List[Message]) -> bytes:
+    lines = []
+    for m in messages:
+        row = {field: getattr(m, field) for field in MESSAGE_FIELDS}
+        row['timestamp'] = m.timestamp.isoformat()
+        lines.append(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+    return '\n'.join(lines).encode('utf-8')
+
+def archive_row_id(conversation_id: int, position: int) -> int:
+    return (conversation_id << ARCHIVE_POSITION_BITS) | position
+
+def read_archive(archive: ConversationArchive) -> List[dict]:
+    """The archived messages in stored order, timestamps still ISO strings."""
+    raw = decompress(archive.codec, bytes(archive.payload)).decode('utf-8')
+    return [json.loads(line) for line in raw.splitlines() if line]
+
+def index_archived_messages(conversation_id: int, user_id: int, texts: List[str]):
+    """Add an archive's messages (in stored order) to the archived-message search index."""
+    rows = [(archive_row_id(conversation_id, i), text) for i, text in enumerate(texts)]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.executemany(
+                "INSERT INTO core_message_archive_fts(rowid, text, owner) VALUES (%s, %s, %s)",
+                [(row_id, text, f"u{user_id}") for row_id, text in rows]
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.executemany(
+                "INSERT INTO core_message_archive_search(id, search_vector) VALUES (%s, to_tsvector('english', %s))", rows
+            )
+
+def unindex_archive(archive: ConversationArchive):
+    """Drop an archive's messages from the search index before the archive is deleted."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # A contentless table deletes by the values that were indexed
+            user_id = Conversation.objects.filter(id=archive.conversation_id).values_list('user_id', flat=True).first()
+            cursor.executemany(
+                "INSERT INTO core_message_archive_fts(core_message_archive_fts, rowid, text, owner) VALUES ('delete', %s, %s, %s)",
+                [(archive_row_id(archive.conversation_id, i), row['text'], f"u{user_id}") for i, row in enumerate(read_archive(archive))]
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                "DELETE FROM core_message_archive_search WHERE id >= %s AND id < %s",
+                [archive_row_id(archive.conversation_id, 0), archive_row_id(archive.conversation_id + 1, 0)]
+            )
+
+def archived_messages(row_ids) -> dict:
+    """Archived messages by search index row id, read from their archives."""
+    wanted = {}
+    for row_id in row_ids:
+        wanted.setdefault(row_id >> ARCHIVE_POSITION_BITS, []).append(row_id)
+    found = {}
+    for archive in ConversationArchive.objects.filter(conversation_id__in=list(wanted)):
+        rows = read_archive(archive)
+        for row_id in wanted[archive.conversation_id]:
+            position = row_id & ((1 << ARCHIVE_POSITION_BITS) - 1)
+            if position < len(rows):
+                found[row_id] = rows[position]
+    return found
+
+def archive_conversation(conversation: Conversation) -> ConversationArchive:
+    """Move the conversation's messages into one compressed JSONL blob and drop them from the hot table."""
+    with transaction.atomic():
+        messages = list(Message.objects.filter(conversation=conversation).order_by('timestamp', 'id'))
+        raw = _encode(messages)
+        codec, payload = compress(raw)
+        archive = ConversationArchive.objects.create(
+            conversation=conversation, codec=codec, payload=payload, message_count=len(messages),
+            last_message_at=messages[-1].timestamp if messages else None, raw_bytes=len(raw)
+        )
+        Message.objects.filter(id__in=[m.id for m in messages]).delete()
+        index_archived_messages(conversation.id, conversation.user_id, [m.text for m in messages])
+        conversation.archived_at = timezone.now()
+        conversation.save(update_fields=['archived_at'])
+    logger.info("Archived conversation %s: %d messages, %d -> %d bytes (%s)",
+                conversation.id, len(messages), len(raw), len(payload), codec)
+    return archive
+
+def rehydrate(conversation: Conversation) -> int:
+    """Restore an archived conversation's messages with their original ids and timestamps."""
+    with transaction.atomic():
+        archive = ConversationArchive.objects.select_for_update().filter(conversation=conversation).first()
+        if archive is None:
+            # Another request got here first
+            conversation.archived_at = None
+            return 0
+        rows = read_archive(archive)
+        timestamps = {row['id']: parse_datetime(row.pop('timestamp')) for row in rows}
+        messages = Message.objects.bulk_create([Message(conversation=conversation, **row) for row in rows])
+        # auto_now_add stamps bulk_create with the current time; put the original times back
+        for m in messages:
+            m.timestamp = timestamps[m.id]
+        Message.objects.bulk_update(messages, ['timestamp'], batch_size=500)
+        archive.delete()
+        conversation.archived_at = None
+        conversation.save(update_fields=['archived_at'])
+    logger.info("Rehydrated conversation %s: %d messages", conversation.id, len(rows))
+    return len(rows)
+
+def ensure_hot(conversation: Conversation) -> Conversation:
+    """Rehydrate the conversation first if it is archived; call before reading or adding messages."""
+    if conversation.archived_at is not None:
+        rehydrate(conversation)
+    return conversation
+
+def idle_conversations(idle_days: int = ARCHIVE_IDLE_DAYS):
+    """Hot conversations whose last message is older than idle_days (empty ones are left alone)."""
+    cutoff = timezone.now() - timedelta(days=idle_days)
+    return (
+        Conversation.objects.filter(archived_at__isnull=True)
+        .annotate(last_message_at=Max('messages__timestamp'))
+        .filter(last_message_at__lt=cutoff)
+        .order_by('id')
+    )
+
+def archive_idle(idle_days: int = ARCHIVE_IDLE_DAYS, limit: int = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Archive idle conversations, one transaction per conversation, batch_size at a time."""
+    archived = 0
+    while limit is None or archived < limit:
+        take = batch_size if limit is None else min(batch_size, limit - archived)
+        batch = list(idle_conversations(idle_days)[:take])
+        if not batch:
+            break
+        for conversation in batch:
+            archive_conversation(conversation)
+        archived += len(batch)
+    return archived
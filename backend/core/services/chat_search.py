@@ -0,0 +1,133 @@
+import os
+import re
+import logging
+from typing import Dict, List
+from django.db import connection
+from ..models import Message
+from .archive import archived_messages
+
+logger = logging.getLogger('ai_manager')
+
+CHAT_SEARCH_PAGE_SIZE = int(os.getenv('CHAT_SEARCH_PAGE_SIZE', '20'))
+CHAT_SEARCH_MAX_PAGE_SIZE = 100
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+# Ranked matches of the user's messages. SQLite uses the FTS5 table from migration 0013
+# (bm25 on the text column, lower is better); PostgreSQL the generated search_vector
+# column (ts_rank_cd). The second half of each query matches archived messages through the
+# text-less index of migration 0015; their rows carry only the index row id (archive_row),
+# and the message itself is read back from its archive.
+SQLITE_SEARCH = """
+    SELECT m.id AS id, m.conversation_id, c.title, m.sender, m.timestamp,
+           snippet(core_message_fts, 0, '[', ']', '…', 16), bm25(core_message_fts, 1.0, 0.0) AS rank, NULL AS archive_row
+    FROM core_message_fts
+    JOIN core_message m ON m.id = core_message_fts.rowid
+    JOIN core_conversation c ON c.id = m.conversation_id
+    WHERE core_message_fts MATCH %s AND c.user_id = %s
+    UNION ALL
+    SELECT NULL, c.id, c.title, NULL, NULL, NULL, bm25(core_message_archive_fts, 1.0, 0.0), core_message_archive_fts.rowid
+    FROM core_message_archive_fts
+    JOIN core_conversation c ON c.id = core_message_archive_fts.rowid >> 32
+    WHERE core_message_archive_fts MATCH %s AND c.user_id = %s
+    ORDER BY rank, id DESC, archive_row DESC
+    LIMIT %s OFFSET %s
+"""
+POSTGRES_SEARCH = """
+    SELECT m.id AS id, m.conversation_id, c.title, m.sender, m.timestamp,
+           ts_headline('english', m.text, q, 'StartSel=[, StopSel=], MaxFragments=1, MaxWords=24'),
+           ts_rank_cd(m.search_vector, q) AS rank, NULL::bigint AS archive_row
+    FROM core_message m
+    JOIN core_conversation c ON c.id = m.conversation_id,
+         websearch_to_tsquery('english', %s) q
+    WHERE m.search_vector @@ q AND c.user_id = %s
+    UNION ALL
+    SELECT NULL, c.id, c.title, NULL, NULL, NULL, ts_rank_cd(a.search_vector, q), a.id
+    FROM core_message_archive_search a
+    JOIN core_conversation c ON c.id = (a.id >> 32),
+         websearch_to_tsquery('english', %s) q
+    WHERE a.search_vector @@ q AND c.user_id = %s
+    ORDER BY rank DESC, id DESC NULLS LAST, archive_row DESC
+    LIMIT %s OFFSET %s
+"""
+
+def fts5_query(text: str, user_id: int) -> str:
+    """
+    Plain words to an FTS5 query over the user's messages: every word must match in the
+    text, after porter stemming. Quoting keeps FTS5 operators in user input inert. There is
+    no prefix matching: FTS5 merges the doclists of every term sharing a prefix before
+    narrowing to the owner, which makes cost follow the whole table instead of the user.
+    """
+    tokens = TOKEN.findall(text)
+    if not tokens:
+        return ''
+    terms = ' '.join(f'"{t}"' for t in tokens)
+    return f"owner : u{int(user_id)} AND text : ({terms})"
+
+def highlight(text: str, query: str, words: int = 16) -> str:
+    """
+    snippet() for archived messages, whose text is not in the index: up to `words` words
+    around the first query term, matches in [brackets]. Terms match on a prefix of at least
+    four characters, a rough stand-in for the index's porter stemming.
+    """
+    stems = [t.lower()[:max(4, len(t) - 3)] for t in TOKEN.findall(query)]
+    tokens = text.split()
+    matches = [i for i, token in enumerate(tokens) if any(token.lower().lstrip('"\'(').startswith(s) for s in stems)]
+    start = max(0, (matches[0] if matches else 0) - words // 4)
+    window = [f"[{t}]" if i + start in matches else t for i, t in enumerate(tokens[start:start + words])]
+    return ('…' if start else '') + ' '.join(window) + ('…' if start + words < len(tokens) else '')
+
+def search_messages(user_id: int, query: str, page: int = 1, page_size: int = CHAT_SEARCH_PAGE_SIZE) -> Dict:
+    """One page of the user's messages matching query, best first, with highlighted snippets."""
+    if connection.vendor == 'sqlite':
+        match = fts5_query(query, user_id)
+        sql, params = SQLITE_SEARCH, [match]
+    elif connection.vendor == 'postgresql':
+        match = query
+        sql, params = POSTGRES_SEARCH, [match]
+    else:
+        return scan_messages(user_id, query, page=page, page_size=page_size)
+    if not match.strip():
+        return {'results': [], 'page': page, 'next_page': None}
+    offset = (page - 1) * page_size
+    with connection.cursor() as cursor:
+        # One extra row tells whether there is a next page without counting all matches
+        cursor.execute(sql, params + [user_id] + params + [user_id, page_size + 1, offset])
+        rows = cursor.fetchall()
+    archived = archived_messages([row[7] for row in rows[:page_size] if row[7] is not None])
+    results: List[Dict] = []
+    for row in rows[:page_size]:
+        if row[7] is None:
+            message_id, sender, timestamp, snippet = row[0], row[3], row[4], row[5]
+        elif row[7] in archived:
+            message = archived[row[7]]
+            message_id, sender, timestamp, snippet = message['id'], message['sender'], message['timestamp'], highlight(message['text'], query)
+        else:
+            continue  # rehydrated or deleted since the query ran
+        results.append({
+            'message_id': message_id, 'conversation_id': row[1], 'conversation_title': row[2],
+            'sender': sender, 'timestamp': timestamp, 'snippet': snippet, 'rank': float(row[6]),
+        })
+    return {'results': results, 'page': page, 'next_page': page + 1 if len(rows) > page_size else None}
+
+def scan_messages(user_id: int, query: str, page: int = 1, page_size: int = CHAT_SEARCH_PAGE_SIZE) -> Dict:
+    """
+    search_messages on databases without a full-text index: messages containing every word,
+    newest first, by a case-insensitive scan. Archived conversations are not searched.
+    """
+    tokens = TOKEN.findall(query)
+    if not tokens:
+        return {'results': [], 'page': page, 'next_page': None}
+    messages = Message.objects.filter(conversation__user_id=user_id)
+    for token in tokens:
+        messages = messages.filter(text__icontains=token)
+    offset = (page - 1) * page_size
+    rows = list(
+        messages.select_related('conversation').only('id', 'sender', 'text', 'timestamp', 'conversation__title')
+        .order_by('-timestamp', '-id')[offset:offset + page_size + 1]
+    )
+    results = [{
+        'message_id': m.id, 'conversation_id': m.conversation_id, 'conversation_title': m.conversation.title,
+        'sender': m.sender, 'timestamp': m.timestamp, 'snippet': highlight(m.text, query), 'rank': 0.0,
+    } for m in rows[:page_size]]
+    return {'results': results, 'page': page, 'next_page': page + 1 if len(rows) > page_size else None}
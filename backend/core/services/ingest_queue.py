@@ -0,0 +1,121 @@
+import os
+import time
+import queue
+import logging
+import threading
+from django.db import close_old_connections
+from ..models import GlobalKnowledgeDocument, PersonalKnowledgeDocument
+from .activity import bump
+from .ingestion import ingest_document, INGEST_STAGE_PROGRESS
+from .vector_store import upsert_vectors
+from .answer_cache import answer_cache
+from .metrics import queue_depth
+
+logger = logging.getLogger('ai_manager')
+
+# Uploads return once the file is stored; these threads extract, embed and index it,
+# recording ingest_status/ingest_progress on the document for the upload pages to poll.
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '2'))
+
+DOCUMENT_MODELS = {'global': GlobalKnowledgeDocument, 'personal': PersonalKnowledgeDocument}
+COLLECTIONS = {'global': 'global_kb', 'personal': 'personal_kb'}
+
+def _update(model, doc_id, **fields):
+    model.objects.filter(id=doc_id).update(**fields)
+
+def ingest(kind: str, doc_id: int) -> int:
+    """Ingest one uploaded document ('global' or 'personal'); returns the number of chunks indexed."""
+    model = DOCUMENT_MODELS[kind]
+    doc = model.objects.filter(id=doc_id).first()
+    if doc is None:
+        return 0  # deleted before its turn
+    is_global = kind == 'global'
+
+    def progress(stage, fraction):
+        _update(model, doc_id, ingest_status=stage, ingest_progress=round(fraction, 3))
+
+    try:
+        with doc.file.open('rb') as file_field:
+            chunks = ingest_document(
+                file_field,
+                doc.file_type,
+                doc_metadata={'doc_id': doc.id, 'title': doc.title, 'file_type': doc.file_type},
+                user_id=None if is_global else doc.owner_id,
+                is_global=is_global,
+                progress=progress
+            )
+        vectors = [
+            {'embedding': c['metadata']['embeddings'][0], 'chunk': c['chunk'], 'metadata': c['metadata']}
+            for c in chunks if c['metadata'].get('embeddings') and c['metadata']['embeddings'][0] is not None
+        ]
+        if not vectors:
+            raise ValueError('No text could be extracted from the document.')
+        progress('indexing', INGEST_STAGE_PROGRESS['indexing'])
+        if not model.objects.filter(id=doc_id).exists():
+            return 0  # deleted while it was being embedded
+        upsert_vectors(vectors, collection=COLLECTIONS[kind])
+    except Exception as e:
+        logger.exception("Ingesting %s document %s failed: %s", kind, doc_id, e)
+        _update(model, doc_id, ingest_status='failed', ingest_error=str(e)[:500])
+        return 0
+    # num_chunks is remembered so the chunk counter can be decremented when the document is deleted
+    _update(model, doc_id, ingest_status='ready', ingest_progress=1.0, ingest_error='',
+            metadata={**doc.metadata, 'num_chunks': len(vectors)})
+    # Answers cached while the document was still being ingested did not see it
+    if is_global:
+        answer_cache.invalidate_global()
+    else:
+        answer_cache.invalidate_user(doc.owner_id)
+        bump(doc.owner_id, active=False, chunks=len(vectors))
+    return len(vectors)
+
+class IngestionQueue:
+    """
+    Runs ingest() for uploaded documents on INGEST_WORKERS background threads. The queue is
+    in-process like the chat memory indexer's: documents left queued when a worker dies are
+    picked up by the ingest_pending command.
+    """
+    def __init__(self, workers: int = INGEST_WORKERS, max_queue: int = 1000):
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def enqueue(self, kind: str, doc_id: int):
+        self._ensure_threads()
+        try:
+            self._queue.put_nowait((kind, doc_id))
+        except queue.Full:
+            logger.warning("Ingestion queue full, %s document %s stays queued until ingest_pending runs", kind, doc_id)
+        queue_depth.labels('ingestion').set(self._queue.qsize())
+
+    def _ensure_threads(self):
+        if sum(t.is_alive() for t in self._threads) < self.workers:
+            with self._lock:
+                self._threads = [t for t in self._threads if t.is_alive()]
+                while len(self._threads) < self.workers:
+                    thread = threading.Thread(target=self._run, name=f"ingestion-{len(self._threads)}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            kind, doc_id = self._queue.get()
+            close_old_connections()
+            try:
+                ingest(kind, doc_id)
+            except Exception as e:
+                logger.warning("Ingestion worker failed on %s document %s: %s", kind, doc_id, e)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+            queue_depth.labels('ingestion').set(self._queue.qsize())
+
+    def flush(self, timeout: float = 30.0):
+        """Block until queued documents are ingested (tests and management commands)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+# Global instance
+ingestion_queue = IngestionQueue()
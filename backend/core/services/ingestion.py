@@ -1,17 +1,28 @@
 import openai
 import os
-from typing import List, Dict
+import time
+from typing import Callable, List, Dict
 import tiktoken
 from PyPDF2 import PdfReader
 import docx
 import torch
 from transformers import AutoTokenizer, AutoModel
+from .usage import record_response_usage
+from .tracing import span, traced
+from .metrics import observe_upstream, embedding_batch_size
+from .model_registry import stage_model
+from .resilience import call_with_resilience, OPENAI_EMBEDDING_TIMEOUT
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 openai.api_key = OPENAI_API_KEY
+# Chunks per embedding request while ingesting a document; progress is reported after each
+INGEST_EMBED_BATCH_SIZE = int(os.getenv('INGEST_EMBED_BATCH_SIZE', '64'))
+# Share of a document's ingestion progress reached when each stage starts
+INGEST_STAGE_PROGRESS = {'extracting': 0.0, 'embedding': 0.1, 'indexing': 0.9}
 
 # --- Token-based chunking with overlap ---
-def chunk_text_token_overlap(text: str, max_tokens: int = 512, overlap: int = 64, model: str = 'text-embedding-3-small') -> List[Dict]:
+def chunk_text_token_overlap(text: str, max_tokens: int = 512, overlap: int = 64, model: str = None) -> List[Dict]:
+    model = model or stage_model('embedding').name
     enc = tiktoken.encoding_for_model(model)
     tokens = enc.encode(text)
     chunks = []
@@ -29,30 +40,36 @@ def chunk_text_token_overlap(text: str, max_tokens: int = 512, overlap: int = 64
     return chunks
 
 # --- Embedding utility ---
-def embed_text(texts: List[str], models: List[str] = None) -> List[List[List[float]]]:
+@traced('ingestion.embed_text')
+def embed_text(texts: List[str], models: List[str] = None, user_id: int = None, stage: str = 'embed') -> List[List[List[float]]]:
     """
-    Generate embeddings using OpenAI's text-embedding-3-small model.
+    Generate embeddings with the registry's embedding-stage model (MODEL_EMBEDDING).
     For production, we use only OpenAI embeddings to avoid memory issues.
+    Each call is recorded in the usage ledger under user_id and stage.
     """
     if models is None:
-        models = ['text-embedding-3-small']  # Use only OpenAI for production
+        models = [stage_model('embedding').name]  # Use only OpenAI for production
     
     embeddings = []
     for model in models:
         if model.startswith('text-embedding'):
             try:
-                response = openai.embeddings.create(input=texts, model=model)
+                started = time.perf_counter()
+                embedding_batch_size.labels(stage).observe(len(texts))
+                with observe_upstream('openai', 'embeddings'):
+                    response = call_with_resilience('openai', openai.embeddings.create, input=texts, model=model, timeout=OPENAI_EMBEDDING_TIMEOUT)
+                record_response_usage(user_id, stage, model, response, (time.perf_counter() - started) * 1000)
                 embeddings.append([d.embedding for d in response.data])
             except Exception as e:
                 import logging
                 logger = logging.getLogger('ai_manager')
-                logger.error(f"OpenAI embedding failed: {e}")
+                logger.error("OpenAI embedding failed: %s", e)
                 raise
         else:
             # For now, skip non-OpenAI models to avoid memory issues
             import logging
             logger = logging.getLogger('ai_manager')
-            logger.warning(f"Skipping non-OpenAI model: {model}")
+            logger.warning("Skipping non-OpenAI model: %s", model)
             continue
     
     if not embeddings:
@@ -74,20 +91,35 @@ def extract_text_from_docx(file_field) -> str:
     return text
 
 # --- Main ingestion function ---
-def ingest_document(file_field, file_type: str, doc_metadata: Dict = None, user_id: int = None, is_global: bool = False) -> List[Dict]:
+@traced('ingestion.ingest_document')
+def ingest_document(file_field, file_type: str, doc_metadata: Dict = None, user_id: int = None, is_global: bool = False,
+                    progress: Callable[[str, float], None] = None) -> List[Dict]:
+    """
+    Extract, chunk and embed a document. progress(stage, fraction) is called as each stage
+    starts and after every embedding batch, fraction being the share of the whole ingestion
+    done (indexing the returned chunks is the caller's last 10%).
+    """
     doc_metadata = doc_metadata or {}
-    if file_type == 'txt':
-        file_field.seek(0)
-        text = file_field.read().decode('utf-8')
-    elif file_type == 'pdf':
-        text = extract_text_from_pdf(file_field)
-    elif file_type == 'docx':
-        text = extract_text_from_docx(file_field)
-    else:
-        raise ValueError('Unsupported file type for ingestion')
-    chunks = chunk_text_token_overlap(text)
+    report = progress or (lambda stage, fraction: None)
+    report('extracting', INGEST_STAGE_PROGRESS['extracting'])
+    with span('ingestion.extract', file_type=file_type):
+        if file_type == 'txt':
+            file_field.seek(0)
+            text = file_field.read().decode('utf-8')
+        elif file_type == 'pdf':
+            text = extract_text_from_pdf(file_field)
+        elif file_type == 'docx':
+            text = extract_text_from_docx(file_field)
+        else:
+            raise ValueError('Unsupported file type for ingestion')
+    with span('ingestion.chunk', characters=len(text)):
+        chunks = chunk_text_token_overlap(text)
     chunk_texts = [c['chunk'] for c in chunks]
-    embeddings = embed_text(chunk_texts)
+    start, end = INGEST_STAGE_PROGRESS['embedding'], INGEST_STAGE_PROGRESS['indexing']
+    embeddings = []
+    for i in range(0, len(chunk_texts), INGEST_EMBED_BATCH_SIZE):
+        report('embedding', start + (end - start) * i / len(chunk_texts))
+        embeddings.extend(embed_text(chunk_texts[i:i + INGEST_EMBED_BATCH_SIZE], user_id=user_id, stage='ingest'))
     results = []
     doc_id = None
     if doc_metadata and 'doc_id' in doc_metadata:
@@ -0,0 +1,172 @@
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Dict, Iterable, List
+from django.db import close_old_connections
+from django.db.models import OuterRef, Subquery
+from ..models import ConversationArchive, Message
+from .archive import read_archive
+from .ingestion import embed_text
+from .vector_store import upsert_vectors, delete_vectors_by_doc_id
+from .metrics import queue_depth
+
+logger = logging.getLogger('ai_manager')
+
+# Long-term chat memory: every completed user/AI exchange is embedded in the background into
+# the tenant-partitioned chat_memory collection, and retrieval recalls the relevant ones from
+# all of the user's conversations next to the KB chunks.
+CHAT_MEMORY_ENABLED = os.getenv('CHAT_MEMORY_ENABLED', 'true').lower() == 'true'
+CHAT_MEMORY_COLLECTION = 'chat_memory'
+CHAT_MEMORY_BATCH_SIZE = int(os.getenv('CHAT_MEMORY_BATCH_SIZE', '32'))
+# Exchanges are clipped to this many characters, for the embedding and the prompt alike
+CHAT_MEMORY_MAX_CHARS = int(os.getenv('CHAT_MEMORY_MAX_CHARS', '1600'))
+# Recalled exchanges less similar than this to the query are not offered to MMR
+CHAT_MEMORY_MIN_SCORE = float(os.getenv('CHAT_MEMORY_MIN_SCORE', '0.3'))
+
+# Replies that did not come from a completion are not worth remembering
+SKIPPED_ROUTES = {'budget', 'cache', 'fallback'}
+
+def conversation_doc_id(conversation_id) -> str:
+    """doc_id of a conversation's memory points, so they can be deleted with it."""
+    return f"conversation-{conversation_id}"
+
+def exchange_text(user_text: str, ai_text: str) -> str:
+    text = f"User: {user_text}\nAssistant: {ai_text}" if user_text else f"Assistant: {ai_text}"
+    return text if len(text) <= CHAT_MEMORY_MAX_CHARS else text[:CHAT_MEMORY_MAX_CHARS - 1] + '…'
+
+def _exchange(conversation, prompt, reply) -> Dict:
+    """Memory chunk for one reply; prompt and reply are dicts with id, text and timestamp."""
+    return {
+        'chunk': exchange_text(prompt['text'] if prompt else '', reply['text']),
+        'metadata': {
+            'doc_id': conversation_doc_id(conversation.id),
+            'chunk_index': reply['id'],  # stable point id: re-indexing replaces the point
+            'user_id': conversation.user_id,
+            'conversation_id': conversation.id,
+            'message_ids': [prompt['id'], reply['id']] if prompt else [reply['id']],
+            'timestamp': reply['timestamp'],
+        },
+    }
+
+def load_exchanges(ai_message_ids: Iterable[int]) -> List[Dict]:
+    """Memory chunks for the given AI replies, each paired with the user message it answered."""
+    prompt_id = Subquery(
+        Message.objects.filter(conversation_id=OuterRef('conversation_id'), sender='user', id__lt=OuterRef('id'))
+        .order_by('-id').values('id')[:1]
+    )
+    replies = [
+        reply for reply in (
+            Message.objects.filter(id__in=list(ai_message_ids), sender='ai')
+            .select_related('conversation').annotate(prompt_id=prompt_id).order_by('id')
+        )
+        if (reply.context or {}).get('route') not in SKIPPED_ROUTES
+    ]
+    prompts = Message.objects.only('id', 'text').in_bulk([r.prompt_id for r in replies if r.prompt_id is not None])
+    exchanges = []
+    for reply in replies:
+        prompt = prompts.get(reply.prompt_id)
+        exchanges.append(_exchange(
+            reply.conversation,
+            {'id': prompt.id, 'text': prompt.text} if prompt else None,
+            {'id': reply.id, 'text': reply.text, 'timestamp': reply.timestamp.isoformat()}
+        ))
+    return exchanges
+
+def load_archived_exchanges(archive: ConversationArchive, after_id: int = 0) -> List[Dict]:
+    """
+    Memory chunks for the AI replies of an archived conversation, read from its archive.
+    Archiving keeps a conversation's memory points (like its search index rows), so this is
+    only needed to backfill.
+    """
+    exchanges = []
+    prompt = None
+    for row in read_archive(archive):
+        if row['sender'] == 'user':
+            prompt = row
+        elif row['sender'] == 'ai' and row['id'] > after_id and (row.get('context') or {}).get('route') not in SKIPPED_ROUTES:
+            exchanges.append(_exchange(archive.conversation, prompt, row))
+    return exchanges
+
+def index_exchanges(ai_message_ids: Iterable[int]) -> int:
+    """Embed and upsert the exchanges ending in the given AI replies; returns how many were indexed."""
+    return upsert_exchanges(load_exchanges(ai_message_ids))
+
+def upsert_exchanges(exchanges: List[Dict]) -> int:
+    """Embed and upsert memory chunks from load_exchanges or load_archived_exchanges."""
+    by_user = {}
+    for exchange in exchanges:
+        by_user.setdefault(exchange['metadata']['user_id'], []).append(exchange)
+    indexed = 0
+    # One embedding call per user so the usage ledger charges the right account
+    for user_id, exchanges in by_user.items():
+        embeddings = embed_text([e['chunk'] for e in exchanges], user_id=user_id, stage='memory')
+        upsert_vectors(
+            [{'embedding': emb[0], **e} for e, emb in zip(exchanges, embeddings)],
+            collection=CHAT_MEMORY_COLLECTION
+        )
+        indexed += len(exchanges)
+    return indexed
+
+def forget_conversation(conversation_id: int, user_id: int = None):
+    """Drop a deleted conversation's exchanges from memory."""
+    if CHAT_MEMORY_ENABLED:
+        delete_vectors_by_doc_id(conversation_doc_id(conversation_id), collection=CHAT_MEMORY_COLLECTION, user_id=user_id)
+
+class MemoryIndexer:
+    """
+    Indexes new exchanges from a background thread in batches of CHAT_MEMORY_BATCH_SIZE, so
+    the chat request only pays for a queue put. The queue is in-process: replies queued when
+    a worker dies are picked up by the index_chat_memory command.
+    """
+    def __init__(self, batch_size: int = CHAT_MEMORY_BATCH_SIZE, max_queue: int = 10000):
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, ai_message_id: int):
+        if not CHAT_MEMORY_ENABLED:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(ai_message_id)
+        except queue.Full:
+            logger.warning("Chat memory queue full, not indexing message %s", ai_message_id)
+        queue_depth.labels('chat_memory').set(self._queue.qsize())
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='chat-memory-indexer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=0.5))
+                except queue.Empty:
+                    break
+            close_old_connections()
+            try:
+                index_exchanges(batch)
+            except Exception as e:
+                logger.warning("Chat memory indexing failed for %d replies: %s", len(batch), e)
+            finally:
+                close_old_connections()
+            for _ in batch:
+                self._queue.task_done()
+            queue_depth.labels('chat_memory').set(self._queue.qsize())
+
+    def flush(self, timeout: float = 5.0):
+        """Block until queued replies are indexed (tests and management commands)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+# Global instance
+memory_indexer = MemoryIndexer()
@@ -0,0 +1,69 @@
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess, REGISTRY
+
+# With PROMETHEUS_MULTIPROC_DIR set (gunicorn), every worker writes its samples to
+# memory-mapped files in that directory and /metrics aggregates them on scrape.
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+if PROMETHEUS_MULTIPROC_DIR:
+    # gunicorn's on_starting empties it for the server, but one-off commands on the same image
+    # (migrate, shell, runserver) import this module first and need it to exist
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+METRICS_BEARER_TOKEN = os.getenv('METRICS_BEARER_TOKEN')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'Request latency per route',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS
+)
+upstream_request_duration = Histogram(
+    'upstream_request_duration_seconds', 'Latency of OpenAI and vector store calls',
+    ['service', 'operation', 'outcome'], buckets=LATENCY_BUCKETS
+)
+chunks_ingested = Counter('ingest_chunks_total', 'Chunks written to the vector store', ['collection'])
+embedding_batch_size = Histogram(
+    'embedding_batch_size', 'Texts per embedding request', ['stage'],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+)
+cache_lookups = Counter('cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+chat_generations_in_flight = Gauge(
+    'chat_generations_in_flight', 'Chat replies being generated', multiprocess_mode='livesum'
+)
+queue_depth = Gauge('queue_depth', 'Items waiting in background queues', ['queue'], multiprocess_mode='livesum')
+admission_rejections = Counter('admission_rejections_total', 'Chat requests rejected by admission control', ['reason'])
+upstream_retries = Counter('upstream_retries_total', 'Retried upstream calls', ['dependency'])
+# Worst state across live workers: 0 closed, 1 half-open, 2 open
+circuit_breaker_state = Gauge('circuit_breaker_state', 'Upstream circuit breaker state', ['dependency'], multiprocess_mode='livemax')
+
+@contextmanager
+def observe_upstream(service: str, operation: str):
+    """Time an upstream call; usable as a context manager or a decorator."""
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        upstream_request_duration.labels(service, operation, outcome).observe(time.perf_counter() - started)
+
+@contextmanager
+def track_in_flight(gauge=chat_generations_in_flight):
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+def render_metrics():
+    """(body, content type) of the current metrics, aggregated across worker processes."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
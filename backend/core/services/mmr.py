@@ -0,0 +1,52 @@
+import numpy as np
+from typing import List, Optional, Sequence
+
+def mmr_select(
+    query_vector: Sequence[float],
+    candidate_vectors: Sequence[Sequence[float]],
+    relevance: Optional[Sequence[float]] = None,
+    token_counts: Optional[Sequence[int]] = None,
+    token_budget: Optional[int] = None,
+    k: Optional[int] = None,
+    lambda_mult: float = 0.7,
+    duplicate_threshold: float = 0.95,
+) -> List[int]:
+    """
+    Maximal-marginal-relevance selection. Returns candidate indices in pick order.
+
+    Each step picks the candidate maximising
+        lambda_mult * relevance - (1 - lambda_mult) * max similarity to the picks so far,
+    skipping candidates that no longer fit the remaining token budget and candidates
+    at least duplicate_threshold cosine-similar to an earlier pick (overlapping chunks).
+    relevance defaults to cosine similarity with the query. The pairwise similarity
+    matrix is computed once, so each step is a handful of O(n) array operations.
+    """
+    vectors = np.asarray(candidate_vectors, dtype=np.float32)
+    n = len(vectors)
+    if n == 0:
+        return []
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if relevance is None:
+        query = np.asarray(query_vector, dtype=np.float32)
+        relevance = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+    else:
+        relevance = np.asarray(relevance, dtype=np.float32)
+    similarity = vectors @ vectors.T
+    tokens = np.zeros(n, dtype=np.int64) if token_counts is None else np.asarray(token_counts, dtype=np.int64)
+    remaining = np.iinfo(np.int64).max if token_budget is None else int(token_budget)
+    k = n if k is None else min(k, n)
+
+    available = np.ones(n, dtype=bool)
+    max_sim = np.full(n, -1.0, dtype=np.float32)
+    picked = []
+    while len(picked) < k:
+        eligible = available & (tokens <= remaining) & (max_sim < duplicate_threshold)
+        if not eligible.any():
+            break
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * np.maximum(max_sim, 0.0)
+        best = int(np.argmax(np.where(eligible, scores, -np.inf)))
+        picked.append(best)
+        available[best] = False
+        remaining -= int(tokens[best])
+        np.maximum(max_sim, similarity[best], out=max_sim)
+    return picked
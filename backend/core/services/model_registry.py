@@ -0,0 +1,118 @@
+import os
+import re
+import json
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Dict, List
+
+@dataclass(frozen=True)
+class ModelSpec:
+    name: str
+    context_window: int  # tokens
+    input_price: float  # USD per 1M tokens
+    cached_input_price: float
+    output_price: float
+    latency_class: str  # 'fast' | 'standard' | 'slow'
+    kind: str = 'chat'  # 'chat' | 'embedding'
+
+MODELS: Dict[str, ModelSpec] = {spec.name: spec for spec in [
+    ModelSpec('gpt-3.5-turbo', 16385, 0.50, 0.50, 1.50, 'fast'),
+    ModelSpec('gpt-4o-mini', 128000, 0.15, 0.075, 0.60, 'fast'),
+    ModelSpec('gpt-4o', 128000, 2.50, 1.25, 10.00, 'standard'),
+    ModelSpec('text-embedding-3-small', 8191, 0.02, 0.02, 0.0, 'fast', kind='embedding'),
+    ModelSpec('text-embedding-3-large', 8191, 0.13, 0.13, 0.0, 'fast', kind='embedding'),
+]}
+
+# Extra or overriding specs, e.g. '[{"name": "gpt-4.1", "context_window": 1047576, ...}]'
+for _extra in json.loads(os.getenv('MODEL_REGISTRY_JSON', '[]')):
+    _base = MODELS.get(_extra['name'])
+    MODELS[_extra['name']] = replace(_base, **_extra) if _base else ModelSpec(**_extra)
+
+# Model per pipeline stage. Changing the embedding model changes the vector size,
+# so existing collections must be re-ingested.
+STAGE_MODELS = {
+    'intent': os.getenv('MODEL_INTENT', 'gpt-3.5-turbo'),
+    'embedding': os.getenv('MODEL_EMBEDDING', 'text-embedding-3-small'),
+    'chat_fast': os.getenv('MODEL_CHAT_FAST', 'gpt-3.5-turbo'),
+    'chat_strong': os.getenv('MODEL_CHAT_STRONG', 'gpt-4o'),
+}
+
+# Routing: turns scoring at least ROUTER_COMPLEXITY_THRESHOLD go to the strong model,
+# unless ROUTER_MAX_STRONG_IN_FLIGHT strong generations are already running here.
+ROUTER_ENABLED = os.getenv('ROUTER_ENABLED', 'true').lower() == 'true'
+ROUTER_COMPLEXITY_THRESHOLD = int(os.getenv('ROUTER_COMPLEXITY_THRESHOLD', '3'))
+ROUTER_MAX_STRONG_IN_FLIGHT = int(os.getenv('ROUTER_MAX_STRONG_IN_FLIGHT', '4'))
+
+PLANNING_TERMS = re.compile(
+    r"\b(plan|planning|strategy|strategi[sz]e|roadmap|compare|trade-?offs?|step[- ]by[- ]step|budget|"
+    r"analy[sz]e|forecast|prioriti[sz]e|timeline|campaign|negotiat\w*|contract)\b",
+    re.IGNORECASE
+)
+
+def get_model(name: str) -> ModelSpec:
+    if name not in MODELS:
+        raise KeyError(f"Model {name} is not in the registry; add it with MODEL_REGISTRY_JSON")
+    return MODELS[name]
+
+def stage_model(stage: str) -> ModelSpec:
+    return get_model(STAGE_MODELS[stage])
+
+@dataclass(frozen=True)
+class Route:
+    name: str  # 'fast' | 'strong'
+    model: str
+    reason: str
+
+class ModelRouter:
+    """
+    Picks the chat model per turn: short, simple turns go to the fast model and planning
+    or long multi-part requests to the strong one. Strong turns are downgraded when the
+    user is over the soft usage budget or this process already runs
+    ROUTER_MAX_STRONG_IN_FLIGHT strong generations.
+    """
+    def __init__(self):
+        self._strong_in_flight = 0
+        self._lock = threading.Lock()
+
+    def complexity(self, query: str, history: List = ()) -> int:
+        words = len(query.split())
+        score = 0
+        score += 1 if words > 30 else 0
+        score += 1 if words > 80 else 0
+        score += min(len(PLANNING_TERMS.findall(query)), 2)
+        score += 1 if query.count('?') > 1 else 0
+        score += 1 if len(history) >= 8 else 0
+        return score
+
+    def route(self, query: str, history: List = (), prompt_tokens: int = 0, budget: str = 'ok') -> Route:
+        fast, strong = STAGE_MODELS['chat_fast'], STAGE_MODELS['chat_strong']
+        if prompt_tokens > get_model(fast).context_window:
+            return Route('strong', strong, 'context')
+        if not ROUTER_ENABLED or fast == strong:
+            return Route('fast', fast, 'default')
+        if self.complexity(query, history) < ROUTER_COMPLEXITY_THRESHOLD:
+            return Route('fast', fast, 'simple')
+        if budget != 'ok':
+            return Route('fast', fast, 'budget')
+        with self._lock:
+            if self._strong_in_flight >= ROUTER_MAX_STRONG_IN_FLIGHT:
+                return Route('fast', fast, 'load')
+        return Route('strong', strong, 'complex')
+
+    @contextmanager
+    def generating(self, route: Route):
+        """Count a running generation against the strong-model load limit."""
+        if route.name != 'strong':
+            yield
+            return
+        with self._lock:
+            self._strong_in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._strong_in_flight -= 1
+
+# Global instance
+model_router = ModelRouter()
@@ -1,6 +1,9 @@
 import os
 import requests
 from typing import List, Dict
+from .tracing import traced
+from .metrics import observe_upstream
+from .resilience import call_with_resilience, QDRANT_CONNECT_TIMEOUT, QDRANT_SEARCH_TIMEOUT, QDRANT_WRITE_TIMEOUT
 
 QDRANT_URL = os.getenv('QDRANT_URL', 'http://localhost:6333')
 QDRANT_COLLECTION = os.getenv('QDRANT_COLLECTION', 'global_kb')
@@ -8,7 +11,178 @@ QDRANT_API_KEY = os.getenv('QDRANT_API_KEY', None)
 
 HEADERS = {'api-key': QDRANT_API_KEY} if QDRANT_API_KEY else {}
 
-def ensure_collection(collection: str, vector_size: int = 1536, distance: str = "Cosine"):
+# --- Collection profiles ---
+# A profile controls how a collection stores its vectors. Quantized profiles keep a
+# compressed copy of every vector in RAM for the HNSW walk and rescore the
+# oversampled candidates against the original float32 vectors; the *_on_disk
+# variants additionally leave those originals memory-mapped on disk.
+COLLECTION_PROFILES = {
+    'float32': {},
+    'scalar': {
+        'quantization_config': {'scalar': {'type': 'int8', 'quantile': 0.99, 'always_ram': True}},
+        'search_params': {'quantization': {'ignore': False, 'rescore': True, 'oversampling': 2.0}},
+    },
+    'scalar_on_disk': {
+        'on_disk': True,
+        'quantization_config': {'scalar': {'type': 'int8', 'quantile': 0.99, 'always_ram': True}},
+        'search_params': {'quantization': {'ignore': False, 'rescore': True, 'oversampling': 2.0}},
+    },
+    'binary': {
+        'quantization_config': {'binary': {'always_ram': True}},
+        'search_params': {'quantization': {'ignore': False, 'rescore': True, 'oversampling': 3.0}},
+    },
+    'binary_on_disk': {
+        'on_disk': True,
+        'quantization_config': {'binary': {'always_ram': True}},
+        'search_params': {'quantization': {'ignore': False, 'rescore': True, 'oversampling': 3.0}},
+    },
+}
+
+QDRANT_COLLECTION_PROFILE = os.getenv('QDRANT_COLLECTION_PROFILE', 'float32')
+
+# --- Tenant partitioning ---
+# Collections holding per-user data are partitioned by tenant so a search only
+# touches that user's points:
+#   'payload' - keyword `tenant_id` index flagged is_tenant plus payload_m HNSW links,
+#               so Qdrant builds a per-tenant graph and co-locates each tenant's points
+#   'shard'   - custom sharding with QDRANT_TENANT_SHARDS shard keys; each tenant is
+#               routed to one shard and filtered by `tenant_id` inside it
+#   'filter'  - plain keyword `tenant_id` filter over the shared graph
+TENANT_MODES = ('payload', 'shard', 'filter')
+QDRANT_TENANT_MODE = os.getenv('QDRANT_TENANT_MODE', 'payload')
+QDRANT_TENANT_SHARDS = int(os.getenv('QDRANT_TENANT_SHARDS', '16'))
+TENANT_COLLECTIONS = {'personal_kb', 'chat_memory'}
+TENANT_KEY = 'tenant_id'
+
+# Collections already confirmed to exist, so upserts skip the GET round trip.
+_known_collections = set()
+
+def get_collection_profile(collection: str) -> str:
+    """
+    Profile name for a collection: QDRANT_PROFILE_<COLLECTION> overrides the
+    QDRANT_COLLECTION_PROFILE default (e.g. QDRANT_PROFILE_PERSONAL_KB=binary_on_disk).
+    """
+    profile = os.getenv(f"QDRANT_PROFILE_{collection.upper()}", QDRANT_COLLECTION_PROFILE)
+    if profile not in COLLECTION_PROFILES:
+        raise ValueError(f"Unknown Qdrant collection profile: {profile}")
+    return profile
+
+def get_tenant_mode(collection: str, tenant_mode: str = None):
+    """Tenant partitioning mode for a collection, or None for shared collections."""
+    if tenant_mode is None:
+        if collection not in TENANT_COLLECTIONS:
+            return None
+        tenant_mode = QDRANT_TENANT_MODE
+    if tenant_mode not in TENANT_MODES:
+        raise ValueError(f"Unknown Qdrant tenant mode: {tenant_mode}")
+    return tenant_mode
+
+def tenant_shard_key(user_id) -> str:
+    """Shard key a tenant is routed to in 'shard' mode."""
+    return f"tenants_{int(user_id) % QDRANT_TENANT_SHARDS}"
+
+def tenant_filter(user_id) -> Dict:
+    return {"must": [{"key": TENANT_KEY, "match": {"value": str(user_id)}}]}
+
+def build_collection_config(vector_size: int, distance: str, profile: str, tenant_mode: str = None) -> Dict:
+    """Request body for creating a collection with the given profile and tenant mode."""
+    settings = COLLECTION_PROFILES[profile]
+    payload = {
+        "vectors": {
+            "size": vector_size,
+            "distance": distance,
+            "on_disk": settings.get('on_disk', False)
+        }
+    }
+    if 'quantization_config' in settings:
+        payload["quantization_config"] = settings['quantization_config']
+    if tenant_mode == 'payload':
+        # No global graph: every tenant gets its own HNSW graph via payload_m
+        payload["hnsw_config"] = {"payload_m": 16, "m": 0}
+    elif tenant_mode == 'shard':
+        payload["sharding_method"] = "custom"
+    return payload
+
+def _request(send, url: str, timeout: float = QDRANT_WRITE_TIMEOUT, allow_status=(), **kwargs):
+    """
+    Send a Qdrant request with a (connect, read) timeout through the qdrant circuit breaker
+    and retry budget. Error statuses raise unless listed in allow_status.
+    """
+    def attempt():
+        r = send(url, headers=HEADERS, timeout=(QDRANT_CONNECT_TIMEOUT, timeout), **kwargs)
+        if r.status_code not in allow_status:
+            r.raise_for_status()
+        return r
+    return call_with_resilience('qdrant', attempt)
+
+def _create_tenant_index(collection: str, tenant_mode: str):
+    schema = {"type": "keyword", "is_tenant": True} if tenant_mode == 'payload' else "keyword"
+    _request(
+        requests.put,
+        f"{QDRANT_URL}/collections/{collection}/index?wait=true",
+        json={"field_name": TENANT_KEY, "field_schema": schema}
+    )
+
+def _prepare_tenants(collection: str, tenant_mode: str):
+    """Create the tenant payload index and, in shard mode, the shard keys."""
+    if tenant_mode == 'shard':
+        for shard in range(QDRANT_TENANT_SHARDS):
+            _request(requests.put, f"{QDRANT_URL}/collections/{collection}/shards", json={"shard_key": f"tenants_{shard}"})
+    _create_tenant_index(collection, tenant_mode)
+
+def backfill_tenants(collection: str, tenant_mode: str = None, batch_size: int = 256) -> Dict[str, int]:
+    """
+    Bring a tenant collection created before tenant partitioning in line with new ones:
+    create the tenant index, switch 'payload' mode to per-tenant graphs, and stamp the
+    tenant key on points lacking it from their user_id. Safe to re-run. Returns counts of
+    points updated and of points skipped for having no user_id.
+    """
+    tenant_mode = get_tenant_mode(collection, tenant_mode)
+    if tenant_mode is None:
+        raise ValueError(f"{collection} is not a tenant collection")
+    url = f"{QDRANT_URL}/collections/{collection}"
+    counts = {'updated': 0, 'skipped': 0}
+    resp = _request(requests.get, url, timeout=QDRANT_SEARCH_TIMEOUT, allow_status=(404,))
+    if resp.status_code == 404:
+        return counts
+    params = resp.json()['result']['config']['params']
+    if tenant_mode == 'shard' and params.get('sharding_method') != 'custom':
+        # Points cannot move between shards: the collection has to be recreated and re-ingested
+        raise RuntimeError(f"{collection} was not created with custom sharding; use QDRANT_TENANT_MODE=payload or filter")
+    if tenant_mode == 'payload':
+        _request(requests.patch, url, json={"hnsw_config": {"payload_m": 16, "m": 0}})
+    _create_tenant_index(collection, tenant_mode)
+    body = {
+        "filter": {"must": [{"is_empty": {"key": TENANT_KEY}}]},
+        "limit": batch_size, "with_payload": ["user_id"], "with_vector": False
+    }
+    while True:
+        page = _request(requests.post, f"{url}/points/scroll", timeout=QDRANT_SEARCH_TIMEOUT, json=body).json()['result']
+        by_tenant = {}
+        for point in page['points']:
+            user_id = point.get('payload', {}).get('user_id')
+            if user_id is None:
+                counts['skipped'] += 1
+            else:
+                by_tenant.setdefault(str(user_id), []).append(point['id'])
+        for tenant, ids in by_tenant.items():
+            _request(requests.post, f"{url}/points/payload?wait=true", json={"payload": {TENANT_KEY: tenant}, "points": ids})
+            counts['updated'] += len(ids)
+        if page.get('next_page_offset') is None:
+            return counts
+        body["offset"] = page['next_page_offset']
+
+@traced('qdrant.ensure_collection')
+@observe_upstream('qdrant', 'ensure_collection')
+def ensure_collection(collection: str, vector_size: int = 1536, distance: str = "Cosine", profile: str = None, tenant_mode: str = None):
+    """
+    Create the collection if it does not exist yet. The profile and tenant mode only
+    apply at creation time; existing collections keep the settings they were created with
+    (backfill_tenants upgrades tenant collections created before tenant partitioning).
+    """
+    if collection in _known_collections:
+        return
+    tenant_mode = get_tenant_mode(collection, tenant_mode)
     url = f"{QDRANT_URL}/collections/{collection}"
     
     # Check if we're using Qdrant Cloud (requires API key)
@@ -16,56 +190,79 @@ def ensure_collection(collection: str, vector_size: int = 1536, distance: str =
         raise RuntimeError('QDRANT_API_KEY is required for Qdrant Cloud.')
     
     try:
-        resp = requests.get(url, headers=HEADERS)
+        resp = _request(requests.get, url, timeout=QDRANT_SEARCH_TIMEOUT, allow_status=(404,))
         if resp.status_code == 200:
+            _known_collections.add(collection)
             return
-        payload = {
-            "vectors": {
-                "size": vector_size,
-                "distance": distance
-            }
-        }
-        resp = requests.put(url, json=payload, headers=HEADERS)
-        resp.raise_for_status()
+        payload = build_collection_config(vector_size, distance, profile or get_collection_profile(collection), tenant_mode)
+        _request(requests.put, url, json=payload)
+        if tenant_mode:
+            _prepare_tenants(collection, tenant_mode)
+        _known_collections.add(collection)
     except Exception as e:
         import logging
         logger = logging.getLogger('ai_manager')
-        logger.error(f"Failed to ensure collection {collection}: {e}")
+        logger.error("Failed to ensure collection %s: %s", collection, e)
         raise
 
 # --- Upsert vectors ---
-def upsert_vectors(vectors: List[Dict], collection: str = QDRANT_COLLECTION):
-    ensure_collection(collection)
+@traced('qdrant.upsert_vectors')
+@observe_upstream('qdrant', 'upsert')
+def upsert_vectors(vectors: List[Dict], collection: str = QDRANT_COLLECTION, tenant_mode: str = None):
+    """
+    Upsert chunks into a collection. In tenant-partitioned collections every chunk
+    must carry user_id in its metadata; it is stamped as the tenant key and, in
+    shard mode, the points are routed to the tenant's shard.
+    """
+    tenant_mode = get_tenant_mode(collection, tenant_mode)
+    ensure_collection(collection, tenant_mode=tenant_mode)
 
     url = f"{QDRANT_URL}/collections/{collection}/points"
-    payload = {
-        "points": [
-            {
-                "id": i,
-                "vector": v['embedding'],
-                "payload": {"chunk": v['chunk'], **v.get('metadata', {})}
-            }
-            for i, v in enumerate(vectors)
-        ]
-    }
+    # Points grouped by shard key; None means no explicit routing
+    batches = {}
+    for i, v in enumerate(vectors):
+        point_payload = {"chunk": v['chunk'], **v.get('metadata', {})}
+        shard_key = None
+        if tenant_mode:
+            if point_payload.get('user_id') is None:
+                raise ValueError(f"user_id is required to upsert into tenant collection {collection}")
+            point_payload[TENANT_KEY] = str(point_payload['user_id'])
+            if tenant_mode == 'shard':
+                shard_key = tenant_shard_key(point_payload['user_id'])
+        batches.setdefault(shard_key, []).append({
+            "id": v.get('id', i),
+            "vector": v['embedding'],
+            "payload": point_payload
+        })
     
     # Check if we're using Qdrant Cloud (requires API key)
     if QDRANT_URL != 'http://localhost:6333' and not QDRANT_API_KEY:
         raise RuntimeError('QDRANT_API_KEY is required for Qdrant Cloud.')
     
     try:
-        r = requests.put(url, json=payload, headers=HEADERS)
-        r.raise_for_status()
-        return r.json()
+        result = None
+        for shard_key, points in batches.items():
+            payload = {"points": points}
+            if shard_key is not None:
+                payload["shard_key"] = shard_key
+            r = _request(requests.put, url, json=payload)
+            result = r.json()
+        return result
     except Exception as e:
         import logging
         logger = logging.getLogger('ai_manager')
-        logger.error(f"Failed to upsert vectors to {collection}: {e}")
+        logger.error("Failed to upsert vectors to %s: %s", collection, e)
         raise
 
 # --- Delete vectors by doc_id ---
-def delete_vectors_by_doc_id(doc_id: str, collection: str = QDRANT_COLLECTION):
-    """Delete all vectors in the collection with the given doc_id in payload."""
+@traced('qdrant.delete_vectors_by_doc_id')
+@observe_upstream('qdrant', 'delete')
+def delete_vectors_by_doc_id(doc_id: str, collection: str = QDRANT_COLLECTION, user_id: int = None, tenant_mode: str = None):
+    """
+    Delete all vectors in the collection with the given doc_id in payload. In
+    tenant-partitioned collections pass the owner's user_id: the delete is then limited
+    to the tenant and, in shard mode, routed to its shard instead of every shard.
+    """
     url = f"{QDRANT_URL}/collections/{collection}/points/delete"
     payload = {
         "filter": {
@@ -74,36 +271,56 @@ def delete_vectors_by_doc_id(doc_id: str, collection: str = QDRANT_COLLECTION):
             ]
         }
     }
-    if not QDRANT_API_KEY:
+    tenant_mode = get_tenant_mode(collection, tenant_mode)
+    if tenant_mode and user_id is not None:
+        payload["filter"]["must"].extend(tenant_filter(user_id)["must"])
+        if tenant_mode == 'shard':
+            payload["shard_key"] = tenant_shard_key(user_id)
+    if QDRANT_URL != 'http://localhost:6333' and not QDRANT_API_KEY:
         raise RuntimeError('QDRANT_API_KEY is required for Qdrant Cloud.')
     try:
-        r = requests.post(url, json=payload, headers=HEADERS)
-        r.raise_for_status()
+        r = _request(requests.post, url, json=payload)
         return r.json()
     except Exception as e:
         import logging
-        logging.getLogger('ai_manager').error(f"Failed to delete vectors for doc_id={doc_id} in {collection}: {e}")
+        logging.getLogger('ai_manager').error("Failed to delete vectors for doc_id=%s in %s: %s", doc_id, collection, e)
         return None
 
 # --- Search vectors ---
-def search_vectors(query_embedding: List[float], collection: str = QDRANT_COLLECTION, top: int = 5):
+@traced('qdrant.search_vectors')
+@observe_upstream('qdrant', 'search')
+def search_vectors(query_embedding: List[float], collection: str = QDRANT_COLLECTION, top: int = 5, profile: str = None, user_id: int = None, tenant_mode: str = None, with_vectors: bool = False):
+    """
+    Search a collection. Tenant-partitioned collections require user_id and only
+    ever return that user's points.
+    """
     url = f"{QDRANT_URL}/collections/{collection}/points/search"
     payload = {
         "vector": query_embedding,
         "limit": top,
-        "with_payload": True
+        "with_payload": True,
+        "with_vector": with_vectors
     }
+    search_params = COLLECTION_PROFILES[profile or get_collection_profile(collection)].get('search_params')
+    if search_params:
+        payload["params"] = search_params
+    tenant_mode = get_tenant_mode(collection, tenant_mode)
+    if tenant_mode:
+        if user_id is None:
+            raise ValueError(f"user_id is required to search tenant collection {collection}")
+        payload["filter"] = tenant_filter(user_id)
+        if tenant_mode == 'shard':
+            payload["shard_key"] = tenant_shard_key(user_id)
     
     # Check if we're using Qdrant Cloud (requires API key)
     if QDRANT_URL != 'http://localhost:6333' and not QDRANT_API_KEY:
         raise RuntimeError('QDRANT_API_KEY is required for Qdrant Cloud.')
     
     try:
-        r = requests.post(url, json=payload, headers=HEADERS)
-        r.raise_for_status()
+        r = _request(requests.post, url, timeout=QDRANT_SEARCH_TIMEOUT, json=payload)
         return r.json()
     except Exception as e:
         import logging
         logger = logging.getLogger('ai_manager')
-        logger.error(f"Failed to search vectors in {collection}: {e}")
+        logger.error("Failed to search vectors in %s: %s", collection, e)
         raise
\ No newline at end of file
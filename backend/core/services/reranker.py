@@ -0,0 +1,135 @@
+import os
+import time
+import logging
+import threading
+from typing import List, Dict
+
+logger = logging.getLogger('ai_manager')
+
+# Optional second stage: retrieval over-fetches RERANK_CANDIDATES hits per KB and a
+# local cross-encoder keeps the best top_k. Off by default.
+RERANK_ENABLED = os.getenv('RERANK_ENABLED', 'false').lower() == 'true'
+RERANK_MODEL = os.getenv('RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', '30'))
+RERANK_BATCH_SIZE = int(os.getenv('RERANK_BATCH_SIZE', '16'))
+RERANK_TIME_BUDGET_MS = float(os.getenv('RERANK_TIME_BUDGET_MS', '300'))
+RERANK_MAX_LENGTH = int(os.getenv('RERANK_MAX_LENGTH', '512'))
+# A failed model load (no network, missing weights) is retried only after this long
+RERANK_LOAD_RETRY_SECONDS = float(os.getenv('RERANK_LOAD_RETRY_SECONDS', '300'))
+
+class CrossEncoderReranker:
+    """
+    Scores (query, chunk) pairs with a CPU cross-encoder in batches. Scoring stops as
+    soon as the next batch would overrun the time budget, and the candidates are then
+    returned in their original vector order. The weights load on a background thread
+    (started at server startup by start_loading); a request arriving mid-load waits for
+    it only within its time budget.
+    """
+    def __init__(self, model_name: str = RERANK_MODEL, batch_size: int = RERANK_BATCH_SIZE, time_budget_ms: float = RERANK_TIME_BUDGET_MS):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.time_budget_ms = time_budget_ms
+        self._tokenizer = None
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._loading = False
+        self._load_failed_at = None
+        self._load_done = threading.Event()
+
+    def start_loading(self) -> str:
+        """
+        Load the weights on a background thread unless they are loaded, loading, or the
+        last attempt failed less than RERANK_LOAD_RETRY_SECONDS ago. Returns the state:
+        'ready', 'loading' or 'unavailable'.
+        """
+        if self._model is not None:
+            return 'ready'
+        with self._state_lock:
+            if self._loading:
+                return 'loading'
+            if self._load_failed_at is not None and time.monotonic() - self._load_failed_at < RERANK_LOAD_RETRY_SECONDS:
+                return 'unavailable'
+            self._loading = True
+            self._load_done.clear()
+        threading.Thread(target=self._load_in_background, name='reranker-load', daemon=True).start()
+        return 'loading'
+
+    def _load_in_background(self):
+        started = time.perf_counter()
+        try:
+            self._load()
+            self._load_failed_at = None
+            logger.info("Loaded reranker %s in %.1f s", self.model_name, time.perf_counter() - started)
+        except Exception as e:
+            self._load_failed_at = time.monotonic()
+            logger.warning("Loading reranker %s failed, retrying in %.0f s: %s", self.model_name, RERANK_LOAD_RETRY_SECONDS, e)
+        finally:
+            with self._state_lock:
+                self._loading = False
+            self._load_done.set()
+
+    def _load(self):
+        if self._model is not None:
+            return
+        with self._load_lock:
+            if self._model is None:
+                from transformers import AutoTokenizer, AutoModelForSequenceClassification
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+                model.eval()
+                self._model = model
+
+    def score_batch(self, query: str, passages: List[str]) -> List[float]:
+        """Relevance logits for one batch of passages against the query."""
+        import torch
+        self._load()
+        features = self._tokenizer(
+            [query] * len(passages), passages,
+            padding=True, truncation=True, max_length=RERANK_MAX_LENGTH, return_tensors='pt'
+        )
+        with torch.inference_mode():
+            logits = self._model(**features).logits
+        return logits.view(len(passages), -1)[:, -1].tolist()
+
+    def rerank(self, query: str, candidates: List[Dict], top_n: int) -> List[Dict]:
+        """
+        Reorder search hits ({'payload': {'chunk': ...}, ...}) by cross-encoder score and
+        keep top_n; each kept hit gets a 'rerank_score'. Falls back to the first top_n
+        hits in vector order when the budget runs out or scoring fails.
+        """
+        if len(candidates) <= 1:
+            return candidates[:top_n]
+        started = time.perf_counter()
+        deadline = started + self.time_budget_ms / 1000
+        state = self.start_loading()
+        if state == 'loading':
+            self._load_done.wait(max(0.0, deadline - time.perf_counter()))
+            state = 'ready' if self._model is not None else state
+        if state != 'ready':
+            logger.warning("Reranker %s, keeping vector order", 'still loading' if state == 'loading' else 'unavailable')
+            return candidates[:top_n]
+        passages = [c.get('payload', {}).get('chunk', '') for c in candidates]
+        scores = []
+        last_batch = 0.0
+        try:
+            for start in range(0, len(passages), self.batch_size):
+                now = time.perf_counter()
+                # Don't start a batch that the previous one says will not finish in time
+                if now + last_batch >= deadline:
+                    logger.warning(
+                        "Rerank budget of %.0f ms exhausted after %d/%d candidates; keeping vector order",
+                        self.time_budget_ms, len(scores), len(passages)
+                    )
+                    return candidates[:top_n]
+                scores.extend(self.score_batch(query, passages[start:start + self.batch_size]))
+                last_batch = time.perf_counter() - now
+        except Exception as e:
+            logger.warning("Rerank failed, keeping vector order: %s", e)
+            return candidates[:top_n]
+        order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+        logger.info("Reranked %s candidates in %.1f ms", len(candidates), (time.perf_counter() - started) * 1000)
+        return [dict(candidates[i], rerank_score=scores[i]) for i in order[:top_n]]
+
+# Global instance
+reranker = CrossEncoderReranker()
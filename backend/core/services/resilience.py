@@ -0,0 +1,189 @@
+import os
+import time
+import random
+import logging
+import threading
+from typing import Callable, Dict
+import openai
+import requests
+from .metrics import circuit_breaker_state, upstream_retries
+
+logger = logging.getLogger('ai_manager')
+
+# Per-dependency timeouts, in seconds
+QDRANT_CONNECT_TIMEOUT = float(os.getenv('QDRANT_CONNECT_TIMEOUT', '2'))
+QDRANT_SEARCH_TIMEOUT = float(os.getenv('QDRANT_SEARCH_TIMEOUT', '5'))
+QDRANT_WRITE_TIMEOUT = float(os.getenv('QDRANT_WRITE_TIMEOUT', '30'))
+OPENAI_INTENT_TIMEOUT = float(os.getenv('OPENAI_INTENT_TIMEOUT', '8'))
+OPENAI_EMBEDDING_TIMEOUT = float(os.getenv('OPENAI_EMBEDDING_TIMEOUT', '10'))
+OPENAI_CHAT_TIMEOUT = float(os.getenv('OPENAI_CHAT_TIMEOUT', '30'))
+
+# Retries: jittered exponential backoff, at most UPSTREAM_MAX_RETRIES per call and, across
+# calls, no more than UPSTREAM_RETRY_RATIO extra requests per request (plus a small floor).
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '2'))
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv('UPSTREAM_RETRY_BASE_DELAY', '0.2'))
+UPSTREAM_RETRY_MAX_DELAY = float(os.getenv('UPSTREAM_RETRY_MAX_DELAY', '2'))
+UPSTREAM_RETRY_RATIO = float(os.getenv('UPSTREAM_RETRY_RATIO', '0.2'))
+
+# Breakers open after this many consecutive failures and let one probe through after the reset timeout
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))
+
+# The client's built-in retries would bypass the retry budget
+openai.max_retries = 0
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the dependency while its breaker is open."""
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go out. In half-open state only one probe at a time is let through."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                logger.info("Circuit %s closed", self.name)
+                self._set_state(self.CLOSED)
+
+    def release(self):
+        """End a call that says nothing about the dependency's health; a half-open probe may go out again."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Circuit %s opened after %d consecutive failures", self.name, self.failures)
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state: str):
+        self.state = state
+        circuit_breaker_state.labels(self.name).set(self.STATE_VALUES[state])
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            retry_in = max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0) if self.state == self.OPEN else None
+            return {'state': self.state, 'consecutive_failures': self.failures, 'retry_in_seconds': retry_in}
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of traffic so a struggling dependency is not hit with a
+    retry storm: each call deposits `ratio` tokens, each retry spends one, and
+    `min_per_second` tokens accrue regardless so low-traffic processes can still retry.
+    """
+    def __init__(self, ratio: float = UPSTREAM_RETRY_RATIO, min_per_second: float = 1.0, cap: float = 50.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.cap = cap
+        self.tokens = cap
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount: float):
+        now = time.monotonic()
+        self.tokens = min(self.cap, self.tokens + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill(0.0)
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+def is_retryable(exc: BaseException) -> bool:
+    """Transient failures: timeouts, connection errors, 429 and 5xx. These also count against the breaker."""
+    if isinstance(exc, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(exc, requests.HTTPError):
+        status = getattr(exc.response, 'status_code', None)
+        return status is None or status == 429 or status >= 500
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500
+    return False
+
+def is_client_error(exc: BaseException) -> bool:
+    """4xx responses: the dependency answered and the request was at fault."""
+    if isinstance(exc, requests.HTTPError):
+        status = getattr(exc.response, 'status_code', None)
+        return status is not None and 400 <= status < 500
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code < 500
+    return False
+
+breakers = {name: CircuitBreaker(name) for name in ('qdrant', 'openai')}
+retry_budgets = {name: RetryBudget() for name in breakers}
+
+def call_with_resilience(dependency: str, func: Callable, *args, retries: int = None, **kwargs):
+    """
+    Call func through the dependency's breaker and retry budget. Transient failures are
+    retried with full-jitter backoff; client errors are raised at once and count as the
+    dependency answering. Any other error is raised without changing the breaker state.
+    Raises CircuitOpenError while the breaker is open.
+    """
+    breaker, budget = breakers[dependency], retry_budgets[dependency]
+    retries = UPSTREAM_MAX_RETRIES if retries is None else retries
+    if not breaker.allow():
+        raise CircuitOpenError(f"{dependency} circuit is open")
+    budget.deposit()
+    attempt = 0
+    while True:
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e):
+                if is_client_error(e):
+                    breaker.record_success()  # The dependency answered; the request was at fault
+                else:
+                    breaker.release()  # A truncated response or a bug of ours proves nothing either way
+                raise
+            if attempt >= retries or not budget.withdraw():
+                breaker.record_failure()
+                raise
+            attempt += 1
+            upstream_retries.labels(dependency).inc()
+            delay = random.uniform(0, min(UPSTREAM_RETRY_MAX_DELAY, UPSTREAM_RETRY_BASE_DELAY * 2 ** attempt))
+            logger.info("Retrying %s call (attempt %d) in %.2fs after %s", dependency, attempt + 1, delay, type(e).__name__)
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+def breaker_states() -> Dict[str, Dict]:
+    return {name: breaker.snapshot() for name, breaker in breakers.items()}
@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional
+from .metrics import queue_depth
+
+logger = logging.getLogger('ai_manager')
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() == 'true'
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'file')  # file | console
+TRACE_FILE = os.getenv('TRACE_FILE', os.path.join(os.path.dirname(__file__), '../../logs/traces.jsonl'))
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'the-manager-backend')
+
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    """
+    One timed stage. Only sampled spans are exported; unsampled spans still carry the
+    trace id so children and outgoing traceparent headers stay consistent.
+    """
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'sampled', 'start_ns', 'end_ns', 'attributes', 'status', 'status_message')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.status = STATUS_UNSET
+        self.status_message = ''
+
+    def set_attribute(self, key: str, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_otlp(self) -> Dict:
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in self.attributes.items()],
+            'status': {'code': self.status, 'message': self.status_message} if self.status else {},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def parse_traceparent(header: Optional[str]):
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent header, or None."""
+    if not header:
+        return None
+    parts = header.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+class SpanExporter:
+    """
+    Writes finished spans as OTLP/JSON lines (one resourceSpans document per batch) from a
+    background thread, so request threads only pay for a queue put.
+    """
+    def __init__(self, exporter: str = TRACE_EXPORTER, path: str = TRACE_FILE, batch_size: int = 64, max_queue: int = 10000):
+        self.exporter = exporter
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass  # Dropping spans is preferable to blocking requests
+        queue_depth.labels('span_export').set(self._queue.qsize())
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=0.5))
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.warning("Span export failed: %s", e)
+            for _ in batch:
+                self._queue.task_done()
+            queue_depth.labels('span_export').set(self._queue.qsize())
+
+    def flush(self, timeout: float = 5.0):
+        """Block until queued spans are written (tests and management commands)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def write(self, spans):
+        document = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': TRACE_SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': 'core'}, 'spans': [s.to_otlp() for s in spans]}],
+        }]})
+        if self.exporter == 'console':
+            sys.stdout.write(document + '\n')
+            sys.stdout.flush()
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(document + '\n')
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+@contextmanager
+def span(name: str, traceparent: Optional[str] = None, **attributes):
+    """
+    Time a stage as a child of the current span. With no current span a new trace is
+    started, continuing `traceparent` when given and sampled at TRACE_SAMPLE_RATE otherwise.
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    parent = _current_span.get()
+    if parent is not None:
+        current = Span(name, parent.trace_id, parent.span_id, parent.sampled)
+    else:
+        remote = parse_traceparent(traceparent)
+        if remote:
+            current = Span(name, remote[0], remote[1], remote[2])
+        else:
+            current = Span(name, f"{random.getrandbits(128):032x}", None, random.random() < TRACE_SAMPLE_RATE)
+    for key, value in attributes.items():
+        current.set_attribute(key, value)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status, current.status_message = STATUS_ERROR, f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        if current.sampled:
+            exporter.export(current)
+
+def traced(name: str):
+    """Decorator form of span()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Global instance
+exporter = SpanExporter()
@@ -0,0 +1,102 @@
+import os
+import logging
+from datetime import timedelta
+from typing import Dict, Optional
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from ..models import UsageRecord, UsageRollup
+from .model_registry import MODELS
+
+logger = logging.getLogger('ai_manager')
+
+# Daily per-user token budgets; 0 disables. Over the soft budget chat takes cheaper paths,
+# over the hard budget it only answers from the semantic answer cache.
+USAGE_SOFT_BUDGET_TOKENS = int(os.getenv('USAGE_SOFT_BUDGET_TOKENS', '0'))
+USAGE_HARD_BUDGET_TOKENS = int(os.getenv('USAGE_HARD_BUDGET_TOKENS', '0'))
+
+class BudgetStatus:
+    OK = "ok"
+    SOFT = "soft"
+    HARD = "hard"
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    spec = MODELS.get(model)
+    if spec is None:
+        return 0.0
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (uncached * spec.input_price + cached_tokens * spec.cached_input_price + completion_tokens * spec.output_price) / 1_000_000
+
+def record_usage(user_id: Optional[int], stage: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+                 cached_tokens: int = 0, latency_ms: float = 0.0, cache_hit: bool = False, route: str = ''):
+    """
+    Write a ledger record and fold it into the user's daily rollup. Never raises:
+    accounting must not break the request it is accounting for.
+    """
+    try:
+        cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+        with transaction.atomic():
+            UsageRecord.objects.create(
+                user_id=user_id, stage=stage, model=model, route=route, prompt_tokens=prompt_tokens,
+                cached_tokens=cached_tokens, completion_tokens=completion_tokens,
+                latency_ms=latency_ms, cost_usd=cost, cache_hit=cache_hit
+            )
+            key = dict(user_id=user_id, date=timezone.localdate(), stage=stage, model=model, route=route)
+            UsageRollup.objects.get_or_create(**key)
+            UsageRollup.objects.filter(**key).update(
+                calls=F('calls') + 1,
+                cache_hits=F('cache_hits') + int(cache_hit),
+                prompt_tokens=F('prompt_tokens') + prompt_tokens,
+                cached_tokens=F('cached_tokens') + cached_tokens,
+                completion_tokens=F('completion_tokens') + completion_tokens,
+                latency_ms=F('latency_ms') + latency_ms,
+                cost_usd=F('cost_usd') + cost,
+            )
+    except Exception as e:
+        logger.warning("Failed to record usage for user_id=%s stage=%s: %s", user_id, stage, e)
+
+def record_response_usage(user_id: Optional[int], stage: str, model: str, response, latency_ms: float, route: str = ''):
+    """record_usage from an OpenAI chat or embedding response object."""
+    usage = getattr(response, 'usage', None)
+    details = getattr(usage, 'prompt_tokens_details', None)
+    record_usage(
+        user_id, stage, model,
+        prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+        completion_tokens=getattr(usage, 'completion_tokens', 0) or 0,
+        cached_tokens=getattr(details, 'cached_tokens', 0) or 0,
+        latency_ms=latency_ms,
+        route=route,
+    )
+
+def tokens_used_today(user_id: int) -> int:
+    totals = UsageRollup.objects.filter(user_id=user_id, date=timezone.localdate()).aggregate(
+        prompt=Sum('prompt_tokens'), completion=Sum('completion_tokens')
+    )
+    return (totals['prompt'] or 0) + (totals['completion'] or 0)
+
+def budget_status(user_id: Optional[int]) -> str:
+    if not user_id or not (USAGE_SOFT_BUDGET_TOKENS or USAGE_HARD_BUDGET_TOKENS):
+        return BudgetStatus.OK
+    used = tokens_used_today(user_id)
+    if USAGE_HARD_BUDGET_TOKENS and used >= USAGE_HARD_BUDGET_TOKENS:
+        return BudgetStatus.HARD
+    if USAGE_SOFT_BUDGET_TOKENS and used >= USAGE_SOFT_BUDGET_TOKENS:
+        return BudgetStatus.SOFT
+    return BudgetStatus.OK
+
+def usage_summary(user_id: int, days: int = 7) -> Dict:
+    """Daily rollups for the last `days` days plus today's budget position."""
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rollups = UsageRollup.objects.filter(user_id=user_id, date__gte=since).order_by('-date', 'stage', 'model')
+    return {
+        'budget': {
+            'status': budget_status(user_id),
+            'tokens_today': tokens_used_today(user_id),
+            'soft_limit': USAGE_SOFT_BUDGET_TOKENS or None,
+            'hard_limit': USAGE_HARD_BUDGET_TOKENS or None,
+        },
+        'rollups': list(rollups.values(
+            'date', 'stage', 'model', 'route', 'calls', 'cache_hits', 'prompt_tokens', 'cached_tokens',
+            'completion_tokens', 'latency_ms', 'cost_usd'
+        )),
+    }
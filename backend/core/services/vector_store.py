@@ -0,0 +1,267 @@
+import os
+import json
+import uuid
+import shutil
+import threading
+import numpy as np
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import List, Dict, Optional
+from . import qdrant_client
+from .tracing import traced
+from .metrics import observe_upstream, chunks_ingested
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+# 'qdrant' talks to the Qdrant server; 'local' keeps vectors in memory-mapped files
+# inside this process, for development, tests and small single-node deployments.
+VECTOR_STORE_BACKEND = os.getenv('VECTOR_STORE_BACKEND', 'qdrant')
+VECTOR_STORE_PATH = os.getenv(
+    'VECTOR_STORE_PATH',
+    os.path.join(os.path.dirname(__file__), '../../vector_store')
+)
+
+def point_id(payload: Dict) -> str:
+    """
+    Stable point id for a chunk, so re-ingesting a document replaces its points
+    instead of piling up duplicates.
+    """
+    if payload.get('doc_id') is not None and payload.get('chunk_index') is not None:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{payload['doc_id']}:{payload['chunk_index']}"))
+    return str(uuid.uuid4())
+
+class VectorStore(ABC):
+    """Interface shared by the vector store backends."""
+    @abstractmethod
+    def upsert_vectors(self, vectors: List[Dict], collection: str):
+        ...
+
+    @abstractmethod
+    def search_vectors(self, query_embedding: List[float], collection: str, top: int = 5, user_id: Optional[int] = None, with_vectors: bool = False) -> Dict:
+        ...
+
+    @abstractmethod
+    def delete_vectors_by_doc_id(self, doc_id: str, collection: str, user_id: Optional[int] = None):
+        ...
+
+class QdrantVectorStore(VectorStore):
+    def upsert_vectors(self, vectors, collection):
+        return qdrant_client.upsert_vectors(vectors, collection=collection)
+
+    def search_vectors(self, query_embedding, collection, top=5, user_id=None, with_vectors=False):
+        return qdrant_client.search_vectors(query_embedding, collection=collection, top=top, user_id=user_id, with_vectors=with_vectors)
+
+    def delete_vectors_by_doc_id(self, doc_id, collection, user_id=None):
+        return qdrant_client.delete_vectors_by_doc_id(doc_id, collection=collection, user_id=user_id)
+
+class _Segment:
+    """One immutable generation of a collection: vectors plus aligned ids/payloads."""
+    def __init__(self, generation: str, vectors: np.ndarray, ids: List[str], payloads: List[Dict]):
+        self.generation = generation
+        self.vectors = vectors
+        self.ids = ids
+        self.payloads = payloads
+        self.tenants = np.array([str(p.get('user_id')) for p in payloads], dtype=object)
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store. Each collection directory holds numbered generations
+    (vectors.npy + points.json) and a CURRENT file naming the live one. Writers build
+    a new generation and swap CURRENT with os.replace, so readers in any process see
+    either the old or the new data, never a partial write. Vectors are L2-normalised
+    float32, memory-mapped on load and searched by a single matrix-vector product.
+    Every upsert or delete rewrites and fsyncs the whole collection, vectors and payload
+    JSON, so a write costs O(collection size): keep collections to about 10k chunks
+    (some 60 MB of 1536-dim vectors plus payloads per write) and use Qdrant beyond that.
+    """
+    def __init__(self, path: str = None):
+        self.path = os.path.abspath(path or VECTOR_STORE_PATH)
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    # --- Storage ---
+    def _collection_dir(self, collection: str) -> str:
+        return os.path.join(self.path, collection)
+
+    def _current_generation(self, collection: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self._collection_dir(collection), 'CURRENT')) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _load(self, collection: str, retries: int = 3) -> Optional[_Segment]:
+        generation = self._current_generation(collection)
+        if generation is None:
+            return None
+        cached = self._segments.get(collection)
+        if cached is not None and cached.generation == generation:
+            return cached
+        gen_dir = os.path.join(self._collection_dir(collection), generation)
+        try:
+            vectors = np.load(os.path.join(gen_dir, 'vectors.npy'), mmap_mode='r')
+            with open(os.path.join(gen_dir, 'points.json')) as f:
+                points = json.load(f)
+        except FileNotFoundError:
+            # A writer swapped generations between reading CURRENT and opening the files
+            if retries <= 0:
+                raise
+            return self._load(collection, retries - 1)
+        segment = _Segment(generation, vectors, points['ids'], points['payloads'])
+        self._segments[collection] = segment
+        return segment
+
+    def _write(self, collection: str, vectors: np.ndarray, ids: List[str], payloads: List[Dict]):
+        coll_dir = self._collection_dir(collection)
+        previous = self._current_generation(collection)
+        generation = f"gen-{int(previous.split('-')[1]) + 1 if previous else 1:08d}"
+        gen_dir = os.path.join(coll_dir, generation)
+        os.makedirs(gen_dir, exist_ok=True)
+        with open(os.path.join(gen_dir, 'vectors.npy'), 'wb') as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(os.path.join(gen_dir, 'points.json'), 'w') as f:
+            json.dump({'ids': ids, 'payloads': payloads}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp = os.path.join(coll_dir, 'CURRENT.tmp')
+        with open(tmp, 'w') as f:
+            f.write(generation)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(coll_dir, 'CURRENT'))
+        if previous:
+            # Readers holding the old generation keep their open mmap; unlinking is safe on POSIX
+            shutil.rmtree(os.path.join(coll_dir, previous), ignore_errors=True)
+
+    @contextmanager
+    def _locked(self, collection: str):
+        """Serialise writers across threads and, where flock exists, across processes."""
+        with self._lock:
+            os.makedirs(self._collection_dir(collection), exist_ok=True)
+            with open(os.path.join(self._collection_dir(collection), '.lock'), 'w') as handle:
+                if fcntl:
+                    fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(handle, fcntl.LOCK_UN)
+
+    # --- VectorStore API ---
+    @traced('local_store.upsert_vectors')
+    @observe_upstream('local_store', 'upsert')
+    def upsert_vectors(self, vectors, collection):
+        if not vectors:
+            return {'status': 'ok', 'result': {'upserted': 0}}
+        tenant_collection = collection in qdrant_client.TENANT_COLLECTIONS
+        new = np.asarray([v['embedding'] for v in vectors], dtype=np.float32)
+        new /= np.maximum(np.linalg.norm(new, axis=1, keepdims=True), 1e-12)
+        new_ids, new_payloads = [], []
+        for v in vectors:
+            payload = {"chunk": v['chunk'], **v.get('metadata', {})}
+            if tenant_collection and payload.get('user_id') is None:
+                raise ValueError(f"user_id is required to upsert into tenant collection {collection}")
+            new_ids.append(str(v.get('id') or point_id(payload)))
+            new_payloads.append(payload)
+        with self._locked(collection):
+            segment = self._load(collection)
+            if segment is None:
+                self._write(collection, new, new_ids, new_payloads)
+            else:
+                if segment.vectors.shape[1] != new.shape[1]:
+                    raise ValueError(f"Vector size {new.shape[1]} does not match collection {collection} ({segment.vectors.shape[1]})")
+                replaced = set(new_ids)
+                keep = [i for i, pid in enumerate(segment.ids) if pid not in replaced]
+                self._write(
+                    collection,
+                    np.concatenate([segment.vectors[keep], new]),
+                    [segment.ids[i] for i in keep] + new_ids,
+                    [segment.payloads[i] for i in keep] + new_payloads
+                )
+        return {'status': 'ok', 'result': {'upserted': len(new_ids)}}
+
+    @traced('local_store.search_vectors')
+    @observe_upstream('local_store', 'search')
+    def search_vectors(self, query_embedding, collection, top=5, user_id=None, with_vectors=False):
+        if collection in qdrant_client.TENANT_COLLECTIONS and user_id is None:
+            raise ValueError(f"user_id is required to search tenant collection {collection}")
+        segment = self._load(collection)
+        if segment is None or not segment.ids:
+            return {'result': []}
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)  # not in place: callers reuse their embedding
+        scores = np.asarray(segment.vectors @ query)
+        if user_id is not None and collection in qdrant_client.TENANT_COLLECTIONS:
+            scores = np.where(segment.tenants == str(user_id), scores, -np.inf)
+        top = min(top, len(scores))
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+        results = []
+        for i in best:
+            if not np.isfinite(scores[i]):
+                continue
+            hit = {'id': segment.ids[i], 'score': float(scores[i]), 'payload': segment.payloads[i]}
+            if with_vectors:
+                hit['vector'] = segment.vectors[i].tolist()
+            results.append(hit)
+        return {'result': results}
+
+    @traced('local_store.delete_vectors_by_doc_id')
+    @observe_upstream('local_store', 'delete')
+    def delete_vectors_by_doc_id(self, doc_id, collection, user_id=None):
+        with self._locked(collection):
+            segment = self._load(collection)
+            if segment is None:
+                return None
+            keep = [
+                i for i, p in enumerate(segment.payloads)
+                if str(p.get('doc_id')) != str(doc_id) or (user_id is not None and str(p.get('user_id')) != str(user_id))
+            ]
+            if len(keep) == len(segment.ids):
+                return {'status': 'ok', 'result': {'deleted': 0}}
+            self._write(
+                collection,
+                segment.vectors[keep],
+                [segment.ids[i] for i in keep],
+                [segment.payloads[i] for i in keep]
+            )
+        return {'status': 'ok', 'result': {'deleted': len(segment.ids) - len(keep)}}
+
+BACKENDS = {
+    'qdrant': QdrantVectorStore,
+    'local': LocalVectorStore,
+}
+
+_store = None
+
+def get_vector_store() -> VectorStore:
+    """The configured backend, created once per process."""
+    global _store
+    if _store is None:
+        if VECTOR_STORE_BACKEND not in BACKENDS:
+            raise ValueError(f"Unknown vector store backend: {VECTOR_STORE_BACKEND}")
+        _store = BACKENDS[VECTOR_STORE_BACKEND]()
+    return _store
+
+# --- Module-level API used by ingestion, retrieval and signals ---
+def upsert_vectors(vectors: List[Dict], collection: str = qdrant_client.QDRANT_COLLECTION):
+    points = []
+    for v in vectors:
+        # The raw per-model embeddings are already the point vector; don't duplicate them in the payload
+        metadata = {k: val for k, val in v.get('metadata', {}).items() if k != 'embeddings'}
+        points.append({**v, 'metadata': metadata, 'id': v.get('id') or point_id(metadata)})
+    result = get_vector_store().upsert_vectors(points, collection)
+    chunks_ingested.labels(collection).inc(len(vectors))
+    return result
+
+def search_vectors(query_embedding: List[float], collection: str = qdrant_client.QDRANT_COLLECTION, top: int = 5, user_id: Optional[int] = None, with_vectors: bool = False):
+    return get_vector_store().search_vectors(query_embedding, collection, top=top, user_id=user_id, with_vectors=with_vectors)
+
+def delete_vectors_by_doc_id(doc_id: str, collection: str = qdrant_client.QDRANT_COLLECTION, user_id: Optional[int] = None):
+    """Pass the owner's user_id for tenant collections so the delete stays within the tenant."""
+    return get_vector_store().delete_vectors_by_doc_id(doc_id, collection, user_id=user_id)
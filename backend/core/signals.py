@@ -1,8 +1,12 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db import transaction
 from django.dispatch import receiver
-from .models import GlobalKnowledgeDocument, PersonalKnowledgeDocument
-from .services.ingestion import ingest_document
-from .services.qdrant_client import upsert_vectors
+from .models import GlobalKnowledgeDocument, PersonalKnowledgeDocument, Conversation, ConversationArchive, Message
+from .services.activity import bump
+from .services.ingest_queue import ingestion_queue
+from .services.answer_cache import answer_cache
+from .services.memory import memory_indexer
+from .services.archive import unindex_archive
 
 # Utility to get file type from model instance
 
@@ -10,69 +14,61 @@ def read_file_content(file_field):
     file_field.seek(0)
     return file_field.read().decode('utf-8')
 
+# Uploaded documents are ingested in the background once committed; the upload returns at once
 @receiver(post_save, sender=GlobalKnowledgeDocument)
 def ingest_global_kb(sender, instance, created, **kwargs):
-    if not created:
-        return
-    import logging
-    logger = logging.getLogger('ai_manager')
-    chunks = ingest_document(
-        instance.file,
-        instance.file_type,
-        doc_metadata={
-            'doc_id': instance.id,
-            'title': instance.title,
-            'file_type': instance.file_type
-        },
-        is_global=True
-    )
-    qdrant_vectors = []
-    skipped_chunks = 0
-    for c in chunks:
-        embeddings = c['metadata'].get('embeddings', [])
-        if not embeddings or not isinstance(embeddings, list) or len(embeddings) == 0 or embeddings[0] is None:
-            
-            skipped_chunks += 1
-            continue
-        qdrant_vectors.append({
-            'embedding': embeddings[0],
-            'chunk': c['chunk'],
-            'metadata': c['metadata']
-        })
-    if not qdrant_vectors:
-        return
-    upsert_vectors(qdrant_vectors, collection='global_kb')
+    if created:
+        transaction.on_commit(lambda: ingestion_queue.enqueue('global', instance.id))
 
 @receiver(post_save, sender=PersonalKnowledgeDocument)
 def ingest_personal_kb(sender, instance, created, **kwargs):
-    if not created:
-        return
-    import logging
-    logger = logging.getLogger('ai_manager')
-    chunks = ingest_document(
-        instance.file,
-        instance.file_type,
-        doc_metadata={
-            'doc_id': instance.id,
-            'title': instance.title,
-            'file_type': instance.file_type
-        },
-        user_id=instance.owner.id,
-        is_global=False
-    )
-    qdrant_vectors = []
-    skipped_chunks = 0
-    for c in chunks:
-        embeddings = c['metadata'].get('embeddings', [])
-        if not embeddings or not isinstance(embeddings, list) or len(embeddings) == 0 or embeddings[0] is None:
-            
-            skipped_chunks += 1
-            continue
-        qdrant_vectors.append({
-            'embedding': embeddings[0],
-            'chunk': c['chunk'],
-            'metadata': c['metadata']
-        })
-    if not qdrant_vectors:
-        return
-    upsert_vectors(qdrant_vectors, collection='personal_kb') 
\ No newline at end of file
+    if created:
+        transaction.on_commit(lambda: ingestion_queue.enqueue('personal', instance.id))
+
+# Cached answers go stale when the KB they were built from changes
+@receiver(post_save, sender=GlobalKnowledgeDocument)
+@receiver(post_delete, sender=GlobalKnowledgeDocument)
+def invalidate_global_answers(sender, instance, **kwargs):
+    answer_cache.invalidate_global()
+
+@receiver(post_save, sender=PersonalKnowledgeDocument)
+@receiver(post_delete, sender=PersonalKnowledgeDocument)
+def invalidate_personal_answers(sender, instance, **kwargs):
+    answer_cache.invalidate_user(instance.owner_id)
+
+# Dashboard counters
+@receiver(post_save, sender=PersonalKnowledgeDocument)
+def count_personal_document(sender, instance, created, **kwargs):
+    if created:
+        bump(instance.owner_id, documents=1)
+
+@receiver(post_delete, sender=PersonalKnowledgeDocument)
+def uncount_personal_document(sender, instance, **kwargs):
+    bump(instance.owner_id, active=False, documents=-1, chunks=-instance.metadata.get('num_chunks', 0))
+
+@receiver(post_save, sender=Conversation)
+def count_conversation(sender, instance, created, **kwargs):
+    if created:
+        bump(instance.user_id, conversations=1)
+
+@receiver(pre_delete, sender=Conversation)
+def uncount_conversation(sender, instance, **kwargs):
+    # Messages go with the conversation; there is no per-message delete receiver so they can be fast-deleted
+    archived = ConversationArchive.objects.filter(conversation=instance).values_list('message_count', flat=True).first() or 0
+    bump(instance.user_id, active=False, conversations=-1, messages=-(instance.messages.count() + archived))
+
+# Rehydrating or deleting a conversation drops its archive, and with it the archived search entries
+@receiver(pre_delete, sender=ConversationArchive)
+def unindex_archived_messages(sender, instance, **kwargs):
+    unindex_archive(instance)
+
+@receiver(post_save, sender=Message)
+def count_message(sender, instance, created, **kwargs):
+    if created:
+        bump(instance.conversation.user_id, messages=1)
+
+# Long-term memory: index each exchange once its reply is committed
+@receiver(post_save, sender=Message)
+def remember_exchange(sender, instance, created, **kwargs):
+    if created and instance.sender == 'ai':
+        transaction.on_commit(lambda: memory_indexer.enqueue(instance.id))
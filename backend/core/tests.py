@@ -35,3 +35,1292 @@ class AgenticRAGTests(TestCase):
         self.assertIn("What should I focus on?", prompt)
 
     # Add more tests for chatbot memory/follow-up as needed
+
+
+class QdrantCollectionProfileTests(TestCase):
+    def test_quantized_profile_config(self):
+        from core.services.qdrant_client import build_collection_config
+        config = build_collection_config(1536, "Cosine", "binary_on_disk")
+        self.assertTrue(config["vectors"]["on_disk"])
+        self.assertIn("binary", config["quantization_config"])
+        self.assertNotIn("quantization_config", build_collection_config(1536, "Cosine", "float32"))
+
+    def test_search_uses_profile_rescoring(self):
+        from core.services import qdrant_client
+        with patch.dict('os.environ', {'QDRANT_PROFILE_PERSONAL_KB': 'scalar'}), \
+             patch('core.services.qdrant_client.requests.post') as mock_post:
+            mock_post.return_value.json.return_value = {'result': []}
+            qdrant_client.search_vectors([0.1] * 4, collection='personal_kb', top=3, user_id=1)
+            params = mock_post.call_args.kwargs['json']['params']
+            self.assertTrue(params['quantization']['rescore'])
+
+
+class TenantPartitioningTests(TestCase):
+    def test_personal_search_is_scoped_to_tenant(self):
+        from core.services import qdrant_client
+        with patch('core.services.qdrant_client.requests.post') as mock_post:
+            mock_post.return_value.json.return_value = {'result': []}
+            qdrant_client.search_vectors([0.1] * 4, collection='personal_kb', top=3, user_id=7, tenant_mode='shard')
+            body = mock_post.call_args.kwargs['json']
+            self.assertEqual(body['filter']['must'][0]['match']['value'], '7')
+            self.assertEqual(body['shard_key'], qdrant_client.tenant_shard_key(7))
+        with self.assertRaises(ValueError):
+            qdrant_client.search_vectors([0.1] * 4, collection='personal_kb', top=3)
+
+    def test_upsert_routes_points_by_shard_key(self):
+        from core.services import qdrant_client
+        vectors = [
+            {'embedding': [0.1] * 4, 'chunk': 'a', 'metadata': {'user_id': 1}},
+            {'embedding': [0.2] * 4, 'chunk': 'b', 'metadata': {'user_id': 2}},
+        ]
+        with patch('core.services.qdrant_client.ensure_collection'), \
+             patch('core.services.qdrant_client.requests.put') as mock_put:
+            qdrant_client.upsert_vectors(vectors, collection='personal_kb', tenant_mode='shard')
+            shard_keys = {c.kwargs['json']['shard_key'] for c in mock_put.call_args_list}
+            self.assertEqual(shard_keys, {qdrant_client.tenant_shard_key(1), qdrant_client.tenant_shard_key(2)})
+            points = [p for c in mock_put.call_args_list for p in c.kwargs['json']['points']]
+            self.assertEqual({p['payload']['tenant_id'] for p in points}, {'1', '2'})
+
+    def test_delete_is_routed_to_the_tenant_shard(self):
+        from core.services import qdrant_client
+        with patch('core.services.qdrant_client.requests.post') as mock_post:
+            mock_post.return_value.status_code = 200
+            qdrant_client.delete_vectors_by_doc_id('42', collection='personal_kb', user_id=7, tenant_mode='shard')
+            body = mock_post.call_args.kwargs['json']
+        self.assertEqual(body['shard_key'], qdrant_client.tenant_shard_key(7))
+        self.assertEqual(body['filter']['must'], [
+            {'key': 'doc_id', 'match': {'value': '42'}}, {'key': 'tenant_id', 'match': {'value': '7'}}
+        ])
+
+    def test_backfill_indexes_and_stamps_existing_points(self):
+        from unittest.mock import MagicMock
+        from core.services import qdrant_client
+        collection = MagicMock(status_code=200)
+        collection.json.return_value = {'result': {'config': {'params': {}}}}
+        pages = [
+            {'result': {'points': [{'id': 1, 'payload': {'user_id': 7}}, {'id': 2, 'payload': {'user_id': 8}},
+                                   {'id': 3, 'payload': {}}], 'next_page_offset': 4}},
+            {'result': {'points': [{'id': 4, 'payload': {'user_id': 7}}], 'next_page_offset': None}},
+        ]
+
+        def post(url, **kwargs):
+            return MagicMock(status_code=200, **{'json.return_value': pages.pop(0) if url.endswith('/scroll') else {}})
+
+        with patch('core.services.qdrant_client.requests.get', return_value=collection), \
+             patch('core.services.qdrant_client.requests.patch') as mock_patch, \
+             patch('core.services.qdrant_client.requests.put') as mock_put, \
+             patch('core.services.qdrant_client.requests.post', side_effect=post) as mock_post:
+            mock_patch.return_value.status_code = mock_put.return_value.status_code = 200
+            counts = qdrant_client.backfill_tenants('personal_kb', tenant_mode='payload')
+        self.assertEqual(counts, {'updated': 3, 'skipped': 1})
+        self.assertEqual(mock_patch.call_args.kwargs['json']['hnsw_config']['payload_m'], 16)
+        self.assertEqual(mock_put.call_args.kwargs['json'], {'field_name': 'tenant_id', 'field_schema': {'type': 'keyword', 'is_tenant': True}})
+        stamped = [(c.kwargs['json']['payload']['tenant_id'], c.kwargs['json']['points'])
+                   for c in mock_post.call_args_list if '/points/payload' in c.args[0]]
+        self.assertEqual(stamped, [('7', [1]), ('8', [2]), ('7', [4])])
+        scrolls = [c.kwargs['json'] for c in mock_post.call_args_list if c.args[0].endswith('/scroll')]
+        self.assertEqual(scrolls[0]['filter'], {'must': [{'is_empty': {'key': 'tenant_id'}}]})
+        self.assertEqual(scrolls[1]['offset'], 4)
+
+
+class LocalVectorStoreTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from core.services.vector_store import LocalVectorStore
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = LocalVectorStore(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_search_is_tenant_scoped_and_persisted(self):
+        from core.services.vector_store import LocalVectorStore
+        self.store.upsert_vectors([
+            {'id': 'a', 'embedding': [1.0, 0.0], 'chunk': 'mine', 'metadata': {'user_id': 1, 'doc_id': '10'}},
+            {'id': 'b', 'embedding': [0.9, 0.1], 'chunk': 'theirs', 'metadata': {'user_id': 2, 'doc_id': '11'}},
+        ], 'personal_kb')
+        result = self.store.search_vectors([1.0, 0.0], 'personal_kb', top=5, user_id=1)['result']
+        self.assertEqual([r['payload']['chunk'] for r in result], ['mine'])
+        # A fresh instance reads the same generation from disk
+        reopened = LocalVectorStore(self.tmp.name)
+        self.assertEqual(len(reopened.search_vectors([0.0, 1.0], 'personal_kb', top=5, user_id=2)['result']), 1)
+
+    def test_search_leaves_the_query_embedding_untouched(self):
+        import numpy as np
+        self.store.upsert_vectors([{'id': 'a', 'embedding': [3.0, 4.0], 'chunk': 'doc', 'metadata': {'doc_id': '1'}}], 'global_kb')
+        query = np.array([3.0, 4.0], dtype=np.float32)
+        self.store.search_vectors(query, 'global_kb', top=1)
+        self.assertEqual(query.tolist(), [3.0, 4.0])
+
+    def test_upsert_leaves_the_callers_points_untouched(self):
+        from core.services import vector_store
+        points = [{'embedding': [1.0, 0.0], 'chunk': 'doc', 'metadata': {'doc_id': '1', 'chunk_index': 0, 'embeddings': {'openai': [1.0, 0.0]}}}]
+        with patch.object(vector_store, '_store', self.store):
+            vector_store.upsert_vectors(points, 'global_kb')
+        self.assertEqual(points, [{'embedding': [1.0, 0.0], 'chunk': 'doc', 'metadata': {'doc_id': '1', 'chunk_index': 0, 'embeddings': {'openai': [1.0, 0.0]}}}])
+        payload = self.store.search_vectors([1.0, 0.0], 'global_kb', top=1)['result'][0]['payload']
+        self.assertNotIn('embeddings', payload)
+
+    def test_backends_must_implement_the_interface(self):
+        from core.services.vector_store import VectorStore
+
+        class Partial(VectorStore):
+            def upsert_vectors(self, vectors, collection):
+                pass
+        with self.assertRaises(TypeError):
+            Partial()
+
+    def test_upsert_replaces_and_delete_by_doc_id(self):
+        vectors = [{'id': 'x', 'embedding': [0.0, 1.0], 'chunk': 'v1', 'metadata': {'doc_id': '5'}}]
+        self.store.upsert_vectors(vectors, 'global_kb')
+        vectors[0]['chunk'] = 'v2'
+        self.store.upsert_vectors(vectors, 'global_kb')
+        result = self.store.search_vectors([0.0, 1.0], 'global_kb', top=5)['result']
+        self.assertEqual([r['payload']['chunk'] for r in result], ['v2'])
+        self.store.delete_vectors_by_doc_id('5', 'global_kb')
+        self.assertEqual(self.store.search_vectors([0.0, 1.0], 'global_kb', top=5)['result'], [])
+
+
+class RerankerTests(TestCase):
+    def setUp(self):
+        from core.services.reranker import CrossEncoderReranker
+        self.reranker = CrossEncoderReranker(batch_size=2, time_budget_ms=1000)
+        self.reranker._model = object()  # skip loading real weights
+        self.hits = [{'payload': {'chunk': c}} for c in ['weak', 'strong', 'medium']]
+
+    def test_rerank_orders_by_cross_encoder_score(self):
+        scores = {'weak': 0.1, 'strong': 0.9, 'medium': 0.5}
+        with patch.object(self.reranker, 'score_batch', side_effect=lambda q, ps: [scores[p] for p in ps]):
+            result = self.reranker.rerank("query", self.hits, top_n=2)
+        self.assertEqual([r['payload']['chunk'] for r in result], ['strong', 'medium'])
+
+    def test_rerank_falls_back_to_vector_order_over_budget(self):
+        self.reranker.time_budget_ms = 0
+        with patch.object(self.reranker, 'score_batch', return_value=[1.0, 0.0]):
+            result = self.reranker.rerank("query", self.hits, top_n=2)
+        self.assertEqual([r['payload']['chunk'] for r in result], ['weak', 'strong'])
+
+    def test_failed_load_is_remembered_and_never_blocks_the_request(self):
+        from core.services.reranker import CrossEncoderReranker
+        reranker = CrossEncoderReranker(batch_size=2, time_budget_ms=200)
+        with patch.object(reranker, '_load', side_effect=OSError('offline')) as load:
+            result = reranker.rerank("query", self.hits, top_n=2)
+            reranker._load_done.wait(1)
+            again = reranker.rerank("query", self.hits, top_n=2)
+        self.assertEqual([r['payload']['chunk'] for r in result], ['weak', 'strong'])
+        self.assertEqual(again, result)
+        self.assertEqual(load.call_count, 1)  # the failure backs off instead of retrying per request
+        self.assertEqual(reranker.start_loading(), 'unavailable')
+
+    def test_load_time_counts_against_the_budget(self):
+        import time
+        from core.services.reranker import CrossEncoderReranker
+        reranker = CrossEncoderReranker(batch_size=2, time_budget_ms=50)
+        with patch.object(reranker, '_load', side_effect=lambda: time.sleep(0.5)):
+            started = time.perf_counter()
+            result = reranker.rerank("query", self.hits, top_n=2)
+            elapsed = time.perf_counter() - started
+        self.assertLess(elapsed, 0.3)
+        self.assertEqual([r['payload']['chunk'] for r in result], ['weak', 'strong'])
+
+
+class DiversitySelectionTests(TestCase):
+    def test_mmr_drops_near_duplicates_and_respects_budget(self):
+        from core.services.mmr import mmr_select
+        vectors = [[1.0, 0.0, 0.0], [0.999, 0.01, 0.0], [0.6, 0.8, 0.0], [0.5, 0.0, 0.86]]
+        picks = mmr_select([1.0, 0.0, 0.0], vectors, token_counts=[100, 100, 100, 500], token_budget=300)
+        self.assertEqual(picks[0], 0)
+        self.assertNotIn(1, picks)  # overlapping neighbour chunk
+        self.assertNotIn(3, picks)  # does not fit the remaining budget
+        self.assertIn(2, picks)
+
+    def test_select_diverse_spans_both_kbs(self):
+        def hit(chunk, vector, score):
+            return {'payload': {'chunk': chunk, 'start_token': 0, 'end_token': 100}, 'vector': vector, 'score': score}
+        candidates = {
+            'global': [hit('g1', [1.0, 0.0], 0.99), hit('g1 overlap', [0.999, 0.02], 0.98)],
+            'personal': [hit('p1', [0.7, 0.7], 0.7)],
+        }
+        selected = agent.select_diverse([1.0, 0.0], candidates, top_k=2, token_budget=1000)
+        self.assertEqual([h['payload']['chunk'] for h in selected['global']], ['g1'])
+        self.assertEqual([h['payload']['chunk'] for h in selected['personal']], ['p1'])
+
+    def test_select_diverse_uses_one_score_scale_when_rerank_fell_back_for_a_kb(self):
+        def hit(chunk, vector, score, rerank_score=None):
+            h = {'payload': {'chunk': chunk, 'start_token': 0, 'end_token': 100}, 'vector': vector, 'score': score}
+            if rerank_score is not None:
+                h['rerank_score'] = rerank_score
+            return h
+        candidates = {
+            'global': [hit('g1', [1.0, 0.0], 0.4, rerank_score=8.0)],  # reranked
+            'personal': [hit('p1', [0.0, 1.0], 0.9)],  # rerank fell back to vector order
+        }
+        with patch('core.services.agent.mmr_select', return_value=[1, 0]) as select:
+            agent.select_diverse([1.0, 0.0], candidates, top_k=1, token_budget=1000)
+        self.assertEqual(select.call_args.kwargs['relevance'], [0.4, 0.9])
+        candidates['personal'][0]['rerank_score'] = -2.0
+        with patch('core.services.agent.mmr_select', return_value=[0, 1]) as select:
+            agent.select_diverse([1.0, 0.0], candidates, top_k=1, token_budget=1000)
+        self.assertGreater(select.call_args.kwargs['relevance'][0], 0.99)
+        self.assertLess(select.call_args.kwargs['relevance'][1], 0.2)
+
+
+class SemanticAnswerCacheTests(TestCase):
+    def setUp(self):
+        from core.services.answer_cache import SemanticAnswerCache
+        self.cache = SemanticAnswerCache()
+
+    def test_global_answers_are_shared_and_personal_answers_scoped(self):
+        self.cache.store([1.0, 0.0], 1, 'global', 'how do I pitch to playlists', 'Pitch early.', 1200)
+        self.cache.store([0.0, 1.0], 1, 'personal', 'what did my last show earn', 'About $400.', 900)
+        self.assertEqual(self.cache.lookup([0.99, 0.01], user_id=2).response, 'Pitch early.')
+        self.assertIsNone(self.cache.lookup([0.0, 1.0], user_id=2))
+        self.assertEqual(self.cache.lookup([0.0, 1.0], user_id=1).response, 'About $400.')
+        from core.models import SemanticCacheStat
+        stat = SemanticCacheStat.objects.get()
+        self.assertEqual((stat.lookups, stat.global_hits, stat.personal_hits), (3, 1, 1))
+
+    def test_answers_built_on_a_conversation_stay_in_it(self):
+        from types import SimpleNamespace
+        from core.models import User, SemanticCacheEntry
+        from core.services import ai_service as ai_module
+        user = User.objects.create_user(username='cache', email='cache@example.com', password='pw')
+        self.cache.store([0.0, 1.0], None, 'global', 'what about the second one of these', 'Shared answer.', 800)
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='The Leeds show, as you said.'))],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=20, prompt_tokens_details=None)
+        )
+        history = [{'role': 'user', 'content': 'List my upcoming shows'}, {'role': 'assistant', 'content': 'Manchester, then Leeds.'}]
+        with patch.object(ai_module, 'answer_cache', self.cache), \
+             patch.object(agent, 'embed_query', side_effect=lambda *a, **k: [0.0, 1.0]), \
+             patch.object(agent, 'classify_intent', return_value='global'), \
+             patch.object(agent, 'retrieve_context', side_effect=lambda *a, **k: {}), \
+             patch.object(ai_module.ai_service, '_build_messages', return_value=[]), \
+             patch.object(ai_module.ai_service, '_measure', return_value=(0, [], [])), \
+             patch('core.services.ai_service.openai.chat.completions.create', return_value=response) as create:
+            # Mid-conversation the shared answer is not served: the turn needs its history
+            reply = ai_module.ai_service.generate_reply('what about the second one of these', history, user_id=user.id)
+            self.assertEqual(reply['text'], 'The Leeds show, as you said.')
+            create.assert_called_once()
+            # ...and the history-dependent answer is not kept for another conversation
+            self.assertEqual(list(SemanticCacheEntry.objects.values_list('response', flat=True)), ['Shared answer.'])
+            self.cache.invalidate_global()
+            self.assertIsNone(self.cache.lookup([0.0, 1.0], user_id=user.id))
+            # Recalled exchanges tie an answer to the user's past chats as well
+            agent.retrieve_context.side_effect = lambda *a, **k: {'memory': ['Leeds was moved to May.']}
+            ai_module.ai_service.generate_reply('what about the second one of these', [], user_id=user.id)
+            self.assertEqual(create.call_count, 2)
+        self.assertFalse(SemanticCacheEntry.objects.exists())
+
+    def test_user_invalidation_clears_only_that_scope(self):
+        self.cache.store([1.0, 0.0], 1, 'global', 'q', 'global answer', 10)
+        self.cache.store([0.0, 1.0], 1, 'hybrid', 'q', 'personal answer', 10)
+        self.cache.invalidate_user(1)
+        self.assertIsNone(self.cache.lookup([0.0, 1.0], user_id=1))
+        self.assertIsNotNone(self.cache.lookup([1.0, 0.0], user_id=1))
+
+
+class PromptLayoutTests(TestCase):
+    def test_static_block_leads_and_volatile_content_is_last(self):
+        from core.services.ai_service import ai_service
+        from core.services.agent import SYSTEM_PROMPT
+        history = [{'role': 'user', 'content': 'Hi'}, {'role': 'assistant', 'content': 'Hello!'}]
+        prompt = agent.build_prompt({'global': ['Pitch early.']}, 'How do I pitch?')
+        # Whitespace tokens keep the test offline (tiktoken downloads its BPE files)
+        with patch('tiktoken.encoding_for_model') as mock_encoding:
+            mock_encoding.return_value.encode = str.split
+            messages = ai_service._build_messages(prompt, history)
+        self.assertEqual(messages[0], {'role': 'system', 'content': SYSTEM_PROMPT})
+        self.assertEqual(messages[1:3], history)
+        self.assertEqual(messages[-1]['role'], 'user')
+        self.assertIn('Pitch early.', messages[-1]['content'])
+        self.assertTrue(messages[-1]['content'].endswith('User Query: How do I pitch?'))
+
+    def test_history_prefix_is_stable_across_turns_past_the_window(self):
+        from rest_framework.test import APIClient
+        from core.models import User, Conversation
+        from core.services.ai_service import ai_service, history_window_start, HISTORY_WINDOW_MESSAGES, HISTORY_BLOCK_MESSAGES
+        user = User.objects.create_user(username='prefix', email='prefix@example.com', password='pw')
+        conversation = Conversation.objects.create(user=user, title='Prefix')
+        client = APIClient()
+        client.force_authenticate(user)
+        histories = []
+        def reply(user_message, conversation_history, **kwargs):
+            histories.append(conversation_history)
+            return {'text': f'answer to {user_message}', 'usage': {}}
+        with patch('core.services.admission.ADMISSION_ENABLED', False), \
+             patch('core.views.ai_service.generate_reply', side_effect=reply), \
+             patch('tiktoken.encoding_for_model') as mock_encoding:
+            mock_encoding.return_value.encode = str.split
+            for i in range(HISTORY_WINDOW_MESSAGES + HISTORY_BLOCK_MESSAGES):
+                client.post('/api/chat/messages/', {'conversation': conversation.id, 'text': f'question {i}', 'sender': 'user'}, format='json')
+            messages = [ai_service._build_messages('volatile', history) for history in histories]
+        checked = 0
+        for n, (previous, current) in enumerate(zip(messages, messages[1:])):
+            # Each turn adds a user and an AI message; the window start only moves on a block boundary
+            if history_window_start(2 * n) != history_window_start(2 * (n + 1)):
+                continue
+            k = len(previous) - 1  # everything before the volatile turn
+            self.assertEqual(current[:k], previous[:k], n)
+            checked += len(histories[n]) >= HISTORY_WINDOW_MESSAGES
+        self.assertGreater(len(histories[-1]), HISTORY_WINDOW_MESSAGES)
+        self.assertGreater(checked, HISTORY_BLOCK_MESSAGES // 2)
+
+    def test_long_conversations_route_to_the_larger_context_window(self):
+        from core.services import ai_service as ai_module
+        from core.services import model_registry
+        # About 20k tokens of history: over the fast model's 16k window, well inside the strong model's
+        history = [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': 'word ' * 1000} for i in range(20)]
+        with patch.dict(model_registry.STAGE_MODELS, {'chat_fast': 'gpt-3.5-turbo', 'chat_strong': 'gpt-4o'}), \
+             patch('tiktoken.encoding_for_model') as mock_encoding, \
+             patch.object(agent, 'classify_intent', return_value='global'), \
+             patch.object(agent, 'retrieve_context', return_value={}), \
+             patch.object(ai_module.answer_cache, 'enabled_for', return_value=False), \
+             patch('core.services.ai_service.openai.chat.completions.create', side_effect=RuntimeError('offline')) as create:
+            mock_encoding.return_value.encode = str.split
+            ai_module.ai_service.generate_reply('Thanks!', history)
+            self.assertEqual(create.call_args.kwargs['model'], 'gpt-4o')
+            self.assertEqual(len(create.call_args.kwargs['messages']), 22)  # nothing trimmed
+            trimmed = ai_module.ai_service._build_messages('Thanks!', history, model='gpt-3.5-turbo')
+        self.assertLess(len(trimmed), 22)
+        self.assertIn('Summary of earlier conversation', trimmed[-1]['content'])
+
+    def test_usage_includes_cached_tokens(self):
+        from types import SimpleNamespace
+        from core.services.ai_service import ai_service
+        response = SimpleNamespace(usage=SimpleNamespace(
+            prompt_tokens=1500, completion_tokens=200,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=1024)
+        ))
+        self.assertEqual(ai_service._usage(response), {'prompt_tokens': 1500, 'cached_tokens': 1024, 'completion_tokens': 200})
+
+class UsageLedgerTests(TestCase):
+    def setUp(self):
+        from core.models import User
+        self.user = User.objects.create_user(username='ledger', email='ledger@example.com', password='pw')
+
+    def test_record_usage_rolls_up_per_day(self):
+        from core.models import UsageRecord, UsageRollup
+        from core.services.usage import record_usage, tokens_used_today
+        record_usage(self.user.id, 'generate', 'gpt-3.5-turbo', prompt_tokens=1000, completion_tokens=200, cached_tokens=400, latency_ms=800)
+        record_usage(self.user.id, 'generate', 'gpt-3.5-turbo', latency_ms=5, cache_hit=True)
+        self.assertEqual(UsageRecord.objects.filter(user=self.user).count(), 2)
+        rollup = UsageRollup.objects.get(user=self.user, stage='generate')
+        self.assertEqual((rollup.calls, rollup.cache_hits, rollup.prompt_tokens, rollup.cached_tokens), (2, 1, 1000, 400))
+        self.assertAlmostEqual(rollup.cost_usd, (1000 * 0.5 + 200 * 1.5) / 1_000_000)
+        self.assertEqual(tokens_used_today(self.user.id), 1200)
+
+    def test_anonymous_usage_rolls_up_into_one_row(self):
+        from django.db import IntegrityError, transaction
+        from django.utils import timezone
+        from core.models import UsageRollup
+        from core.services.usage import record_usage
+        record_usage(None, 'embed', 'text-embedding-3-small', prompt_tokens=10)
+        record_usage(None, 'embed', 'text-embedding-3-small', prompt_tokens=15)
+        rollup = UsageRollup.objects.get(user=None)
+        self.assertEqual((rollup.calls, rollup.prompt_tokens), (2, 25))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UsageRollup.objects.create(user=None, date=timezone.localdate(), stage='embed', model='text-embedding-3-small')
+
+    def test_budgets_route_to_cheaper_paths(self):
+        from core.services import ai_service as ai_module
+        from core.services import usage
+        from core.services.usage import record_usage
+        record_usage(self.user.id, 'generate', 'gpt-3.5-turbo', prompt_tokens=900, completion_tokens=100)
+        with patch.object(usage, 'USAGE_SOFT_BUDGET_TOKENS', 500), patch.object(usage, 'USAGE_HARD_BUDGET_TOKENS', 5000):
+            self.assertEqual(usage.budget_status(self.user.id), usage.BudgetStatus.SOFT)
+            with patch.object(agent, 'classify_intent', return_value='global') as classify, \
+                 patch.object(agent, 'retrieve_context', return_value={}), \
+                 patch.object(ai_module.ai_service, '_build_messages', return_value=[]), \
+                 patch.object(ai_module.ai_service, '_measure', return_value=(0, [], [])), \
+                 patch.object(ai_module.answer_cache, 'enabled_for', return_value=False), \
+                 patch('core.services.ai_service.openai.chat.completions.create', side_effect=RuntimeError('offline')) as create:
+                ai_module.ai_service.generate_reply('What are the latest industry trends?', [], user_id=self.user.id)
+            self.assertFalse(classify.call_args.kwargs['use_llm'])
+            self.assertEqual(create.call_args.kwargs['max_tokens'], ai_module.SOFT_BUDGET_MAX_TOKENS)
+        with patch.object(usage, 'USAGE_HARD_BUDGET_TOKENS', 1000), \
+             patch.object(ai_module.answer_cache, 'enabled_for', return_value=False), \
+             patch('core.services.ai_service.openai.chat.completions.create') as create:
+            reply = ai_module.ai_service.generate_reply('What are the latest industry trends?', [], user_id=self.user.id)
+        create.assert_not_called()
+        self.assertIn('usage limit', reply['text'])
+
+    def test_answers_over_the_soft_budget_are_not_cached(self):
+        from types import SimpleNamespace
+        from core.services import ai_service as ai_module
+        from core.services import usage
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='Short answer.'))],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=20, prompt_tokens_details=None)
+        )
+        for status, cached in ((usage.BudgetStatus.SOFT, False), (usage.BudgetStatus.OK, True)):
+            with patch.object(ai_module, 'budget_status', return_value=status), \
+                 patch.object(agent, 'embed_query', return_value=[1.0, 0.0]), \
+                 patch.object(agent, 'classify_intent', return_value='global'), \
+                 patch.object(agent, 'retrieve_context', return_value={}), \
+                 patch.object(ai_module.ai_service, '_build_messages', return_value=[]), \
+                 patch.object(ai_module.ai_service, '_measure', return_value=(0, [], [])), \
+                 patch.object(ai_module.answer_cache, 'enabled_for', return_value=True), \
+                 patch.object(ai_module.answer_cache, 'lookup', return_value=None), \
+                 patch.object(ai_module.answer_cache, 'store') as store, \
+                 patch('core.services.ai_service.openai.chat.completions.create', return_value=response):
+                reply = ai_module.ai_service.generate_reply('What are the latest industry trends?', [], user_id=self.user.id)
+            self.assertEqual(reply['text'], 'Short answer.')
+            self.assertEqual(store.called, cached, status)
+
+class TracingTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from core.services import tracing
+        self.tracing = tracing
+        self.tmp = tempfile.TemporaryDirectory()
+        self.exporter = tracing.SpanExporter(exporter='file', path=f"{self.tmp.name}/traces.jsonl")
+        self.patches = [patch.object(tracing, 'TRACING_ENABLED', True), patch.object(tracing, 'exporter', self.exporter)]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.tmp.cleanup()
+
+    def exported_spans(self):
+        import json
+        self.exporter.flush()
+        with open(self.exporter.path) as f:
+            return [s for line in f for s in json.loads(line)['resourceSpans'][0]['scopeSpans'][0]['spans']]
+
+    def test_spans_nest_and_continue_remote_trace(self):
+        parent = '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01'
+        with self.tracing.span('root', traceparent=parent) as root:
+            with self.tracing.span('child', collection='global_kb'):
+                pass
+        spans = {s['name']: s for s in self.exported_spans()}
+        self.assertEqual(root.trace_id, '4bf92f3577b34da6a3ce929d0e0e4736')
+        self.assertEqual(spans['root']['parentSpanId'], '00f067aa0ba902b7')
+        self.assertEqual(spans['child']['parentSpanId'], spans['root']['spanId'])
+        self.assertEqual(spans['child']['attributes'], [{'key': 'collection', 'value': {'stringValue': 'global_kb'}}])
+
+    def test_middleware_propagates_traceparent_and_samples(self):
+        parent = '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00'
+        with patch.object(self.tracing, 'TRACE_SAMPLE_RATE', 0.0), patch('core.middleware.TRACING_ENABLED', True):
+            response = self.client.get('/api/usage/', HTTP_TRACEPARENT=parent)
+            unsampled = self.client.get('/api/usage/')
+            with patch.object(self.tracing, 'TRACE_SAMPLE_RATE', 1.0):
+                sampled = self.client.get('/api/usage/')
+        self.assertTrue(response['traceparent'].startswith('00-4bf92f3577b34da6a3ce929d0e0e4736-'))
+        self.assertTrue(response['traceparent'].endswith('-00'))
+        self.assertTrue(unsampled['traceparent'].endswith('-00'))
+        spans = self.exported_spans()
+        self.assertEqual([s['name'] for s in spans], ['HTTP GET api/usage/'])
+        self.assertEqual(spans[0]['traceId'], sampled['traceparent'].split('-')[1])
+
+class MetricsTests(TestCase):
+    def sample(self, name, labels):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    def test_endpoint_exposes_route_latency(self):
+        labels = {'method': 'GET', 'route': 'api/usage/', 'status': '401'}
+        before = self.sample('http_request_duration_seconds_count', labels)
+        self.client.get('/api/usage/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds_bucket', response.content)
+        self.assertEqual(self.sample('http_request_duration_seconds_count', labels), before + 1)
+
+    def test_upstream_and_in_flight_instrumentation(self):
+        from core.services import metrics
+        labels = {'service': 'openai', 'operation': 'embeddings', 'outcome': 'error'}
+        before = self.sample('upstream_request_duration_seconds_count', labels)
+        with patch('core.services.ingestion.openai.embeddings.create', side_effect=RuntimeError('offline')):
+            from core.services.ingestion import embed_text
+            with self.assertRaises(RuntimeError):
+                embed_text(['a', 'b', 'c'], stage='search')
+        self.assertEqual(self.sample('upstream_request_duration_seconds_count', labels), before + 1)
+        with metrics.track_in_flight():
+            self.assertEqual(self.sample('chat_generations_in_flight', {}), 1.0)
+        self.assertEqual(self.sample('chat_generations_in_flight', {}), 0.0)
+
+    def test_management_commands_start_without_the_multiprocess_dir(self):
+        import os
+        import sys
+        import subprocess
+        import tempfile
+        from django.conf import settings
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': os.path.join(tmp.name, 'missing')}
+        result = subprocess.run([sys.executable, 'manage.py', 'check'], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+class StructuredLoggingTests(TestCase):
+    def test_json_formatter_truncates_payloads_and_keeps_extras(self):
+        import json
+        import logging
+        from core.logging_config import JSONFormatter, LOG_MAX_FIELD_CHARS
+        record = logging.LogRecord('ai_manager', logging.DEBUG, __file__, 1, "Context retrieved: %s", ({'global': ['x' * 5000]},), None)
+        record.user_id = 7
+        entry = json.loads(JSONFormatter().format(record))
+        self.assertEqual(entry['level'], 'DEBUG')
+        self.assertEqual(entry['user_id'], 7)
+        self.assertLess(len(entry['message']), LOG_MAX_FIELD_CHARS + 100)
+        self.assertIn('more chars]', entry['message'])
+
+    def test_queue_handler_writes_off_thread_and_samples_debug(self):
+        import json
+        import logging
+        import tempfile
+        from core import logging_config
+        with tempfile.TemporaryDirectory() as tmp:
+            handler = logging_config.AsyncQueueHandler(log_file=f"{tmp}/app.log", console=False)
+            handler.setFormatter(logging_config.JSONFormatter())
+            handler.addFilter(logging_config.SamplingFilter())
+            logger = logging.getLogger('tests.structured_logging')
+            logger.handlers, logger.propagate = [handler], False
+            logger.setLevel(logging.DEBUG)
+            with patch.object(logging_config, 'LOG_DEBUG_SAMPLE_RATE', 0.0):
+                logger.debug("dropped by sampling")
+                logger.info("kept %s", 'record')
+            handler.close()
+            with open(f"{tmp}/app.log") as f:
+                entries = [json.loads(line) for line in f]
+        self.assertEqual([e['message'] for e in entries], ['kept record'])
+
+    def test_mutable_arguments_are_merged_before_queueing(self):
+        import logging
+        from core.logging_config import AsyncQueueHandler
+        handler = AsyncQueueHandler()
+        self.addCleanup(handler.close)
+        self.assertEqual(handler.targets, [])  # no console output unless configured
+        context = {'global': ['Pitch early.']}
+        record = logging.LogRecord('ai_manager', logging.DEBUG, __file__, 1, "Context retrieved: %s", (context,), None)
+        handler.prepare(record)
+        context['global'].append('Added later.')
+        self.assertEqual((record.getMessage(), record.args), ("Context retrieved: {'global': ['Pitch early.']}", None))
+        record = logging.LogRecord('ai_manager', logging.INFO, __file__, 1, "Generating response for user_id=%s", (7,), None)
+        handler.prepare(record)
+        self.assertEqual(record.args, (7,))  # immutable arguments are still merged on the listener thread
+
+class ModelRoutingTests(TestCase):
+    def test_router_sends_complex_turns_to_strong_model_unless_loaded(self):
+        from core.services import model_registry
+        router = model_registry.ModelRouter()
+        with patch.dict(model_registry.STAGE_MODELS, {'chat_fast': 'gpt-3.5-turbo', 'chat_strong': 'gpt-4o'}):
+            self.assertEqual(router.route("Thanks!").name, 'fast')
+            complex_turn = "Can you plan a release strategy and a budget for my next EP? What timeline should I follow?"
+            route = router.route(complex_turn)
+            self.assertEqual((route.name, route.model), ('strong', 'gpt-4o'))
+            self.assertEqual(router.route(complex_turn, budget='soft').reason, 'budget')
+            with patch.object(model_registry, 'ROUTER_MAX_STRONG_IN_FLIGHT', 1), router.generating(route):
+                self.assertEqual(router.route(complex_turn).reason, 'load')
+            self.assertEqual(router.route("hi", prompt_tokens=20000).name, 'strong')
+
+    def test_costs_come_from_registry_and_usage_keeps_route(self):
+        from core.models import UsageRollup
+        from core.services.usage import estimate_cost, record_usage
+        self.assertAlmostEqual(estimate_cost('gpt-4o', 1000, 100, cached_tokens=500), (500 * 2.5 + 500 * 1.25 + 100 * 10) / 1_000_000)
+        self.assertEqual(estimate_cost('not-a-model', 1000, 100), 0.0)
+        record_usage(None, 'generate', 'gpt-4o', prompt_tokens=10, route='strong')
+        record_usage(None, 'generate', 'gpt-3.5-turbo', prompt_tokens=10, route='fast')
+        self.assertEqual(sorted(UsageRollup.objects.values_list('route', flat=True)), ['fast', 'strong'])
+
+class ResilienceTests(TestCase):
+    def setUp(self):
+        from core.services import resilience
+        self.resilience = resilience
+        self.breaker = resilience.CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+        self.patches = [
+            patch.dict(resilience.breakers, {'qdrant': self.breaker}),
+            patch.dict(resilience.retry_budgets, {'qdrant': resilience.RetryBudget(ratio=0.0, min_per_second=0.0, cap=1.0)}),
+            patch.object(resilience, 'UPSTREAM_RETRY_BASE_DELAY', 0.0),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_retries_are_budgeted_and_breaker_opens(self):
+        import requests
+        from unittest.mock import Mock
+        flaky = Mock(side_effect=[requests.ConnectionError('down'), 'ok'])
+        self.assertEqual(self.resilience.call_with_resilience('qdrant', flaky), 'ok')
+        self.assertEqual(flaky.call_count, 2)
+        # The budget's single token is spent: the next transient failure is not retried
+        down = Mock(side_effect=requests.Timeout('slow'))
+        for _ in range(2):
+            with self.assertRaises(requests.Timeout):
+                self.resilience.call_with_resilience('qdrant', down)
+        self.assertEqual(down.call_count, 2)
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(self.resilience.CircuitOpenError):
+            self.resilience.call_with_resilience('qdrant', down)
+        self.assertEqual(down.call_count, 2)
+        # Client errors do not count as dependency failures
+        self.breaker.record_success()
+        with self.assertRaises(ValueError):
+            self.resilience.call_with_resilience('qdrant', Mock(side_effect=ValueError('bad request')))
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_half_open_probe_failing_without_a_response_keeps_the_breaker_half_open(self):
+        import requests
+        from unittest.mock import Mock
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.opened_at -= 61
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            self.resilience.call_with_resilience('qdrant', Mock(side_effect=requests.exceptions.ChunkedEncodingError('dropped')))
+        self.assertEqual((self.breaker.state, self.breaker.failures), ('half_open', 2))
+        # The probe slot is free again, and a 4xx proves the dependency is answering
+        response = Mock(status_code=404)
+        with self.assertRaises(requests.HTTPError):
+            self.resilience.call_with_resilience('qdrant', Mock(side_effect=requests.HTTPError(response=response)))
+        self.assertEqual((self.breaker.state, self.breaker.failures), ('closed', 0))
+
+    def test_open_qdrant_breaker_degrades_to_answer_without_retrieval(self):
+        from core.services import qdrant_client
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        with patch('core.services.qdrant_client.requests.post') as mock_post:
+            with self.assertRaises(self.resilience.CircuitOpenError):
+                qdrant_client.search_vectors([0.1] * 4, collection='global_kb', top=3)
+            with patch('core.services.agent.search_vectors', side_effect=qdrant_client.search_vectors):
+                context = agent.retrieve_context("How do I book a tour?", intent='global', query_embedding=[0.1] * 4)
+        mock_post.assert_not_called()
+        self.assertEqual(context, {})
+        self.assertIn("No specific context available", agent.build_prompt(context, "How do I book a tour?"))
+        response = self.client.get('/api/health/')
+        self.assertEqual(response.json()['status'], 'degraded')
+        self.assertEqual(response.json()['breakers']['qdrant']['state'], 'open')
+
+class AdmissionControlTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from core.services.admission import AdmissionController
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.controller = AdmissionController(
+            path=f"{self.tmp.name}/admission.sqlite3", user_concurrency=1, rate_per_minute=60, burst=2, max_in_flight=2
+        )
+
+    def test_concurrency_rate_and_load_shedding(self):
+        from core.services.admission import AdmissionRejected
+        lease = self.controller.acquire(1)
+        with self.assertRaises(AdmissionRejected) as ctx:
+            self.controller.acquire(1)
+        self.assertEqual(ctx.exception.reason, 'concurrency')
+        # A second user fills the server; a third is shed
+        other = self.controller.acquire(2)
+        with self.assertRaises(AdmissionRejected) as ctx:
+            self.controller.acquire(3)
+        self.assertEqual(ctx.exception.reason, 'overloaded')
+        self.controller.release(other)
+        self.controller.release(lease)
+        # Burst of two spent: the third request in a row is rate limited with a refill hint
+        self.controller.release(self.controller.acquire(1))
+        with self.assertRaises(AdmissionRejected) as ctx:
+            self.controller.acquire(1)
+        self.assertEqual(ctx.exception.reason, 'rate')
+        self.assertAlmostEqual(ctx.exception.retry_after, 1.0, delta=0.1)
+
+    def test_release_failure_leaves_the_lease_to_expire(self):
+        import sqlite3
+        from unittest.mock import MagicMock
+        from core.services.admission import AdmissionRejected
+        locked = MagicMock(**{'execute.side_effect': sqlite3.OperationalError('database is locked')})
+        with self.controller.admitted(1) as lease:
+            self.assertIsNotNone(lease)
+            store = patch.object(self.controller, '_connection', return_value=locked)
+            store.start()
+        store.stop()  # the block exited without raising
+        with self.assertRaises(AdmissionRejected) as ctx:
+            self.controller.acquire(1)
+        self.assertEqual(ctx.exception.reason, 'concurrency')  # held until ADMISSION_LEASE_TTL
+
+    def test_rejected_chat_returns_429_without_saving(self):
+        from core.models import User, Conversation, Message
+        user = User.objects.create_user(username='busy', email='busy@example.com', password='pw')
+        conversation = Conversation.objects.create(user=user, title='Busy')
+        from rest_framework.test import APIClient
+        client = APIClient()
+        client.force_authenticate(user)
+        with patch('core.views.admission', self.controller), \
+             patch('core.views.ai_service.generate_reply') as generate:
+            with self.controller.admitted(user.id):
+                response = client.post('/api/chat/messages/', {'conversation': conversation.id, 'text': 'Hi'}, format='json')
+        generate.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response.json()['reason'], 'concurrency')
+        self.assertFalse(Message.objects.filter(conversation=conversation).exists())
+
+class IncrementalMessageFetchTests(TestCase):
+    def setUp(self):
+        # Admission limits are covered by AdmissionControlTests; keep them out of these turns
+        self.enterContext(patch('core.services.admission.ADMISSION_ENABLED', False))
+        from rest_framework.test import APIClient
+        from core.models import User, Conversation
+        self.user = User.objects.create_user(username='delta', email='delta@example.com', password='pw')
+        self.conversation = Conversation.objects.create(user=self.user, title='Delta')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_create_returns_user_and_ai_message(self):
+        reply = {'text': 'Book the venue first.', 'usage': {'prompt_tokens': 120, 'cached_tokens': 0, 'completion_tokens': 8}}
+        with patch('core.views.ai_service.generate_reply', return_value=reply):
+            response = self.client.post('/api/chat/messages/', {'conversation': self.conversation.id, 'text': 'Where do I start?', 'sender': 'user'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body['sender'], body['text']), ('user', 'Where do I start?'))
+        self.assertEqual((body['ai_message']['sender'], body['ai_message']['text']), ('ai', 'Book the venue first.'))
+        self.assertGreater(body['ai_message']['id'], body['id'])
+
+    def test_after_cursor_returns_only_newer_messages(self):
+        from core.models import User, Conversation, Message
+        ids = [Message.objects.create(conversation=self.conversation, sender='user' if i % 2 == 0 else 'ai', text=f"m{i}").id for i in range(5)]
+        response = self.client.get(f'/api/chat/conversations/{self.conversation.id}/messages/', {'after': ids[2]})
+        self.assertEqual([m['text'] for m in response.json()], ['m3', 'm4'])
+        response = self.client.get(f'/api/chat/conversations/{self.conversation.id}/messages/', {'limit': 2})
+        self.assertEqual([m['id'] for m in response.json()], ids[:2])
+        self.assertEqual(self.client.get(f'/api/chat/conversations/{self.conversation.id}/messages/', {'after': 'x'}).status_code, 400)
+        # Paging back from the end: the latest window, then the one before it, both in id order
+        url = f'/api/chat/conversations/{self.conversation.id}/messages/'
+        self.assertEqual([m['id'] for m in self.client.get(url, {'tail': 1, 'limit': 2}).json()], ids[3:])
+        self.assertEqual([m['id'] for m in self.client.get(url, {'before': ids[3], 'limit': 2}).json()], ids[1:3])
+        self.assertEqual([m['id'] for m in self.client.get(url, {'before': ids[1], 'limit': 2}).json()], ids[:1])
+        self.assertEqual(self.client.get(url, {'before': 'x'}).status_code, 400)
+        # Other users' conversations are not visible
+        other = User.objects.create_user(username='other', email='other@example.com', password='pw')
+        foreign = Conversation.objects.create(user=other, title='Theirs')
+        self.assertEqual(self.client.get(f'/api/chat/conversations/{foreign.id}/messages/').status_code, 404)
+
+class ConversationListTests(TestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from core.models import User
+        self.user = User.objects.create_user(username='lister', email='lister@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def seed(self, conversations, messages_each):
+        from core.models import Conversation, Message
+        for i in range(conversations):
+            conversation = Conversation.objects.create(user=self.user, title=f"Chat {i}")
+            Message.objects.bulk_create([
+                Message(conversation=conversation, sender='user', text=f"m{j}") for j in range(messages_each)
+            ])
+
+    def test_summaries_are_annotated_and_cursor_paginated(self):
+        self.seed(3, 4)
+        response = self.client.get('/api/chat/conversations/', {'page_size': 2})
+        body = response.json()
+        self.assertEqual([c['title'] for c in body['results']], ['Chat 2', 'Chat 1'])
+        self.assertEqual(body['results'][0]['message_count'], 4)
+        self.assertIsNotNone(body['results'][0]['last_message_at'])
+        self.assertNotIn('messages', body['results'][0])
+        rest = self.client.get(body['next']).json()
+        self.assertEqual([c['title'] for c in rest['results']], ['Chat 0'])
+        self.assertIsNone(rest['next'])
+
+    def test_query_count_is_constant(self):
+        self.seed(2, 2)
+        with self.assertNumQueries(1):
+            self.client.get('/api/chat/conversations/')
+        self.seed(30, 20)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/chat/conversations/')
+        self.assertEqual(len(response.json()['results']), 20)
+
+class DashboardStatsTests(TestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from core.models import User
+        self.user = User.objects.create_user(username='dash', email='dash@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_counters_follow_writes(self):
+        import tempfile
+        from django.test import override_settings
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        from core.models import Conversation, Message, PersonalKnowledgeDocument, UserActivityStats
+        chunks = [{'chunk': f"c{i}", 'metadata': {'embeddings': [[0.1] * 4]}} for i in range(3)]
+        from core.services.ingest_queue import ingest, ingestion_queue
+        with patch('core.services.ingest_queue.ingest_document', return_value=chunks), patch('core.services.ingest_queue.upsert_vectors'), \
+                patch.object(ingestion_queue, 'enqueue', side_effect=ingest), self.captureOnCommitCallbacks(execute=True):
+            doc = PersonalKnowledgeDocument.objects.create(
+                owner=self.user, title='Rider', file=SimpleUploadedFile('rider.txt', b'rider'), file_type='txt'
+            )
+        conversation = Conversation.objects.create(user=self.user, title='Tour')
+        Conversation.objects.create(user=self.user, title='Merch')
+        for text in ('hi', 'hello'):
+            Message.objects.create(conversation=conversation, sender='user', text=text)
+        stats = UserActivityStats.objects.get(user=self.user)
+        self.assertEqual((stats.documents, stats.chunks, stats.conversations, stats.messages, stats.active_days), (1, 3, 2, 2, 1))
+        doc.refresh_from_db()  # num_chunks was recorded by the ingestion job
+        with patch('core.services.vector_store.delete_vectors_by_doc_id'), patch('core.services.memory.delete_vectors_by_doc_id'):
+            conversation.delete()
+            doc.delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.documents, stats.chunks, stats.conversations, stats.messages, stats.active_days), (0, 0, 1, 0, 1))
+
+    def test_dashboard_is_one_round_trip_with_constant_queries(self):
+        from core.models import Conversation, Message
+        for i in range(5):
+            conversation = Conversation.objects.create(user=self.user, title=f"Chat {i}")
+            Message.objects.create(conversation=conversation, sender='user', text='hi')
+        with self.assertNumQueries(3):
+            body = self.client.get('/api/dashboard/').json()
+        self.assertEqual((body['conversations'], body['messages'], body['active_days']), (5, 5, 1))
+        self.assertEqual([c['title'] for c in body['recent_conversations']], ['Chat 4', 'Chat 3', 'Chat 2'])
+        self.assertEqual(body['recent_documents'], [])
+
+class HotPathQueryTests(TestCase):
+    """
+    Query counts and plans of the chat and knowledge base hot paths on seeded data. The
+    default seed is small; QUERY_PLAN_SEED_CONVERSATIONS=10000 QUERY_PLAN_SEED_MESSAGES=1000000
+    reproduces production scale.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        import os
+        from django.db import connection
+        from core.models import User, Conversation, Message, PersonalKnowledgeDocument
+        conversations = int(os.getenv('QUERY_PLAN_SEED_CONVERSATIONS', '200'))
+        messages = int(os.getenv('QUERY_PLAN_SEED_MESSAGES', '2000'))
+        cls.user = User.objects.create_user(username='seeded', email='seeded@example.com', password='pw')
+        others = [User.objects.create_user(username=f"u{i}", email=f"u{i}@example.com", password='pw') for i in range(4)]
+        owners = [cls.user] + others
+        # bulk_create skips the counter signals, which these tests do not measure
+        Conversation.objects.bulk_create([
+            Conversation(user=owners[i % len(owners)], title=f"Chat {i}") for i in range(conversations)
+        ], batch_size=5000)
+        conversation_ids = list(Conversation.objects.values_list('id', flat=True))
+        for start in range(0, messages, 50000):
+            Message.objects.bulk_create([
+                Message(conversation_id=conversation_ids[i % len(conversation_ids)], sender='user' if i % 2 else 'ai', text=f"m{i}")
+                for i in range(start, min(start + 50000, messages))
+            ], batch_size=5000)
+        PersonalKnowledgeDocument.objects.bulk_create([
+            PersonalKnowledgeDocument(owner=owners[i % len(owners)], title=f"Doc {i}", file=f"personal_kb/doc{i}.txt", file_type='txt')
+            for i in range(50)
+        ])
+        cls.conversation = Conversation.objects.filter(user=cls.user).first()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.enterContext(patch('core.services.admission.ADMISSION_ENABLED', False))
+
+    def assertUsesIndex(self, queryset, index_name):
+        from django.db import connection
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_hot_queries_use_composite_indexes(self):
+        from core.models import Conversation, Message, PersonalKnowledgeDocument
+        self.assertUsesIndex(
+            Message.objects.filter(conversation=self.conversation).exclude(id=0).order_by('-timestamp')[:10],
+            'message_conversation_ts'
+        )
+        self.assertUsesIndex(
+            Conversation.objects.filter(user=self.user).order_by('-started_at', '-id')[:20], 'conversation_user_started'
+        )
+        self.assertUsesIndex(
+            PersonalKnowledgeDocument.objects.filter(owner=self.user).order_by('-uploaded_at'), 'personal_doc_owner_uploaded'
+        )
+
+    def test_view_query_counts_do_not_grow_with_data(self):
+        from rest_framework.test import APIClient
+        from core.models import Message
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.assertNumQueries(1):
+            client.get('/api/chat/conversations/')
+        with self.assertNumQueries(2):
+            client.get(f'/api/chat/conversations/{self.conversation.id}/messages/')
+        with self.assertNumQueries(2):
+            client.get(f'/api/chat/conversations/{self.conversation.id}/')
+        with self.assertNumQueries(1):
+            client.get('/api/personal-kb/')
+        with self.assertNumQueries(3):
+            client.get('/api/dashboard/')
+        # A chat turn costs the same number of queries however long the conversation is
+        reply = {'text': 'ok', 'usage': {'prompt_tokens': 1, 'cached_tokens': 0, 'completion_tokens': 1}}
+        from django.test.utils import CaptureQueriesContext
+        from django.db import connection
+        counts = []
+        with patch('core.views.ai_service.generate_reply', return_value=reply):
+            # The first turn of the day also creates the counter row; measure steady-state turns
+            client.post('/api/chat/messages/', {'conversation': self.conversation.id, 'text': 'hi', 'sender': 'user'}, format='json')
+            for _ in range(2):
+                with CaptureQueriesContext(connection) as queries:
+                    client.post('/api/chat/messages/', {'conversation': self.conversation.id, 'text': 'hi', 'sender': 'user'}, format='json')
+                counts.append(len(queries))
+                Message.objects.bulk_create([Message(conversation=self.conversation, sender='user', text='x') for _ in range(100)])
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[0], 11)
+
+class CompactMessageContextTests(TestCase):
+    def setUp(self):
+        # Admission limits are covered by AdmissionControlTests; keep them out of these turns
+        self.enterContext(patch('core.services.admission.ADMISSION_ENABLED', False))
+        from rest_framework.test import APIClient
+        from core.models import User, Conversation
+        self.user = User.objects.create_user(username='compact', email='compact@example.com', password='pw')
+        self.conversation = Conversation.objects.create(user=self.user, title='Compact')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_turn_stores_references_and_serializers_omit_context(self):
+        from core.models import Message
+        earlier = Message.objects.create(conversation=self.conversation, sender='user', text='Earlier question ' * 50)
+        context = {'intent': 'global', 'model': 'gpt-3.5-turbo', 'route': 'fast',
+                   'sources': [{'kb': 'global', 'id': 'p1', 'doc_id': 3, 'score': 0.82}], 'timings_ms': {'total': 900.0}}
+        reply = {'text': 'Answer', 'usage': {}, 'context': context}
+        with patch('core.views.ai_service.generate_reply', return_value=reply):
+            response = self.client.post('/api/chat/messages/', {'conversation': self.conversation.id, 'text': 'Next?', 'sender': 'user'}, format='json')
+        self.assertNotIn('context', response.json()['ai_message'])
+        stored = Message.objects.get(id=response.json()['ai_message']['id']).context
+        self.assertEqual(stored['history_ids'], [earlier.id])
+        self.assertEqual(stored['sources'][0]['doc_id'], 3)
+        self.assertNotIn('history', stored)
+        url = f'/api/chat/conversations/{self.conversation.id}/messages/'
+        self.assertNotIn('context', self.client.get(url).json()[-1])
+        self.assertEqual(self.client.get(url, {'include': 'context'}).json()[-1]['context']['intent'], 'global')
+        self.assertNotIn('context', self.client.get(f'/api/chat/conversations/{self.conversation.id}/').json()['messages'][-1])
+
+    def test_migration_compacts_copied_history(self):
+        import importlib
+        from django.apps import apps
+        from core.models import Message
+        migration = importlib.import_module('core.migrations.0011_compact_message_context')
+        # As the baseline view did: save the user turn, then copy the last 10 texts including it
+        texts = []
+        for i in range(13):
+            sender = 'user' if i % 2 == 0 else 'ai'
+            message = Message.objects.create(
+                conversation=self.conversation, sender=sender, text=f"m{i}",
+                context={'history': texts[-10:], 'note': 'kept'} if sender == 'ai' else {}
+            )
+            texts.append(message.text)
+        ids = list(Message.objects.filter(conversation=self.conversation).order_by('id').values_list('id', flat=True))
+        # An edited message no longer lines up: the other copied texts are matched one by one
+        Message.objects.filter(id=ids[9]).update(text='edited')
+        Message.objects.filter(id=ids[7]).update(context={'history': ['m0', 'm2', 'm6']})
+        migration.compact_message_context(apps, None)
+        last_ai = Message.objects.get(id=ids[11])
+        self.assertEqual(last_ai.context, {'note': 'kept', 'history_ids': ids[1:9] + [ids[10]]})
+        self.assertEqual(Message.objects.get(id=ids[5]).context['history_ids'], ids[0:5])
+        self.assertEqual(Message.objects.get(id=ids[1]).context['history_ids'], [ids[0]])
+        self.assertEqual(Message.objects.get(id=ids[7]).context['history_ids'], [ids[0], ids[2], ids[6]])
+        self.assertFalse(Message.objects.filter(context__has_key='history').exists())
+
+class ConversationArchiveTests(TestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from core.models import User, Conversation, Message
+        self.enterContext(patch('core.services.admission.ADMISSION_ENABLED', False))
+        self.user = User.objects.create_user(username='archivist', email='archivist@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.idle = Conversation.objects.create(user=self.user, title='Old tour')
+        self.active = Conversation.objects.create(user=self.user, title='This week')
+        for conversation in (self.idle, self.active):
+            for i in range(6):
+                Message.objects.create(conversation=conversation, sender='user' if i % 2 == 0 else 'ai',
+                                       text=f"Setlist question {i} " * 20, context={'intent': 'global'} if i % 2 else {})
+        from datetime import timedelta
+        from django.utils import timezone
+        Message.objects.filter(conversation=self.idle).update(timestamp=timezone.now() - timedelta(days=120))
+
+    def test_idle_conversations_are_compressed_out_of_the_hot_table(self):
+        from django.core.management import call_command
+        from core.models import ConversationArchive, Message
+        before = list(Message.objects.filter(conversation=self.idle).order_by('id').values('id', 'text', 'timestamp', 'context'))
+        import io
+        call_command('archive_conversations', '--idle-days', '90', stdout=io.StringIO())
+        self.assertFalse(Message.objects.filter(conversation=self.idle).exists())
+        self.assertEqual(Message.objects.filter(conversation=self.active).count(), 6)
+        archive = ConversationArchive.objects.get(conversation=self.idle)
+        self.assertEqual(archive.message_count, 6)
+        self.assertLess(len(archive.payload), archive.raw_bytes / 3)
+        # The list still reports archived messages
+        summary = {c['id']: c for c in self.client.get('/api/chat/conversations/').json()['results']}
+        self.assertEqual(summary[self.idle.id]['message_count'], 6)
+        self.assertIsNotNone(summary[self.idle.id]['archived_at'])
+        # Reading the conversation restores it with the original ids, timestamps and context
+        response = self.client.get(f'/api/chat/conversations/{self.idle.id}/')
+        self.assertEqual([m['id'] for m in response.json()['messages']], [m['id'] for m in before])
+        after = list(Message.objects.filter(conversation=self.idle).order_by('id').values('id', 'text', 'timestamp', 'context'))
+        self.assertEqual(after, before)
+        self.assertFalse(ConversationArchive.objects.filter(conversation=self.idle).exists())
+
+    def test_new_message_in_archived_conversation_rehydrates_first(self):
+        from core.models import Message
+        from core.services.archive import archive_conversation
+        archive_conversation(self.idle)
+        self.idle.refresh_from_db()
+        reply = {'text': 'Welcome back', 'usage': {}}
+        with patch('core.views.ai_service.generate_reply', return_value=reply) as generate:
+            self.client.post('/api/chat/messages/', {'conversation': self.idle.id, 'text': 'Picking this up again', 'sender': 'user'}, format='json')
+        self.assertEqual(len(generate.call_args.kwargs['conversation_history']), 6)
+        self.assertEqual(Message.objects.filter(conversation=self.idle).count(), 8)
+        self.idle.refresh_from_db()
+        self.assertIsNone(self.idle.archived_at)
+
+class ChatSearchTests(TestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from core.models import User, Conversation, Message
+        self.user = User.objects.create_user(username='searcher', email='searcher@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tour = Conversation.objects.create(user=self.user, title='Tour')
+        self.m1 = Message.objects.create(conversation=self.tour, sender='user', text='How do I negotiate a venue guarantee?')
+        self.m2 = Message.objects.create(conversation=self.tour, sender='ai', text='Negotiating guarantees: ask for a guarantee versus door split; guarantee guarantees.')
+        Message.objects.create(conversation=self.tour, sender='user', text='What merch sizes sell best?')
+        other = User.objects.create_user(username='nosy', email='nosy@example.com', password='pw')
+        Message.objects.create(conversation=Conversation.objects.create(user=other, title='Theirs'), sender='user', text='venue guarantee for my band')
+
+    def test_search_is_ranked_scoped_and_maintained_on_write(self):
+        body = self.client.get('/api/chat/search/', {'q': 'guarantee'}).json()
+        self.assertEqual([r['message_id'] for r in body['results']], [self.m2.id, self.m1.id])
+        self.assertIn('[', body['results'][0]['snippet'])
+        self.assertEqual(body['results'][0]['conversation_title'], 'Tour')
+        # Porter stemming: 'negotiating' finds 'negotiate'; every word must match
+        self.assertEqual(len(self.client.get('/api/chat/search/', {'q': 'negotiating venues'}).json()['results']), 1)
+        # Updates and deletes reach the index
+        self.m1.text = 'How do I price a headline slot?'
+        self.m1.save()
+        self.m2.delete()
+        self.assertEqual(self.client.get('/api/chat/search/', {'q': 'guarantee'}).json()['results'], [])
+        self.assertEqual(self.client.get('/api/chat/search/', {'q': 'headline'}).json()['results'][0]['message_id'], self.m1.id)
+
+    def test_other_databases_fall_back_to_a_scan(self):
+        from unittest.mock import MagicMock
+        with patch('core.services.chat_search.connection', MagicMock(vendor='mysql')):
+            response = self.client.get('/api/chat/search/', {'q': 'venue guarantee', 'page_size': 1})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([r['message_id'] for r in body['results']], [self.m1.id])
+        self.assertIn('[guarantee?]', body['results'][0]['snippet'])
+        self.assertIsNone(body['next_page'])
+
+    def test_pagination_and_hostile_queries(self):
+        from core.models import Message
+        Message.objects.bulk_create([Message(conversation=self.tour, sender='user', text=f'setlist idea {i}') for i in range(5)])
+        first = self.client.get('/api/chat/search/', {'q': 'setlist', 'page_size': 3}).json()
+        second = self.client.get('/api/chat/search/', {'q': 'setlist', 'page_size': 3, 'page': first['next_page']}).json()
+        self.assertEqual((len(first['results']), len(second['results']), second['next_page']), (3, 2, None))
+        self.assertFalse({r['message_id'] for r in first['results']} & {r['message_id'] for r in second['results']})
+        for query in ['"unbalanced', 'venue AND OR NOT', 'NEAR(', '***']:
+            self.assertEqual(self.client.get('/api/chat/search/', {'q': query}).status_code, 200)
+        self.assertEqual(self.client.get('/api/chat/search/').status_code, 400)
+
+    def test_archived_conversations_stay_searchable(self):
+        from core.models import Message
+        from core.services.archive import archive_conversation, rehydrate
+        from django.db import connection
+        archive_conversation(self.tour)
+        self.assertFalse(Message.objects.filter(conversation=self.tour).exists())
+        body = self.client.get('/api/chat/search/', {'q': 'guarantee'}).json()
+        self.assertEqual([r['message_id'] for r in body['results']], [self.m2.id, self.m1.id])
+        self.assertEqual((body['results'][1]['sender'], body['results'][1]['conversation_title']), ('user', 'Tour'))
+        self.assertIn('[guarantee?]', body['results'][1]['snippet'])
+        # Rehydrating moves the messages back to the hot index without leaving duplicates
+        self.tour.refresh_from_db()
+        rehydrate(self.tour)
+        self.assertEqual([r['message_id'] for r in self.client.get('/api/chat/search/', {'q': 'guarantee'}).json()['results']], [self.m2.id, self.m1.id])
+        archive_conversation(self.tour)
+        with patch('core.services.memory.delete_vectors_by_doc_id'):
+            self.tour.delete()
+        self.assertEqual(self.client.get('/api/chat/search/', {'q': 'guarantee'}).json()['results'], [])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM core_message_archive_fts WHERE core_message_archive_fts MATCH 'guarantee'")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+class ChatMemoryTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from core.models import User, Conversation, Message
+        from core.services.vector_store import LocalVectorStore
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.enterContext(patch('core.services.vector_store._store', LocalVectorStore(tmp.name)))
+        self.enterContext(patch('core.services.agent.RERANK_ENABLED', False))
+        # Tour talk embeds along one axis, everything else along another
+        self.enterContext(patch('core.services.memory.embed_text', side_effect=lambda texts, **kwargs: [
+            [[1.0, 0.0, 0.0] if 'tour' in t else [0.0, 1.0, 0.0]] for t in texts
+        ]))
+        self.user = User.objects.create_user(username='rememberer', email='rememberer@example.com', password='pw')
+        self.spring = Conversation.objects.create(user=self.user, title='Spring tour')
+        Message.objects.create(conversation=self.spring, sender='user', text='Which cities should the spring tour hit?')
+        self.answer = Message.objects.create(conversation=self.spring, sender='ai', text='Start in Leeds, then Glasgow.', context={'route': 'fast'})
+        Message.objects.create(conversation=self.spring, sender='user', text='One more tour question?')
+        self.capped = Message.objects.create(conversation=self.spring, sender='ai', text='Limit reached.', context={'route': 'budget'})
+        other = User.objects.create_user(username='stranger', email='stranger@example.com', password='pw')
+        theirs = Conversation.objects.create(user=other, title='Their tour')
+        Message.objects.create(conversation=theirs, sender='user', text='Plan my tour')
+        self.their_answer = Message.objects.create(conversation=theirs, sender='ai', text='Go to Cardiff.', context={'route': 'fast'})
+
+    def test_exchanges_are_indexed_and_recalled_per_user(self):
+        from core.services.memory import index_exchanges
+        self.assertEqual(index_exchanges([self.answer.id, self.capped.id, self.their_answer.id]), 2)
+        sources = []
+        context = agent.retrieve_context('Where did we say the tour starts?', user_id=self.user.id, intent='personal',
+                                         query_embedding=[1.0, 0.0, 0.0], sources=sources)
+        self.assertEqual(context['memory'], ['User: Which cities should the spring tour hit?\nAssistant: Start in Leeds, then Glasgow.'])
+        self.assertEqual((sources[0]['kb'], sources[0]['doc_id']), ('memory', f"conversation-{self.spring.id}"))
+        self.assertIn('Earlier Conversations', agent.build_prompt(context, 'Where does the tour start?'))
+        # Turns already sent as history are not recalled again
+        context = agent.retrieve_context('Where did we say the tour starts?', user_id=self.user.id, intent='personal',
+                                         query_embedding=[1.0, 0.0, 0.0], exclude_message_ids=[self.answer.id])
+        self.assertFalse(context.get('memory'))
+
+    def test_global_turns_recall_memory_within_the_shared_budget(self):
+        from core.services.memory import index_exchanges
+        index_exchanges([self.answer.id])
+        context = agent.retrieve_context('Where did we say the tour starts?', user_id=self.user.id, intent='global',
+                                         query_embedding=[1.0, 0.0, 0.0])
+        self.assertEqual(len(context['memory']), 1)
+        # Without MMR the budget still spans every KB: the memory chunk no longer fits
+        def hit(chunk):
+            return {'payload': {'chunk': chunk, 'start_token': 0, 'end_token': 100}, 'score': 0.9}
+        with patch('core.services.agent.MMR_ENABLED', False), patch('core.services.agent.CONTEXT_TOKEN_BUDGET', 300), \
+             patch('core.services.agent.search_vectors', side_effect=lambda *a, collection, **k: {
+                 'result': [hit('g1'), hit('g2'), hit('g3')] if collection == 'global_kb' else
+                           [dict(hit('m1'), payload=dict(hit('m1')['payload'], user_id=self.user.id))]}):
+            context = agent.retrieve_context('Where did we say the tour starts?', user_id=self.user.id, intent='global',
+                                             query_embedding=[1.0, 0.0, 0.0])
+        self.assertEqual(context, {'global': ['g1', 'g2'], 'memory': ['m1']})
+
+    def test_replies_are_queued_after_commit_and_forgotten_with_the_conversation(self):
+        from core.models import Message
+        from core.services.memory import index_exchanges, memory_indexer
+        from core.services.vector_store import search_vectors
+        with patch.object(memory_indexer, 'enqueue') as enqueue, self.captureOnCommitCallbacks(execute=True):
+            reply = Message.objects.create(conversation=self.spring, sender='ai', text='Book Leeds first.')
+            Message.objects.create(conversation=self.spring, sender='user', text='Thanks!')
+        enqueue.assert_called_once_with(reply.id)
+        index_exchanges([self.answer.id, self.their_answer.id])
+        self.spring.delete()
+        self.assertEqual(search_vectors([1.0, 0.0, 0.0], collection='chat_memory', user_id=self.user.id)['result'], [])
+        self.assertEqual(len(search_vectors([1.0, 0.0, 0.0], collection='chat_memory', user_id=self.their_answer.conversation.user_id)['result']), 1)
+
+    def test_prompts_are_fetched_for_the_whole_batch(self):
+        from core.models import Message
+        from core.services.memory import load_exchanges
+        for i in range(5):
+            Message.objects.create(conversation=self.spring, sender='user', text=f'Tour question {i}?')
+            Message.objects.create(conversation=self.spring, sender='ai', text=f'Tour answer {i}.', context={'route': 'fast'})
+        replies = list(Message.objects.filter(sender='ai').values_list('id', flat=True))
+        with self.assertNumQueries(2):
+            exchanges = load_exchanges(replies)
+        self.assertEqual(len(exchanges), 7)
+        self.assertEqual(exchanges[-1]['chunk'], 'User: Tour question 4?\nAssistant: Tour answer 4.')
+        self.assertEqual(exchanges[0]['metadata']['message_ids'], [self.answer.id - 1, self.answer.id])
+
+    def test_archived_conversations_stay_in_memory_and_are_backfilled(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from core.services.archive import archive_conversation
+        from core.services.memory import index_exchanges
+        from core.services.vector_store import search_vectors
+        index_exchanges([self.answer.id])
+        with patch('core.services.memory.delete_vectors_by_doc_id') as forget:
+            archive_conversation(self.spring)
+        forget.assert_not_called()
+        context = agent.retrieve_context('Where did we say the tour starts?', user_id=self.user.id, intent='personal',
+                                         query_embedding=[1.0, 0.0, 0.0])
+        self.assertEqual(context['memory'], ['User: Which cities should the spring tour hit?\nAssistant: Start in Leeds, then Glasgow.'])
+        # The backfill reads archived conversations from their archives instead of skipping them
+        with patch('core.services.memory.upsert_vectors') as upsert:
+            call_command('index_chat_memory', user=self.user.id, stdout=StringIO())
+        points = [v for call in upsert.call_args_list for v in call.args[0]]
+        self.assertEqual([v['metadata']['chunk_index'] for v in points], [self.answer.id])
+        self.assertEqual(points[0]['metadata']['message_ids'], [self.answer.id - 1, self.answer.id])
+        self.assertEqual(len(search_vectors([1.0, 0.0, 0.0], collection='chat_memory', user_id=self.user.id)['result']), 1)
+
+
+class DocumentIngestionTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from rest_framework.test import APIClient
+        from core.models import User
+        from core.services.vector_store import LocalVectorStore
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=tmp.name))
+        self.enterContext(patch('core.services.vector_store._store', LocalVectorStore(tmp.name)))
+        # One chunk per line, so the test needs no tokenizer download
+        self.enterContext(patch('core.services.ingestion.chunk_text_token_overlap', side_effect=lambda text: [
+            {'chunk': line, 'chunk_index': i, 'start_token': i, 'end_token': i + 1} for i, line in enumerate(text.splitlines())
+        ]))
+        self.enterContext(patch('core.services.ingestion.INGEST_EMBED_BATCH_SIZE', 2))
+        self.user = User.objects.create_user(username='uploader', email='uploader@example.com', password='pw', is_admin=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, path, name, body, **data):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from core.services.ingest_queue import ingestion_queue
+        with patch.object(ingestion_queue, 'enqueue') as enqueue, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(path, {'file': SimpleUploadedFile(name, body), 'file_type': 'txt', **data}, format='multipart')
+        return response, enqueue
+
+    def test_upload_returns_at_once_and_progress_is_polled(self):
+        from core.models import PersonalKnowledgeDocument, UserActivityStats
+        from core.services.ingest_queue import ingest
+        from core.services.vector_store import search_vectors
+        response, enqueue = self.upload('/api/personal-kb/', 'setlist.txt', b'opener\nballad\nencore', title='Setlist')
+        self.assertEqual(response.status_code, 202)
+        doc_id = response.json()['id']
+        self.assertEqual((response.json()['ingest_status'], response.json()['ingest_progress']), ('queued', 0.0))
+        enqueue.assert_called_once_with('personal', doc_id)
+        polled = []
+
+        def embed(texts, **kwargs):
+            polled.append(self.client.get('/api/personal-kb/status/', {'ids': str(doc_id)}).json()[0])
+            return [[[0.1, 0.2, 0.3]] for _ in texts]
+
+        with patch('core.services.ingestion.embed_text', side_effect=embed):
+            self.assertEqual(ingest('personal', doc_id), 3)
+        # Two embedding batches, each reported before it runs
+        self.assertEqual([(p['ingest_status'], p['ingest_progress']) for p in polled], [('embedding', 0.1), ('embedding', 0.633)])
+        status = self.client.get('/api/personal-kb/status/', {'ids': f"{doc_id},999"}).json()
+        self.assertEqual(status, [{'id': doc_id, 'ingest_status': 'ready', 'ingest_progress': 1.0, 'ingest_error': ''}])
+        self.assertEqual(PersonalKnowledgeDocument.objects.get(id=doc_id).metadata['num_chunks'], 3)
+        self.assertEqual(UserActivityStats.objects.get(user=self.user).chunks, 3)
+        self.assertEqual(len(search_vectors([0.1, 0.2, 0.3], collection='personal_kb', user_id=self.user.id)['result']), 3)
+
+    def test_admin_upload_is_ingested_once_and_failures_are_reported(self):
+        from core.models import User
+        from core.services.ingest_queue import ingest
+        response, enqueue = self.upload('/api/global_kb_upload/', 'notes.txt', b'\xff\xfe')
+        self.assertEqual(response.status_code, 202)
+        doc_id = response.json()['doc_id']
+        enqueue.assert_called_once_with('global', doc_id)
+        with patch('core.services.ingestion.embed_text') as embed:
+            self.assertEqual(ingest('global', doc_id), 0)
+        embed.assert_not_called()
+        status = self.client.get('/api/global-kb/status/', {'ids': str(doc_id)}).json()[0]
+        self.assertEqual(status['ingest_status'], 'failed')
+        self.assertIn('utf-8', status['ingest_error'])
+        # Personal documents are only visible to their owner
+        personal, _ = self.upload('/api/personal-kb/', 'mine.txt', b'mine', title='Mine')
+        other = User.objects.create_user(username='other', email='other@example.com', password='pw')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get('/api/personal-kb/status/', {'ids': str(personal.json()['id'])}).json(), [])
+        self.assertEqual(self.client.get('/api/personal-kb/status/', {'ids': 'x'}).status_code, 400)
@@ -1,6 +1,6 @@
 from django.urls import path
 from .views import admin_global_kb_upload
-from .views import RegisterView, LoginView, UserProfileView, GlobalKnowledgeDocumentListCreateView, GlobalKnowledgeDocumentRetrieveDestroyView, PersonalKnowledgeDocumentListCreateView, PersonalKnowledgeDocumentRetrieveDestroyView, global_kb_semantic_search, personal_kb_semantic_search, suggest_consultancy, ConversationListCreateView, ConversationDetailView, MessageCreateView
+from .views import RegisterView, LoginView, UserProfileView, GlobalKnowledgeDocumentListCreateView, GlobalKnowledgeDocumentRetrieveDestroyView, PersonalKnowledgeDocumentListCreateView, PersonalKnowledgeDocumentRetrieveDestroyView, global_kb_semantic_search, personal_kb_semantic_search, ingest_status_view, suggest_consultancy, usage_summary_view, dashboard_view, chat_search_view, health_view, ConversationListCreateView, ConversationDetailView, ConversationMessagesView, MessageCreateView
 
 urlpatterns = [
     path('global_kb_upload/', admin_global_kb_upload, name='admin_global_kb_upload'),
@@ -12,11 +12,13 @@ urlpatterns = [
 urlpatterns += [
     path('global-kb/', GlobalKnowledgeDocumentListCreateView.as_view(), name='global-kb-list-create'),
     path('global-kb/<int:pk>/', GlobalKnowledgeDocumentRetrieveDestroyView.as_view(), name='global-kb-detail'),
+    path('global-kb/status/', ingest_status_view, {'kind': 'global'}, name='global-kb-status'),
 ]
 
 urlpatterns += [
     path('personal-kb/', PersonalKnowledgeDocumentListCreateView.as_view(), name='personal-kb-list-create'),
     path('personal-kb/<int:pk>/', PersonalKnowledgeDocumentRetrieveDestroyView.as_view(), name='personal-kb-detail'),
+    path('personal-kb/status/', ingest_status_view, {'kind': 'personal'}, name='personal-kb-status'),
 ]
 
 urlpatterns += [
@@ -26,10 +28,15 @@ urlpatterns += [
 
 urlpatterns += [
     path('consultancy/suggest/', suggest_consultancy, name='consultancy-suggest'),
+    path('usage/', usage_summary_view, name='usage-summary'),
+    path('dashboard/', dashboard_view, name='dashboard'),
+    path('health/', health_view, name='health'),
 ]
 
 urlpatterns += [
     path('chat/conversations/', ConversationListCreateView.as_view(), name='chat-conversation-list-create'),
     path('chat/conversations/<int:pk>/', ConversationDetailView.as_view(), name='chat-conversation-detail'),
+    path('chat/conversations/<int:pk>/messages/', ConversationMessagesView.as_view(), name='chat-conversation-messages'),
+    path('chat/search/', chat_search_view, name='chat-search'),
     path('chat/messages/', MessageCreateView.as_view(), name='chat-message-create'),
 ] 
\ No newline at end of file
@@ -13,13 +13,36 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.parsers import JSONParser, MultiPartParser
 from .services.ingestion import embed_text
-from .services.qdrant_client import search_vectors
-from .services.ai_service import ai_service
+from .services.vector_store import search_vectors
+from .services.ai_service import ai_service, history_window_start, HISTORY_WINDOW_MESSAGES, HISTORY_BLOCK_MESSAGES
+from .services.usage import usage_summary
+from .services.activity import bump, dashboard
+from .services.archive import ensure_hot
+from .services.chat_search import search_messages, CHAT_SEARCH_PAGE_SIZE, CHAT_SEARCH_MAX_PAGE_SIZE
+from .services.tracing import span
+from .services.metrics import render_metrics, METRICS_BEARER_TOKEN
+from .services.resilience import breaker_states
+from .services.admission import admission, AdmissionRejected
+import os
+import math
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework.exceptions import ValidationError
 from .models import Conversation, Message
-from .serializers import ConversationSerializer, MessageSerializer
+from .serializers import ConversationSerializer, ConversationSummarySerializer, MessageSerializer, MessageContextSerializer
+from django.db.models import Count, Max, Prefetch, Window
+from django.db.models.functions import Coalesce
+from rest_framework.pagination import CursorPagination
 
 User = get_user_model()
 
+# Messages returned per incremental fetch of a conversation
+CHAT_MESSAGES_PAGE_SIZE = int(os.getenv('CHAT_MESSAGES_PAGE_SIZE', '50'))
+CHAT_MESSAGES_MAX_PAGE_SIZE = 200
+CHAT_CONVERSATIONS_PAGE_SIZE = int(os.getenv('CHAT_CONVERSATIONS_PAGE_SIZE', '20'))
+# Documents whose ingestion status one poll may ask for
+INGEST_STATUS_MAX_IDS = 100
+
 from rest_framework.decorators import api_view, permission_classes, parser_classes
 
 @api_view(['POST'])
@@ -38,65 +61,20 @@ def admin_global_kb_upload(request):
         file_type = request.data.get('file_type')
         title = request.data.get('title', getattr(file_field, 'name', 'Untitled'))
         
-        logger.info(f"Upload request - file: {file_field}, file_type: {file_type}, title: {title}")
+        logger.info("Upload request - file: %s, file_type: %s, title: %s", file_field, file_type, title)
         
         if not file_field or not file_type:
             logger.error("Missing required fields: file or file_type")
             return Response({'error': 'file and file_type are required.'}, status=400)
         
-        from .models import GlobalKnowledgeDocument
-        from .services.ingestion import ingest_document
-        from .services.qdrant_client import upsert_vectors
-        
-        # Save document to DB first to get PK
-        logger.info("Creating GlobalKnowledgeDocument in database")
+        # Extraction, embedding and indexing run in the background (see services.ingest_queue);
+        # poll /api/global-kb/status/?ids=<doc_id> for progress
         doc = GlobalKnowledgeDocument.objects.create(title=title, file=file_field, file_type=file_type)
-        doc_metadata = {'doc_id': str(doc.id)}
-        
-        logger.info(f"Document saved with ID: {doc.id}")
-        
-        # Ingest with is_global=True and doc_id in metadata
-        logger.info("Starting document ingestion")
-        chunks = ingest_document(doc.file, file_type=file_type, doc_metadata=doc_metadata, is_global=True)
-        
-        logger.info(f"Ingestion completed, got {len(chunks)} chunks")
-        
-        # Upsert chunks to Qdrant with doc_id in payload
-        qdrant_vectors = []
-        skipped_chunks = 0
-        
-        for i, c in enumerate(chunks):
-            embeddings = c['metadata'].get('embeddings', [])
-            if not embeddings or not isinstance(embeddings, list) or len(embeddings) == 0 or embeddings[0] is None:
-                logger.error(f"Skipping chunk {i} due to missing or invalid OpenAI embedding: {c}")
-                skipped_chunks += 1
-                continue
-            qdrant_vectors.append({
-                'embedding': embeddings[0],  # OpenAI embedding for default collection
-                'chunk': c['chunk'],
-                'metadata': c['metadata']
-            })
-        
-        logger.info(f"Prepared {len(qdrant_vectors)} vectors for Qdrant, skipped {skipped_chunks}")
-        
-        if not qdrant_vectors:
-            logger.error("No valid chunks with OpenAI embeddings to upsert to Qdrant.")
-            return Response({'error': 'No valid chunks with OpenAI embeddings to upload.'}, status=500)
-        
-        # Upsert to Qdrant
-        logger.info("Upserting vectors to Qdrant")
-        upsert_vectors(qdrant_vectors, collection='global_kb')
-        
-        result = {'status': 'success', 'num_chunks': len(qdrant_vectors), 'doc_id': doc.id}
-        if skipped_chunks:
-            result['skipped_chunks'] = skipped_chunks
-            logger.warning(f"Skipped {skipped_chunks} chunks due to missing embeddings.")
-        
-        logger.info(f"Upload completed successfully: {result}")
-        return Response(result)
+        logger.info("Document saved with ID: %s, queued for ingestion", doc.id)
+        return Response({'status': doc.ingest_status, 'doc_id': doc.id}, status=status.HTTP_202_ACCEPTED)
         
     except Exception as e:
-        logger.exception(f"Upload failed with exception: {e}")
+        logger.exception("Upload failed with exception: %s", e)
         return Response({'error': str(e)}, status=500)
 
 class RegisterView(generics.CreateAPIView):
@@ -131,7 +109,14 @@ class IsAdminOrReadOnly(permissions.BasePermission):
             return True
         return request.user.is_authenticated and request.user.is_admin
 
-class GlobalKnowledgeDocumentListCreateView(generics.ListCreateAPIView):
+class AcceptedCreateMixin:
+    """Document uploads answer 202: the file is stored and ingestion continues in the background."""
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+class GlobalKnowledgeDocumentListCreateView(AcceptedCreateMixin, generics.ListCreateAPIView):
     queryset = GlobalKnowledgeDocument.objects.all().order_by('-uploaded_at')
     serializer_class = GlobalKnowledgeDocumentSerializer
     permission_classes = [IsAdminOrReadOnly]
@@ -146,9 +131,9 @@ class GlobalKnowledgeDocumentRetrieveDestroyView(generics.RetrieveDestroyAPIView
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.owner == request.user
+        return obj.owner_id == request.user.id
 
-class PersonalKnowledgeDocumentListCreateView(generics.ListCreateAPIView):
+class PersonalKnowledgeDocumentListCreateView(AcceptedCreateMixin, generics.ListCreateAPIView):
     serializer_class = PersonalKnowledgeDocumentSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -165,13 +150,27 @@ class PersonalKnowledgeDocumentRetrieveDestroyView(generics.RetrieveDestroyAPIVi
     def get_queryset(self):
         return PersonalKnowledgeDocument.objects.filter(owner=self.request.user)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def ingest_status_view(request, kind):
+    """Ingestion status and progress of the given documents (?ids=1,2,3), polled by the upload pages."""
+    try:
+        ids = [int(i) for i in request.query_params.get('ids', '').split(',') if i.strip()][:INGEST_STATUS_MAX_IDS]
+    except ValueError:
+        return Response({'error': 'ids must be comma-separated document ids.'}, status=400)
+    if kind == 'global':
+        documents = GlobalKnowledgeDocument.objects.filter(id__in=ids)
+    else:
+        documents = PersonalKnowledgeDocument.objects.filter(owner=request.user, id__in=ids)
+    return Response(list(documents.order_by('id').values('id', 'ingest_status', 'ingest_progress', 'ingest_error')))
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def global_kb_semantic_search(request):
     query = request.data.get('query')
     if not query:
         return Response({'error': 'Query is required.'}, status=400)
-    embedding = embed_text([query])[0]
+    embedding = embed_text([query], user_id=request.user.id if request.user.is_authenticated else None, stage='search')[0][0]
     results = search_vectors(embedding, collection='global_kb', top=5)
     return Response(results)
 
@@ -181,13 +180,50 @@ def personal_kb_semantic_search(request):
     query = request.data.get('query')
     if not query:
         return Response({'error': 'Query is required.'}, status=400)
-    embedding = embed_text([query])[0]
-    # Filter by user_id in Qdrant
+    embedding = embed_text([query], user_id=request.user.id, stage='search')[0][0]
+    # Tenant-partitioned search: the vector store only returns this user's points
     user_id = request.user.id
-    results = search_vectors(embedding, collection='personal_kb', top=5)
-    # Filter results to only those with matching user_id in payload
-    filtered = [r for r in results.get('result', []) if r['payload'].get('user_id') == user_id]
-    return Response({'result': filtered})
+    results = search_vectors(embedding, collection='personal_kb', top=5, user_id=user_id)
+    return Response({'result': results.get('result', [])})
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def health_view(request):
+    """Liveness plus this worker's upstream circuit breaker states; 'degraded' while any breaker is not closed."""
+    breakers = breaker_states()
+    degraded = any(b['state'] != 'closed' for b in breakers.values())
+    return Response({'status': 'degraded' if degraded else 'ok', 'breakers': breakers})
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def usage_summary_view(request):
+    """Today's budget position and daily token/cost rollups for the current user (?days=7)."""
+    try:
+        days = min(max(int(request.query_params.get('days', 7)), 1), 90)
+    except ValueError:
+        return Response({'error': 'days must be an integer.'}, status=400)
+    return Response(usage_summary(request.user.id, days=days))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def chat_search_view(request):
+    """Full-text search over the current user's chat messages (?q=...&page=1&page_size=20), best match first."""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q is required.'}, status=400)
+    try:
+        page = max(int(request.query_params.get('page', 1)), 1)
+        page_size = min(max(int(request.query_params.get('page_size', CHAT_SEARCH_PAGE_SIZE)), 1), CHAT_SEARCH_MAX_PAGE_SIZE)
+    except ValueError:
+        return Response({'error': 'page and page_size must be integers.'}, status=400)
+    with span('db.chat_search'):
+        return Response(search_messages(request.user.id, query, page=page, page_size=page_size))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def dashboard_view(request):
+    """Dashboard counters and recent documents/conversations for the current user in one call."""
+    return Response(dashboard(request.user.id))
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -206,17 +242,35 @@ def suggest_consultancy(request):
         if len(recent_docs) >= 5:
             suggestions.append("You have uploaded several documents recently. Consider setting clear goals for the week.")
         # Placeholder for more advanced logic
+    bump(user.id, suggestions=1)
     return Response({
         'suggestions': suggestions,
         'recent_docs': [doc.title for doc in recent_docs]
     })
 
+class ConversationCursorPagination(CursorPagination):
+    page_size = CHAT_CONVERSATIONS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-started_at', '-id')
+
 class ConversationListCreateView(generics.ListCreateAPIView):
-    serializer_class = ConversationSerializer
+    """
+    Lists conversation summaries, newest first, one cursor page per request. Message
+    count and last message time come from annotations (including archived messages),
+    so a page is a single query.
+    """
     permission_classes = [IsAuthenticated]
+    pagination_class = ConversationCursorPagination
+
+    def get_serializer_class(self):
+        return ConversationSummarySerializer if self.request.method == 'GET' else ConversationSerializer
 
     def get_queryset(self):
-        return Conversation.objects.filter(user=self.request.user).order_by('-started_at')
+        return Conversation.objects.filter(user=self.request.user).annotate(
+            message_count=Count('messages') + Coalesce('archive__message_count', 0),
+            last_message_at=Coalesce(Max('messages__timestamp'), 'archive__last_message_at'),
+        )
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -227,24 +281,103 @@ class ConversationDetailView(generics.RetrieveAPIView):
     queryset = Conversation.objects.all()
 
     def get_queryset(self):
-        return Conversation.objects.filter(user=self.request.user)
+        return Conversation.objects.filter(user=self.request.user).prefetch_related(
+            Prefetch('messages', queryset=Message.objects.defer('context').order_by('timestamp', 'id'))
+        )
+
+    def get_object(self):
+        conversation = super().get_object()
+        if conversation.archived_at is not None:
+            # Archived conversations are restored to the hot table on first access
+            ensure_hot(conversation)
+            conversation = super().get_object()
+        return conversation
+
+class ConversationMessagesView(generics.ListAPIView):
+    """
+    Messages of a conversation in id order. `?after=<message id>` returns only newer
+    messages, at most `limit` (default CHAT_MESSAGES_PAGE_SIZE) per call.
+    `?tail=1` returns the last `limit` messages instead of the first, and
+    `?before=<message id>` the `limit` messages right before that one (for paging back).
+    `?include=context` adds each message's generation context.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_serializer_class(self):
+        return MessageContextSerializer if self.request.query_params.get('include') == 'context' else MessageSerializer
+
+    def get_queryset(self):
+        conversation = ensure_hot(get_object_or_404(Conversation, id=self.kwargs['pk'], user=self.request.user))
+        try:
+            after = int(self.request.query_params.get('after', 0))
+            before = self.request.query_params.get('before')
+            before = int(before) if before is not None else None
+            limit = min(int(self.request.query_params.get('limit', CHAT_MESSAGES_PAGE_SIZE)), CHAT_MESSAGES_MAX_PAGE_SIZE)
+        except ValueError:
+            raise ValidationError({'error': '`after`, `before` and `limit` must be integers.'})
+        messages = Message.objects.filter(conversation=conversation, id__gt=after)
+        if self.get_serializer_class() is MessageSerializer:
+            messages = messages.defer('context')
+        if before is not None or self.request.query_params.get('tail') == '1':
+            if before is not None:
+                messages = messages.filter(id__lt=before)
+            # Newest first to take the window, then back to id order
+            return list(reversed(messages.order_by('-id')[:max(limit, 1)]))
+        return messages.order_by('id')[:max(limit, 1)]
 
 class MessageCreateView(generics.CreateAPIView):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
 
+    def create(self, request, *args, **kwargs):
+        # Admission control: reject before saving anything when the user or the server is at capacity
+        try:
+            with admission.admitted(request.user.id):
+                response = super().create(request, *args, **kwargs)
+        except AdmissionRejected as e:
+            retry_after = max(1, math.ceil(e.retry_after))
+            return Response(
+                {'error': 'Too many chat requests, please retry shortly.', 'reason': e.reason, 'retry_after': retry_after},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(retry_after)}
+            )
+        # Return the reply with the user message so the client can append both without a reload
+        response.data['ai_message'] = MessageSerializer(self.ai_message).data
+        return response
+
     def perform_create(self, serializer):
-        conversation = Conversation.objects.get(id=self.request.data['conversation'], user=self.request.user)
-        # Save user message
-        msg = serializer.save(conversation=conversation, sender='user')
-        # Retrieve last N messages for context
-        context_msgs = Message.objects.filter(conversation=conversation).order_by('-timestamp')[:10][::-1]
-        context_texts = [m.text for m in context_msgs]
+        with span('db.save_user_message'):
+            conversation = ensure_hot(Conversation.objects.select_related('user').get(id=self.request.data['conversation'], user=self.request.user))
+            # Save user message
+            msg = serializer.save(conversation=conversation, sender='user')
+        # Retrieve the messages before this one from a block-aligned window start, for context
+        with span('db.load_history'):
+            # The longest window the block alignment allows, with the total count in the same query
+            latest = list(
+                Message.objects.filter(conversation=conversation).exclude(id=msg.id).only('sender', 'text')
+                .annotate(total=Window(Count('id'))).order_by('-timestamp')[:HISTORY_WINDOW_MESSAGES + HISTORY_BLOCK_MESSAGES - 1]
+            )
+            count = latest[0].total if latest else 0
+            context_msgs = latest[:count - history_window_start(count)][::-1]
+        history = [{'role': 'user' if m.sender == 'user' else 'assistant', 'content': m.text} for m in context_msgs]
         # Generate AI response using RAG
-        ai_response = ai_service.generate_response(
+        reply = ai_service.generate_reply(
             user_message=msg.text,
-            conversation_history=context_texts,
-            user_id=self.request.user.id
+            conversation_history=history,
+            user_id=self.request.user.id,
+            recent_message_ids=[m.id for m in context_msgs]
         )
-        # Save AI message
-        Message.objects.create(conversation=conversation, sender='ai', text=ai_response, context={"history": context_texts})
+        # Save AI message with the token usage of its completion and references (not copies) to what it used
+        with span('db.save_ai_message'):
+            self.ai_message = Message.objects.create(
+                conversation=conversation, sender='ai', text=reply['text'],
+                context={'history_ids': [m.id for m in context_msgs], **reply.get('context', {})},
+                **reply['usage']
+            )
+
+def metrics_view(request):
+    """Prometheus scrape endpoint. Set METRICS_BEARER_TOKEN to require `Authorization: Bearer <token>`."""
+    if METRICS_BEARER_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_BEARER_TOKEN}":
+        return HttpResponse(status=401)
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
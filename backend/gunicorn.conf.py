@@ -0,0 +1,18 @@
+import os
+import shutil
+
+# Prometheus multiprocess mode: workers write samples under PROMETHEUS_MULTIPROC_DIR,
+# which must be empty when the server starts and pruned when a worker exits.
+
+
+def on_starting(server):
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -65,6 +65,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.TracingMiddleware',
+    'core.middleware.MetricsMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -76,6 +78,39 @@ MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware',
 ]
 
+# Logging: records are queued on the calling thread and formatted and written by a
+# listener thread (see core/logging_config.py). LOG_FORMAT is 'json' or 'text'; set
+# LOG_CONSOLE=true to also write records to stderr.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_FILE = os.getenv('LOG_FILE', str(BASE_DIR / 'logs' / 'ai_manager.log'))
+LOG_CONSOLE = os.getenv('LOG_CONSOLE', 'false').lower() == 'true'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'core.logging_config.JSONFormatter'},
+        'text': {'()': 'core.logging_config.TextFormatter'},
+    },
+    'filters': {
+        'sampling': {'()': 'core.logging_config.SamplingFilter'},
+    },
+    'handlers': {
+        'async': {
+            'class': 'core.logging_config.AsyncQueueHandler',
+            'formatter': LOG_FORMAT,
+            'filters': ['sampling'],
+            'log_file': LOG_FILE,
+            'console': LOG_CONSOLE,
+        },
+    },
+    'root': {'handlers': ['async'], 'level': 'INFO'},
+    'loggers': {
+        'ai_manager': {'handlers': ['async'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
+
 ROOT_URLCONF = "manager_backend.urls"
 
 TEMPLATES = [
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "manager_backend.settings")
 
 application = get_wsgi_application()
+
+# Start loading the cross-encoder now rather than on the first chat request
+from core.services.reranker import reranker, RERANK_ENABLED  # noqa: E402
+if RERANK_ENABLED:
+    reranker.start_loading()
@@ -0,0 +1,148 @@
+import io
+import os
+import uuid
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+# Backend the pages talk to: http://backend:8000 inside docker compose, the backend's public URL in production
+BACKEND_URL = os.getenv('BACKEND_URL', 'http://localhost:8000').rstrip('/')
+# (connect, read) seconds. Chat turns and uploads wait on the model and on ingestion.
+API_CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', '3'))
+API_TIMEOUT = (API_CONNECT_TIMEOUT, float(os.getenv('API_READ_TIMEOUT', '15')))
+API_SLOW_TIMEOUT = (API_CONNECT_TIMEOUT, float(os.getenv('API_SLOW_READ_TIMEOUT', '120')))
+API_UPLOAD_TIMEOUT = (API_CONNECT_TIMEOUT, float(os.getenv('API_UPLOAD_READ_TIMEOUT', '300')))
+# GET responses are reused across reruns for this long, or until this session changes something
+API_CACHE_TTL = int(os.getenv('API_CACHE_TTL', '30'))
+API_POOL_SIZE = int(os.getenv('API_POOL_SIZE', '20'))
+# Bytes handed to the socket per read of an upload body
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+class ApiResponse:
+    """Status and decoded body of a GET; small and picklable so st.cache_data can keep it."""
+    def __init__(self, status_code: int, data, text: str = ''):
+        self.status_code = status_code
+        self.data = data
+        self.text = text
+
+    def json(self):
+        return self.data
+
+class _Uncached(Exception):
+    # Raised inside the cached function so error responses are not cached
+    def __init__(self, response: ApiResponse):
+        self.response = response
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """
+    One keep-alive connection pool shared by every browser session of this server.
+    Authorization is passed per request, never stored on the session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=API_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _headers(token: str = None):
+    token = token or st.session_state.get('token')
+    return {'Authorization': f"Bearer {token}"} if token else {}
+
+def request(method: str, path: str, timeout=API_TIMEOUT, token: str = None, **kwargs) -> requests.Response:
+    """Uncached call to the backend; path is relative to BACKEND_URL, e.g. '/api/dashboard/'."""
+    headers = {**_headers(token), **kwargs.pop('headers', {})}
+    return get_session().request(method, f"{BACKEND_URL}{path}", headers=headers, timeout=timeout, **kwargs)
+
+@st.cache_data(ttl=API_CACHE_TTL, show_spinner=False)
+def _cached_get(path: str, params, token: str, generation: int) -> ApiResponse:
+    response = request('GET', path, params=params, token=token)
+    try:
+        data = response.json()
+    except ValueError:
+        data = None
+    result = ApiResponse(response.status_code, data, response.text if data is None else '')
+    if response.status_code != 200:
+        raise _Uncached(result)
+    return result
+
+def get(path: str, params: dict = None) -> ApiResponse:
+    """
+    GET through the TTL cache. The key includes the user's token and this session's cache
+    generation, so users never share entries and the session's own changes show up at once.
+    """
+    try:
+        return _cached_get(path, params, st.session_state.get('token'), st.session_state.get('api_cache_generation', 0))
+    except _Uncached as e:
+        return e.response
+
+def invalidate():
+    """Start a fresh cache generation for this session after it changed something."""
+    st.session_state.api_cache_generation = st.session_state.get('api_cache_generation', 0) + 1
+
+def post(path: str, timeout=API_TIMEOUT, invalidates: bool = True, **kwargs) -> requests.Response:
+    """POST; pass invalidates=False for read-only calls such as searches."""
+    response = request('POST', path, timeout=timeout, **kwargs)
+    if invalidates:
+        invalidate()
+    return response
+
+def delete(path: str, timeout=API_TIMEOUT, **kwargs) -> requests.Response:
+    response = request('DELETE', path, timeout=timeout, **kwargs)
+    invalidate()
+    return response
+
+class MultipartStream:
+    """
+    A multipart/form-data body that is read off the uploaded file piece by piece, so an upload
+    is streamed instead of being copied into one bytes object first. It has a length, so the
+    request carries Content-Length (Django does not read chunked request bodies).
+    """
+    def __init__(self, fields: dict, file, filename: str, content_type: str = None, on_progress=None):
+        self.boundary = uuid.uuid4().hex
+        quoted = filename.replace('"', '%22').replace('\r', '').replace('\n', '')
+        head = ''.join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        ) + (
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="file"; filename="{quoted}"\r\n'
+            f'Content-Type: {content_type or "application/octet-stream"}\r\n\r\n'
+        )
+        tail = f'\r\n--{self.boundary}--\r\n'.encode()
+        file.seek(0, io.SEEK_END)
+        size = file.tell()
+        file.seek(0)
+        self._parts = [io.BytesIO(head.encode()), file, io.BytesIO(tail)]
+        self.len = len(head.encode()) + size + len(tail)  # requests takes Content-Length from .len
+        self.sent = 0
+        self.on_progress = on_progress
+        self._percent = -1
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def read(self, size: int = -1) -> bytes:
+        size = UPLOAD_CHUNK_SIZE if size is None or size < 0 else min(size, UPLOAD_CHUNK_SIZE)
+        while self._parts:
+            data = self._parts[0].read(size)
+            if data:
+                self.sent += len(data)
+                # The socket reads a few KB at a time; report whole percents only
+                percent = self.sent * 100 // self.len
+                if self.on_progress and percent != self._percent:
+                    self._percent = percent
+                    self.on_progress(self.sent / self.len)
+                return data
+            self._parts.pop(0)
+        return b''
+
+def upload(path: str, file, fields: dict, on_progress=None, timeout=API_UPLOAD_TIMEOUT) -> requests.Response:
+    """
+    POST a Streamlit UploadedFile (or any seekable file with .name) as the multipart 'file'
+    field plus fields, streaming it; on_progress(fraction) follows the bytes sent.
+    """
+    body = MultipartStream(fields, file, getattr(file, 'name', 'upload'), getattr(file, 'type', None), on_progress)
+    response = request('POST', path, timeout=timeout, data=body, headers={'Content-Type': body.content_type})
+    invalidate()
+    return response
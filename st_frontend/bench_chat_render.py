@@ -0,0 +1,106 @@
+"""
+Rerun time of the Chat page for a long conversation, measured with Streamlit's AppTest
+against an in-process stub of the messages API (no backend needed):
+
+    python bench_chat_render.py --messages 1000 --reruns 20
+
+'window' opens the conversation the way the page does (latest CHAT_WINDOW messages),
+'all' holds the whole transcript in session state like the page used to, and
+'load earlier' times one "Load earlier messages" click.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import statistics
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def make_messages(count):
+    words = "tour venue setlist merch budget release single press radio playlist".split()
+    return [
+        {'id': i, 'sender': 'user' if i % 2 else 'ai', 'timestamp': '2026-01-01T00:00:00Z',
+         'text': ' '.join(words[(i + j) % len(words)] for j in range(40 if i % 2 else 120))}
+        for i in range(1, count + 1)
+    ]
+
+def serve(messages):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path.endswith('/messages/'):
+                limit = int(query.get('limit', 50))
+                rows = [m for m in messages if m['id'] > int(query.get('after', 0))]
+                if 'before' in query or query.get('tail') == '1':
+                    rows = [m for m in rows if 'before' not in query or m['id'] < int(query['before'])][-limit:]
+                else:
+                    rows = rows[:limit]
+                body = rows
+            else:
+                body = {'results': [{'id': 1, 'title': 'Long chat', 'started_at': '2026-01-01T00:00:00Z'}], 'next': None}
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+APP = '''
+import sys
+sys.path.insert(0, {here!r})
+import streamlit as st
+from pages import Chat
+if 'token' not in st.session_state:
+    st.session_state.token = 'bench'
+    Chat.open_conversation({{'id': 1, 'title': 'Long chat', 'started_at': '2026-01-01'}})
+    if {render_all!r}:
+        st.session_state.messages = Chat.fetch_new_messages(1)
+        st.session_state.has_earlier = False
+Chat.render()
+'''
+
+def timed(run):
+    started = time.perf_counter()
+    run()
+    return (time.perf_counter() - started) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--reruns', type=int, default=20)
+    args = parser.parse_args()
+
+    server = serve(make_messages(args.messages))
+    os.environ['BACKEND_URL'] = f"http://127.0.0.1:{server.server_port}"
+    sys.path.insert(0, HERE)
+    from streamlit.testing.v1 import AppTest
+
+    for name, render_all in (('window', False), ('all', True)):
+        app = AppTest.from_string(APP.format(here=HERE, render_all=render_all), default_timeout=60)
+        app.run()
+        if app.exception:
+            raise SystemExit(app.exception[0].message)
+        samples = sorted(timed(app.run) for _ in range(args.reruns))
+        print(f"{name:>13}: {len(app.session_state['messages']):5d} messages held, rerun p50 {statistics.median(samples):7.1f} ms, "
+              f"max {samples[-1]:7.1f} ms")
+        if not render_all:
+            click = timed(lambda: app.button(key='load_earlier').click().run())
+            print(f"{'load earlier':>13}: {len(app.session_state['messages']):5d} messages held, {click:7.1f} ms")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+from pages.Knowledgebase import PENDING_STATUSES, STATUS_LABELS, fetch_ingest_status, ingestion_progress, upload_document
 
 st.title('🛡️ Admin: Global KB Upload')
 st.markdown('Upload documents to the **Global Knowledge Base**. Only authenticated users can use this page. For production, restrict to admins.')
@@ -22,33 +23,40 @@ token = st.session_state.get('token')
 
 if uploaded_file and file_type and token:
     if st.button('Upload to Global KB'):
-        with st.spinner('Uploading and ingesting...'):
-            files = {'file': (uploaded_file.name, uploaded_file, uploaded_file.type)}
-            data = {'file_type': file_type}
-            headers = {'Authorization': f'Bearer {token}'}
-            try:
-                response = requests.post(
-                    'http://34.60.140.141:8000/api/global_kb_upload/',
-                    files=files,
-                    data=data,
-                    headers=headers,
-                    timeout=300  # 5 minute timeout
-                )
-                if response.status_code == 200:
-                    result = response.json()
-                    st.success(f"Upload successful! Chunks created: {result.get('num_chunks')}")
-                    if result.get('skipped_chunks'):
-                        st.warning(f"Skipped {result.get('skipped_chunks')} chunks due to embedding issues")
-                else:
-                    try:
-                        error_data = response.json()
-                        st.error(f"Upload failed: {error_data.get('error', 'Unknown error')}")
-                    except:
-                        st.error(f"Upload failed: {response.text}")
-            except requests.exceptions.Timeout:
-                st.error("Upload timed out. The file might be too large or the server is busy.")
-            except Exception as e:
-                st.error(f"Request failed: {e}")
-                st.error("Check server logs for more details.")
+        try:
+            response = upload_document('/api/global_kb_upload/', uploaded_file, {'title': uploaded_file.name, 'file_type': file_type})
+            if response.status_code == 202:
+                # Ingestion continues in the background; its progress is followed below
+                st.session_state.setdefault('global_uploads', []).append({'id': response.json()['doc_id'], 'title': uploaded_file.name})
+            else:
+                try:
+                    error_data = response.json()
+                    st.error(f"Upload failed: {error_data.get('error', 'Unknown error')}")
+                except:
+                    st.error(f"Upload failed: {response.text}")
+        except requests.exceptions.Timeout:
+            st.error("Upload timed out. The file might be too large or the server is busy.")
+        except Exception as e:
+            st.error(f"Request failed: {e}")
+            st.error("Check server logs for more details.")
 else:
     st.info('Please select a file and ensure you are logged in.')
+
+# Documents uploaded from this session: final states, and live progress of those still processing
+uploads = st.session_state.get('global_uploads', [])
+if uploads and token:
+    st.subheader('Processing')
+    statuses = fetch_ingest_status('global', [doc['id'] for doc in uploads]) or {}
+    pending = []
+    for doc in uploads:
+        current = statuses.get(doc['id'])
+        if current is None:
+            continue
+        if current['ingest_status'] in PENDING_STATUSES:
+            pending.append(doc)
+        elif current['ingest_status'] == 'failed':
+            st.error(f"{doc['title']}: ingestion failed: {current['ingest_error']}")
+        else:
+            st.success(f"{doc['title']}: {STATUS_LABELS['ready'][0]}")
+    if pending:
+        ingestion_progress('global', pending)
@@ -1,5 +1,5 @@
 import streamlit as st
-import requests
+import api_client
 import json
 import re
 from theme import create_page_header, create_card, create_action_button
@@ -78,8 +78,8 @@ def render():
                     else:
                         with st.spinner("Authenticating..."):
                             try:
-                                response = requests.post(
-                                    "http://34.60.140.141:8000/api/login/",
+                                response = api_client.post(
+                                    "/api/login/",
                                     json={"email": email, "password": password}
                                 )
                                 if response.status_code == 200:
@@ -144,8 +144,8 @@ def render():
                     else:
                         with st.spinner("Creating your account..."):
                             try:
-                                response = requests.post(
-                                    "http://34.60.140.141:8000/api/register/",
+                                response = api_client.post(
+                                    "/api/register/",
                                     json={
                                         "email": email.strip(),
                                         "username": username.strip(),
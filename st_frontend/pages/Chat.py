@@ -1,9 +1,127 @@
+import os
+import html
 import streamlit as st
-import requests
+import api_client
 import json
 from datetime import datetime
 from theme import create_page_header, create_card, create_action_button, create_section_header
 
+# Matches the backend's default CHAT_MESSAGES_PAGE_SIZE
+MESSAGES_PAGE_SIZE = 50
+# Messages shown when a conversation opens; "Load earlier" pages back this many at a time (max 200)
+CHAT_WINDOW = min(int(os.getenv('CHAT_WINDOW', '50')), 200)
+
+def fetch_new_messages(conversation_id, after_id=0):
+    """Messages of a conversation newer than after_id, following the cursor page by page."""
+    messages = []
+    while True:
+        response = api_client.get(f"/api/chat/conversations/{conversation_id}/messages/", params={"after": after_id})
+        page = response.json() if response.status_code == 200 else []
+        messages.extend(page)
+        if not page or len(page) < MESSAGES_PAGE_SIZE:
+            return messages
+        after_id = page[-1]['id']
+
+def fetch_window(conversation_id, before_id=None):
+    """The CHAT_WINDOW messages before before_id (the latest ones when None), oldest first."""
+    params = {"limit": CHAT_WINDOW}
+    if before_id is None:
+        params["tail"] = 1
+    else:
+        params["before"] = before_id
+    response = api_client.get(f"/api/chat/conversations/{conversation_id}/messages/", params=params)
+    return response.json() if response.status_code == 200 else []
+
+def open_conversation(conversation):
+    """Make conversation current, holding only its latest CHAT_WINDOW messages."""
+    st.session_state.current_conversation = conversation
+    st.session_state.messages = fetch_window(conversation['id'])
+    st.session_state.has_earlier = len(st.session_state.messages) == CHAT_WINDOW
+    st.session_state.chat_notice = None
+
+def load_earlier():
+    earlier = fetch_window(st.session_state.current_conversation['id'], st.session_state.messages[0]['id'])
+    st.session_state.messages = earlier + st.session_state.messages
+    st.session_state.has_earlier = len(earlier) == CHAT_WINDOW
+
+def send_message():
+    """chat_input callback: post the message and append it with the reply before the panel reruns."""
+    prompt = st.session_state.get('chat_input')
+    if not prompt:
+        return
+    st.session_state.chat_notice = None
+    try:
+        response = api_client.post(
+            "/api/chat/messages/",
+            timeout=api_client.API_SLOW_TIMEOUT,
+            json={
+                "conversation": st.session_state.current_conversation['id'],
+                "text": prompt,
+                "sender": "user"
+            }
+        )
+        if response.status_code == 201:
+            # Append the new user message and the AI reply instead of reloading the conversation
+            created = response.json()
+            ai_message = created.pop('ai_message', None)
+            st.session_state.messages.append(created)
+            if ai_message:
+                st.session_state.messages.append(ai_message)
+            else:
+                st.session_state.messages.extend(fetch_new_messages(st.session_state.current_conversation['id'], created['id']))
+        elif response.status_code == 429:
+            st.session_state.chat_notice = ('warning', f"You're sending messages too quickly. Please try again in {response.headers.get('Retry-After', 'a few')} seconds.")
+    except Exception as e:
+        st.session_state.chat_notice = ('error', f"Failed to send message: {str(e)}")
+
+def messages_html(messages):
+    """All message bubbles as one HTML block: one element to diff per rerun instead of one per message."""
+    bubbles = []
+    for msg in messages:
+        if msg['sender'] == 'user':
+            color, label = "255, 68, 68", "You"
+            border = "#ff4444"
+        else:
+            color, label = "0, 255, 136", "AI Assistant"
+            border = "#00ff88"
+        bubbles.append(
+            f'<div style="background: rgba({color}, 0.1); padding: 1rem; border-radius: 12px; margin: 0.5rem 0; border-left: 4px solid {border};">'
+            f'<p style="margin: 0; color: #ffffff;"><strong>{label}:</strong> {html.escape(msg["text"])}</p></div>'
+        )
+    return "\n".join(bubbles)
+
+@st.fragment
+def chat_panel():
+    """
+    Header, message window and input of the current conversation. Sending a message or
+    loading earlier ones reruns only this fragment, not the sidebar and tips.
+    """
+    conversation = st.session_state.current_conversation
+    create_card(
+        f"💬 {conversation.get('title', 'Chat')}",
+        f"Started: {(conversation.get('started_at') or 'Unknown')[:10]}",
+        "💬"
+    )
+    if st.session_state.get('has_earlier'):
+        st.button("⬆️ Load earlier messages", key="load_earlier", on_click=load_earlier, use_container_width=True)
+    if st.session_state.messages:
+        st.markdown(messages_html(st.session_state.messages), unsafe_allow_html=True)
+    else:
+        create_card(
+            "Start Your Conversation",
+            "Type a message below to begin chatting with your AI assistant. Ask about your music career, get advice, or discuss your goals!",
+            "💭"
+        )
+    notice = st.session_state.get('chat_notice')
+    if notice:
+        getattr(st, notice[0])(notice[1])
+    st.markdown("""
+    <div style="background: rgba(26, 26, 26, 0.8); padding: 1rem; border-radius: 12px; border: 1px solid #333333;">
+        <p style="margin: 0 0 0.5rem 0; color: #cccccc; font-weight: 600;">💬 Send a message:</p>
+    </div>
+    """, unsafe_allow_html=True)
+    st.chat_input("Type your message here...", key="chat_input", on_submit=send_message)
+
 def render():
     create_page_header("AI Chat", "Intelligent conversations with your AI assistant", "💬")
     
@@ -30,28 +148,44 @@ def render():
         
         if create_action_button("New Conversation", "➕", "new_conv"):
             try:
-                response = requests.post(
-                    "http://34.60.140.141:8000/api/chat/conversations/",
-                    headers={"Authorization": f"Bearer {st.session_state.token}"},
+                response = api_client.post(
+                    "/api/chat/conversations/",
                     json={"title": f"Chat {datetime.now().strftime('%H:%M')}"}
                 )
                 if response.status_code == 201:
                     st.session_state.current_conversation = response.json()
                     st.session_state.messages = []
+                    st.session_state.has_earlier = False
                     st.rerun()
             except Exception as e:
                 st.error(f"Failed to create conversation: {str(e)}")
         
         st.markdown("<br>", unsafe_allow_html=True)
-        
+
+        # Search across all conversations
+        search_query = st.text_input("🔍 Search messages", key="chat_search")
+        if search_query.strip():
+            try:
+                response = api_client.get("/api/chat/search/", params={"q": search_query})
+                if response.status_code == 200:
+                    hits = response.json()['results']
+                    if not hits:
+                        st.info("No matching messages.")
+                    for hit in hits:
+                        st.caption(f"{hit['conversation_title'] or 'Untitled'} · {hit['timestamp'][:10]}")
+                        if st.button(hit['snippet'], key=f"hit_{hit['message_id']}", use_container_width=True):
+                            open_conversation({'id': hit['conversation_id'], 'title': hit['conversation_title']})
+                            st.rerun()
+            except Exception as e:
+                st.error(f"Search failed: {str(e)}")
+            st.markdown("<br>", unsafe_allow_html=True)
+
         # Load existing conversations
         try:
-            response = requests.get(
-                "http://34.60.140.141:8000/api/chat/conversations/",
-                headers={"Authorization": f"Bearer {st.session_state.token}"}
-            )
+            response = api_client.get("/api/chat/conversations/")
             if response.status_code == 200:
-                conversations = response.json()
+                # Summaries only (no messages); the first page holds the most recent conversations
+                conversations = response.json()['results']
                 if conversations:
                     st.markdown("**Your Conversations:**")
                     for conv in conversations:
@@ -64,81 +198,16 @@ def render():
                             """, unsafe_allow_html=True)
                         else:
                             if st.button(f"📝 {conv.get('title', 'Untitled')}", key=f"conv_{conv['id']}", use_container_width=True):
-                                st.session_state.current_conversation = conv
-                                st.session_state.messages = conv.get('messages', [])
+                                open_conversation(conv)
                                 st.rerun()
                 else:
                     st.info("No conversations yet. Start your first chat!")
         except Exception as e:
             st.error(f"Failed to load conversations: {str(e)}")
     
-    # Main chat area
+    # Main chat area; it reruns on its own when a message is sent or earlier messages are loaded
     if st.session_state.current_conversation:
-        # Chat header
-        create_card(
-            f"💬 {st.session_state.current_conversation.get('title', 'Chat')}",
-            f"Started: {st.session_state.current_conversation.get('started_at', 'Unknown')[:10]}",
-            "💬"
-        )
-        
-        # Chat messages container
-        chat_container = st.container()
-        with chat_container:
-            if st.session_state.messages:
-                for msg in st.session_state.messages:
-                    if msg['sender'] == 'user':
-                        st.markdown(f"""
-                        <div style="background: rgba(255, 68, 68, 0.1); padding: 1rem; border-radius: 12px; margin: 0.5rem 0; border-left: 4px solid #ff4444;">
-                            <p style="margin: 0; color: #ffffff;"><strong>You:</strong> {msg['text']}</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    else:
-                        st.markdown(f"""
-                        <div style="background: rgba(0, 255, 136, 0.1); padding: 1rem; border-radius: 12px; margin: 0.5rem 0; border-left: 4px solid #00ff88;">
-                            <p style="margin: 0; color: #ffffff;"><strong>AI Assistant:</strong> {msg['text']}</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-            else:
-                create_card(
-                    "Start Your Conversation",
-                    "Type a message below to begin chatting with your AI assistant. Ask about your music career, get advice, or discuss your goals!",
-                    "💭"
-                )
-        
-        # Message input
-        st.markdown("<br>", unsafe_allow_html=True)
-        
-        # Chat input with better styling
-        with st.container():
-            st.markdown("""
-            <div style="background: rgba(26, 26, 26, 0.8); padding: 1rem; border-radius: 12px; border: 1px solid #333333;">
-                <p style="margin: 0 0 0.5rem 0; color: #cccccc; font-weight: 600;">💬 Send a message:</p>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            if prompt := st.chat_input("Type your message here...", key="chat_input"):
-                try:
-                    # Send message to backend
-                    response = requests.post(
-                        "http://34.60.140.141:8000/api/chat/messages/",
-                        headers={"Authorization": f"Bearer {st.session_state.token}"},
-                        json={
-                            "conversation": st.session_state.current_conversation['id'],
-                            "text": prompt,
-                            "sender": "user"
-                        }
-                    )
-                    if response.status_code == 201:
-                        # Reload conversation to get updated messages
-                        conv_response = requests.get(
-                            f"http://34.60.140.141:8000/api/chat/conversations/{st.session_state.current_conversation['id']}/",
-                            headers={"Authorization": f"Bearer {st.session_state.token}"}
-                        )
-                        if conv_response.status_code == 200:
-                            st.session_state.messages = conv_response.json()['messages']
-                            st.rerun()
-                except Exception as e:
-                    st.error(f"Failed to send message: {str(e)}")
+        chat_panel()
     else:
         # No conversation selected
         col1, col2, col3 = st.columns([1, 2, 1])
@@ -161,14 +230,14 @@ def render():
             
             if create_action_button("Start New Conversation", "🚀", "start_new"):
                 try:
-                    response = requests.post(
-                        "http://34.60.140.141:8000/api/chat/conversations/",
-                        headers={"Authorization": f"Bearer {st.session_state.token}"},
+                    response = api_client.post(
+                        "/api/chat/conversations/",
                         json={"title": f"Chat {datetime.now().strftime('%H:%M')}"}
                     )
                     if response.status_code == 201:
                         st.session_state.current_conversation = response.json()
                         st.session_state.messages = []
+                        st.session_state.has_earlier = False
                         st.rerun()
                 except Exception as e:
                     st.error(f"Failed to create conversation: {str(e)}")
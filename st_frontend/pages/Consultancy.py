@@ -1,5 +1,5 @@
 import streamlit as st
-import requests
+import api_client
 import json
 from theme import create_page_header, create_card, create_action_button, create_section_header, create_metric_card
 
@@ -31,10 +31,7 @@ def render():
         if create_action_button("Get AI Recommendations", "🎯", "get_suggestions"):
             with st.spinner("🤖 Analyzing your data and generating recommendations..."):
                 try:
-                    response = requests.post(
-                        "http://34.60.140.141:8000/api/consultancy/suggest/",
-                        headers={"Authorization": f"Bearer {st.session_state.token}"}
-                    )
+                    response = api_client.post("/api/consultancy/suggest/", timeout=api_client.API_SLOW_TIMEOUT)
                     if response.status_code == 200:
                         data = response.json()
                         
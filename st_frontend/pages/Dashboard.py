@@ -1,5 +1,5 @@
 import streamlit as st
-import requests
+import api_client
 import json
 from datetime import datetime
 from theme import create_page_header, create_card, create_metric_card, create_action_button, create_section_header
@@ -27,47 +27,26 @@ def render():
     # Main metrics section
     create_section_header("Activity Overview", "📈")
     
+    # Counters and recent items come from one aggregated call
     try:
-        # Get user stats from backend
+        dashboard_response = api_client.get("/api/dashboard/")
+        dashboard = dashboard_response.json() if dashboard_response.status_code == 200 else None
+        dashboard_error = None if dashboard else f"HTTP {dashboard_response.status_code}"
+    except Exception as e:
+        dashboard, dashboard_error = None, str(e)
+
+    if dashboard:
         col1, col2, col3, col4 = st.columns(4)
-        
-        # Personal documents count
-        try:
-            kb_response = requests.get(
-                "http://34.60.140.141:8000/api/personal-kb/",
-                headers={"Authorization": f"Bearer {st.session_state.token}"}
-            )
-            if kb_response.status_code == 200:
-                personal_docs = len(kb_response.json())
-            else:
-                personal_docs = 0
-        except:
-            personal_docs = 0
-        
-        # Conversations count
-        try:
-            chat_response = requests.get(
-                "http://34.60.140.141:8000/api/chat/conversations/",
-                headers={"Authorization": f"Bearer {st.session_state.token}"}
-            )
-            if chat_response.status_code == 200:
-                conversations = len(chat_response.json())
-            else:
-                conversations = 0
-        except:
-            conversations = 0
-        
         with col1:
-            create_metric_card("Personal Documents", personal_docs, "📚")
+            create_metric_card("Personal Documents", dashboard['documents'], "📚")
         with col2:
-            create_metric_card("Chat Conversations", conversations, "💬")
+            create_metric_card("Chat Conversations", dashboard['conversations'], "💬")
         with col3:
-            create_metric_card("Suggestions Used", "Coming Soon", "🎯")
+            create_metric_card("Suggestions Used", dashboard['suggestions'], "🎯")
         with col4:
-            create_metric_card("Days Active", "1", "📅")
-            
-    except Exception as e:
-        st.error(f"Failed to load metrics: {str(e)}")
+            create_metric_card("Days Active", dashboard['active_days'], "📅")
+    else:
+        st.error(f"Failed to load metrics: {dashboard_error}")
     
     # Quick actions section
     create_section_header("Quick Actions", "⚡")
@@ -95,59 +74,35 @@ def render():
     col1, col2 = st.columns(2)
     
     with col1:
-        try:
-            # Recent documents
-            kb_response = requests.get(
-                "http://34.60.140.141:8000/api/personal-kb/",
-                headers={"Authorization": f"Bearer {st.session_state.token}"}
+        if dashboard is None:
+            create_card("Recent Documents", f"Unable to load documents: {dashboard_error}", "❌")
+        elif dashboard['recent_documents']:
+            create_card(
+                "Recent Documents",
+                "".join([f"<p>📄 {doc['title']} ({doc['file_type']}) - {doc['uploaded_at'][:10]}</p>" for doc in dashboard['recent_documents']]),
+                "📚"
             )
-            if kb_response.status_code == 200:
-                recent_docs = kb_response.json()[:5]  # Last 5 documents
-                if recent_docs:
-                    create_card(
-                        "Recent Documents",
-                        "".join([f"<p>📄 {doc['title']} ({doc['file_type']}) - {doc['uploaded_at'][:10]}</p>" for doc in recent_docs]),
-                        "📚"
-                    )
-                else:
-                    create_card(
-                        "Recent Documents",
-                        "No documents uploaded yet. Start by uploading your first document!",
-                        "📚"
-                    )
-        except Exception as e:
+        else:
             create_card(
                 "Recent Documents",
-                f"Unable to load documents: {str(e)}",
-                "❌"
+                "No documents uploaded yet. Start by uploading your first document!",
+                "📚"
             )
     
     with col2:
-        try:
-            # Recent conversations
-            chat_response = requests.get(
-                "http://34.60.140.141:8000/api/chat/conversations/",
-                headers={"Authorization": f"Bearer {st.session_state.token}"}
+        if dashboard is None:
+            create_card("Recent Conversations", f"Unable to load conversations: {dashboard_error}", "❌")
+        elif dashboard['recent_conversations']:
+            create_card(
+                "Recent Conversations",
+                "".join([f"<p>💬 {chat.get('title', 'Untitled')} - {chat['started_at'][:10]}</p>" for chat in dashboard['recent_conversations']]),
+                "💬"
             )
-            if chat_response.status_code == 200:
-                recent_chats = chat_response.json()[:3]  # Last 3 conversations
-                if recent_chats:
-                    create_card(
-                        "Recent Conversations",
-                        "".join([f"<p>💬 {chat.get('title', 'Untitled')} - {chat['started_at'][:10]}</p>" for chat in recent_chats]),
-                        "💬"
-                    )
-                else:
-                    create_card(
-                        "Recent Conversations",
-                        "No conversations yet. Start your first AI chat!",
-                        "💬"
-                    )
-        except Exception as e:
+        else:
             create_card(
                 "Recent Conversations",
-                f"Unable to load conversations: {str(e)}",
-                "❌"
+                "No conversations yet. Start your first AI chat!",
+                "💬"
             )
     
     # Tips and insights section
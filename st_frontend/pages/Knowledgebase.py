@@ -1,9 +1,63 @@
 import streamlit as st
-import requests
+import api_client
 import json
 import os
 from theme import create_page_header, create_card, create_action_button, create_section_header
 
+# Seconds between status polls while uploaded documents are being ingested
+INGEST_POLL_SECONDS = float(os.getenv('INGEST_POLL_SECONDS', '2'))
+PENDING_STATUSES = ('queued', 'extracting', 'embedding', 'indexing')
+STATUS_LABELS = {
+    'queued': ('⏳ Queued', '#ffaa00'),
+    'extracting': ('📖 Extracting text', '#ffaa00'),
+    'embedding': ('🧠 Embedding', '#ffaa00'),
+    'indexing': ('🗂️ Indexing', '#ffaa00'),
+    'ready': ('✅ Processed', '#00ff88'),
+    'failed': ('❌ Failed', '#ff4444'),
+}
+
+def status_html(doc):
+    label, color = STATUS_LABELS.get(doc.get('ingest_status', 'ready'), STATUS_LABELS['ready'])
+    error = f" ({doc['ingest_error']})" if doc.get('ingest_error') else ''
+    return f'<span style="color: {color};">{label}{error}</span>'
+
+def fetch_ingest_status(kind, ids):
+    """Current ingestion status of documents by id; uncached, this is what the progress view polls."""
+    response = api_client.request('GET', f"/api/{kind}-kb/status/", params={'ids': ','.join(map(str, ids))})
+    return {s['id']: s for s in response.json()} if response.status_code == 200 else None
+
+@st.fragment(run_every=INGEST_POLL_SECONDS)
+def ingestion_progress(kind, documents):
+    """
+    Progress bars for documents ({'id', 'title'}) still being ingested. Only this fragment reruns
+    on each poll; once none is pending the whole page reruns to show their final state.
+    """
+    statuses = fetch_ingest_status(kind, [doc['id'] for doc in documents])
+    if statuses is None:
+        st.caption("Waiting for processing status...")
+        return
+    pending = False
+    for doc in documents:
+        current = statuses.get(doc['id'])
+        if current and current['ingest_status'] in PENDING_STATUSES:
+            pending = True
+            st.progress(current['ingest_progress'], text=f"{doc['title']}: {STATUS_LABELS[current['ingest_status']][0]}")
+    if not pending:
+        api_client.invalidate()
+        st.rerun()
+
+def upload_document(path, uploaded_file, fields):
+    """Stream uploaded_file to path with a progress bar; the backend answers 202 and ingests it in the background."""
+    bar = st.progress(0.0, text="Uploading...")
+    response = api_client.upload(
+        path,
+        uploaded_file,
+        fields,
+        on_progress=lambda fraction: bar.progress(fraction, text=f"Uploading... {fraction:.0%}")
+    )
+    bar.empty()
+    return response
+
 def render():
     create_page_header("Knowledgebase", "Manage your documents and search your knowledge", "📚")
     
@@ -46,23 +100,16 @@ def render():
             
             if create_action_button("Upload to Personal KB", "🚀", "upload_personal"):
                 try:
-                    with st.spinner("Uploading and processing document..."):
-                        files = {'file': uploaded_file}
-                        data = {
-                            'title': uploaded_file.name,
-                            'file_type': uploaded_file.name.split('.')[-1]
-                        }
-                        response = requests.post(
-                            "http://34.60.140.141:8000/api/personal-kb/",
-                            headers={"Authorization": f"Bearer {st.session_state.token}"},
-                            files=files,
-                            data=data
-                        )
-                        if response.status_code == 201:
-                            st.success("🎉 Document uploaded and processed successfully!")
-                            st.rerun()
-                        else:
-                            st.error("❌ Upload failed. Please try again.")
+                    response = upload_document(
+                        "/api/personal-kb/",
+                        uploaded_file,
+                        {'title': uploaded_file.name, 'file_type': uploaded_file.name.split('.')[-1]}
+                    )
+                    if response.status_code == 202:
+                        st.success("🎉 Document uploaded! It is being processed below; you can keep using the app meanwhile.")
+                        st.rerun()
+                    else:
+                        st.error("❌ Upload failed. Please try again.")
                 except Exception as e:
                     st.error(f"❌ Upload failed: {str(e)}")
         
@@ -70,12 +117,12 @@ def render():
         create_section_header("Your Documents", "📋")
         
         try:
-            response = requests.get(
-                "http://34.60.140.141:8000/api/personal-kb/",
-                headers={"Authorization": f"Bearer {st.session_state.token}"}
-            )
+            response = api_client.get("/api/personal-kb/")
             if response.status_code == 200:
                 documents = response.json()
+                pending = [doc for doc in documents if doc.get('ingest_status') in PENDING_STATUSES]
+                if pending:
+                    ingestion_progress('personal', [{'id': doc['id'], 'title': doc['title']} for doc in pending])
                 if documents:
                     for doc in documents:
                         create_card(
@@ -83,7 +130,7 @@ def render():
                             f"""
                             <p><strong>Type:</strong> {doc['file_type'].upper()}</p>
                             <p><strong>Uploaded:</strong> {doc['uploaded_at'][:10]}</p>
-                            <p><strong>Status:</strong> <span style="color: #00ff88;">✅ Processed</span></p>
+                            <p><strong>Status:</strong> {status_html(doc)}</p>
                             """,
                             "📄"
                         )
@@ -92,10 +139,7 @@ def render():
                         with col2:
                             if create_action_button("Delete", "🗑️", f"del_personal_{doc['id']}"):
                                 try:
-                                    del_response = requests.delete(
-                                        f"http://34.60.140.141:8000/api/personal-kb/{doc['id']}/",
-                                        headers={"Authorization": f"Bearer {st.session_state.token}"}
-                                    )
+                                    del_response = api_client.delete(f"/api/personal-kb/{doc['id']}/")
                                     if del_response.status_code == 204:
                                         st.success("🗑️ Document deleted successfully!")
                                         st.rerun()
@@ -129,9 +173,9 @@ def render():
             if search_query:
                 try:
                     with st.spinner("Searching your knowledgebase..."):
-                        response = requests.post(
-                            "http://34.60.140.141:8000/api/personal-kb/search/",
-                            headers={"Authorization": f"Bearer {st.session_state.token}"},
+                        response = api_client.post(
+                            "/api/personal-kb/search/",
+                            invalidates=False,
                             json={"query": search_query}
                         )
                         if response.status_code == 200:
@@ -162,12 +206,12 @@ def render():
         
         # List global documents (read-only for regular users)
         try:
-            response = requests.get(
-                "http://34.60.140.141:8000/api/global-kb/",
-                headers={"Authorization": f"Bearer {st.session_state.token}"}
-            )
+            response = api_client.get("/api/global-kb/")
             if response.status_code == 200:
                 documents = response.json()
+                pending = [doc for doc in documents if doc.get('ingest_status') in PENDING_STATUSES]
+                if pending:
+                    ingestion_progress('global', [{'id': doc['id'], 'title': doc['title']} for doc in pending])
                 if documents:
                     for doc in documents:
                         create_card(
@@ -175,6 +219,7 @@ def render():
                             f"""
                             <p><strong>Type:</strong> {doc['file_type'].upper()}</p>
                             <p><strong>Added:</strong> {doc['uploaded_at'][:10]}</p>
+                            <p><strong>Status:</strong> {status_html(doc)}</p>
                             <p><strong>Access:</strong> <span style="color: #ffaa00;">🌍 Global</span></p>
                             """,
                             "📄"
@@ -207,8 +252,9 @@ def render():
             if global_search_query:
                 try:
                     with st.spinner("Searching global knowledgebase..."):
-                        response = requests.post(
-                            "http://34.60.140.141:8000/api/global-kb/search/",
+                        response = api_client.post(
+                            "/api/global-kb/search/",
+                            invalidates=False,
                             json={"query": global_search_query}
                         )
                         if response.status_code == 200: